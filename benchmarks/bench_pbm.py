@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+bench_pbm -- time pbm on synthetic Bookmarks files
+
+For each ``--sizes`` url count, a Bookmarks file is generated (see
+:mod:`generate_bookmarks`; seeded, so runs are comparable) and these are
+timed (the best of ``--repeat`` runs; in seconds):
+
+* ``read_bookmarks``, ``iter_bookmarks``, ``walk_bookmarks``
+* ``plugins.<phase>``: each :class:`pbm.plugins.PluginSequence` phase
+  (see ``PluginSequence.timings``)
+* ``to_json`` and ``organize`` (the transforms and an atomic write)
+* ``web.<endpoint>``: pbmweb responses (rendered; and ``.cached``)
+
+Results are written as JSON (``-o``); with ``--baseline``, results are
+compared with an earlier results file and any benchmark slower by more
+than ``--threshold`` is flagged as a regression (exit status 1).
+
+.. code:: bash
+
+    python benchmarks/bench_pbm.py -s 10000,100000 -o before.json
+    python benchmarks/bench_pbm.py -s 10000,100000 -o after.json \\
+        --baseline before.json
+
+"""
+
+import collections
+import contextlib
+import datetime
+import json
+import logging
+import optparse
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import generate_bookmarks  # noqa
+import pbm.main  # noqa
+import pbm.plugins  # noqa
+
+log = logging.getLogger('bench_pbm')
+
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+DEFAULT_REPEAT = 3
+# flag benchmarks which are this fraction slower than the baseline
+DEFAULT_THRESHOLD = 0.10
+# (and at least this many seconds slower; to ignore timer noise)
+DEFAULT_MIN_SECONDS = 0.005
+
+# name, path
+WEB_ENDPOINTS = (
+    ('web.json', '/bookmarks/chrome/json'),
+    ('web.links.json', '/bookmarks/chrome/links.json'),
+    ('web.list', '/bookmarks/chrome/list'),
+    ('web.tree', '/bookmarks/chrome/tree'),
+    ('web.search', '/bookmarks/search?q=python+docs'),
+)
+
+ChromiumBookmarks = pbm.main.ChromiumBookmarks
+
+
+def best_of(func, repeat, setup=None):
+    """
+    Args:
+        func (callable): function to time (called with ``setup()``'s
+            return value, if ``setup`` is given)
+        repeat (int): number of runs
+
+    Keyword Arguments:
+        setup (callable): called (untimed) before each run
+
+    Returns:
+        float: the fastest run (seconds)
+    """
+    times = []
+    for _ in range(repeat):
+        args = (setup(),) if setup is not None else ()
+        start = time.time()
+        func(*args)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def bench_read(path, repeat):
+    """
+    Returns:
+        OrderedDict: name -> seconds
+    """
+    results = collections.OrderedDict()
+    results['read_bookmarks'] = best_of(
+        lambda: ChromiumBookmarks.read_bookmarks(path), repeat)
+    results['iter_bookmarks'] = best_of(
+        lambda: sum(1 for _ in ChromiumBookmarks.iter_bookmarks(path)),
+        repeat)
+    bookmarks_dict = ChromiumBookmarks.read_bookmarks(path)
+    roots = bookmarks_dict['roots']
+
+    def walk():
+        for key in ('bookmark_bar', 'other'):
+            for _ in ChromiumBookmarks.walk_bookmarks(roots[key]):
+                pass
+    results['walk_bookmarks'] = best_of(walk, repeat)
+    return results
+
+
+def bench_plugins(path, repeat):
+    """
+    Returns:
+        OrderedDict: ``plugins.<phase>`` -> seconds
+    """
+    results = collections.OrderedDict()
+    for _ in range(repeat):
+        cb = ChromiumBookmarks(path)
+        pluginseq = pbm.plugins.PluginSequence(conf={})
+        pluginseq.run(cb)
+        for phase, seconds in pluginseq.timings.items():
+            key = 'plugins.%s' % phase
+            results[key] = min(results.get(key, seconds), seconds)
+    return results
+
+
+def bench_write(path, repeat, tmpdir):
+    """
+    Returns:
+        OrderedDict: name -> seconds
+    """
+    results = collections.OrderedDict()
+    bookmarks_dict = ChromiumBookmarks.transform_bookmarks_dict(
+        bookmarks_path=path)
+    results['to_json'] = best_of(
+        lambda: ChromiumBookmarks._to_json(bookmarks_dict), repeat)
+
+    organize_path = os.path.join(tmpdir, 'Bookmarks.organize')
+
+    def setup():
+        # (the same input each time; not the output of the last run)
+        shutil.copy(path, organize_path)
+        return ChromiumBookmarks(organize_path)
+    results['organize'] = best_of(
+        lambda cb: cb.organize(prompt=False, keep_backups=1), repeat,
+        setup=setup)
+    return results
+
+
+@contextlib.contextmanager
+def nop_auth(username='bench'):
+    """
+    Skip pbmweb's login (as ``tests/test_app.py`` does)
+    """
+    import pbm.app
+    get_current_user = pbm.app.BaseHandler.get_current_user
+    pbm.app.BaseHandler.get_current_user = lambda self: {'name': username}
+    try:
+        yield
+    finally:
+        pbm.app.BaseHandler.get_current_user = get_current_user
+
+
+def bench_web(path, repeat):
+    """
+    Serve ``path`` with pbmweb (in this process) and time each of
+    :data:`WEB_ENDPOINTS`; rendered (with an empty response cache) and
+    ``.cached``
+
+    Returns:
+        OrderedDict: name -> seconds
+    """
+    import tornado.httpclient
+    import tornado.httpserver
+    import tornado.ioloop
+    import tornado.testing
+    import pbm.app
+
+    results = collections.OrderedDict()
+    io_loop = tornado.ioloop.IOLoop()
+    io_loop.make_current()
+    application = pbm.app.make_app({
+        'bookmarks_file': path,
+        'use_cache': False,
+        'watch_bookmarks_file': False,
+    })
+    sock, port = tornado.testing.bind_unused_port()
+    server = tornado.httpserver.HTTPServer(application)
+    server.add_sockets([sock])
+    client = tornado.httpclient.AsyncHTTPClient()
+
+    def fetch(url):
+        response = io_loop.run_sync(lambda: client.fetch(
+            'http://127.0.0.1:%d%s' % (port, url),
+            request_timeout=3600,
+            raise_error=False))
+        if response.code != 200:
+            raise Exception((url, response.code))
+        return response
+
+    def clear_cache():
+        response_cache = application.settings.get('response_cache')
+        if response_cache is not None:
+            application.settings['response_cache'] = pbm.app.ResponseCache(
+                max_bytes=response_cache.max_bytes,
+                encodings=response_cache.encodings,
+                compress_min_size=response_cache.compress_min_size)
+        application.settings.pop('search_indexes', None)
+
+    try:
+        with nop_auth():
+            for name, url in WEB_ENDPOINTS:
+                results[name] = best_of(lambda _: fetch(url), repeat,
+                                        setup=clear_cache)
+                results[name + '.cached'] = best_of(
+                    lambda: fetch(url), repeat)
+    finally:
+        client.close()
+        server.stop()
+        io_loop.close(all_fds=True)
+    return results
+
+
+BENCHMARK_GROUPS = collections.OrderedDict((
+    ('read', bench_read),
+    ('plugins', bench_plugins),
+    ('write', bench_write),
+    ('web', bench_web),
+))
+
+
+def run_benchmarks(sizes, repeat=DEFAULT_REPEAT, groups=None, tmpdir=None,
+                   generator_kwargs=None):
+    """
+    Args:
+        sizes (iterable[int]): url counts
+
+    Keyword Arguments:
+        repeat (int): runs of each benchmark (the fastest is kept)
+        groups (iterable[str]): :data:`BENCHMARK_GROUPS` to run
+            (default: all)
+        tmpdir (str): directory for the generated files (default: a new
+            temporary directory, which is removed)
+        generator_kwargs (dict): see
+            :func:`generate_bookmarks.generate_bookmarks_dict`
+
+    Returns:
+        OrderedDict: ``{"meta": {...}, "results": {size: {name: seconds}}}``
+    """
+    if groups is None:
+        groups = list(BENCHMARK_GROUPS)
+    if generator_kwargs is None:
+        generator_kwargs = {}
+    remove_tmpdir = tmpdir is None
+    if tmpdir is None:
+        tmpdir = tempfile.mkdtemp(prefix='bench_pbm')
+    results = collections.OrderedDict()
+    try:
+        for size in sizes:
+            path = os.path.join(tmpdir, 'Bookmarks.%d' % size)
+            generate_bookmarks.write_bookmarks(path, size,
+                                               **generator_kwargs)
+            size_results = results[str(size)] = collections.OrderedDict()
+            for group in groups:
+                func = BENCHMARK_GROUPS[group]
+                if group == 'write':
+                    group_results = func(path, repeat, tmpdir)
+                else:
+                    group_results = func(path, repeat)
+                size_results.update(group_results)
+                for name, seconds in group_results.items():
+                    log.info(('bench', size, name, seconds))
+    finally:
+        if remove_tmpdir:
+            shutil.rmtree(tmpdir)
+    return collections.OrderedDict((
+        ('meta', collections.OrderedDict((
+            ('created', datetime.datetime.utcnow().isoformat()),
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('repeat', repeat),
+            ('generator', generator_kwargs),
+        ))),
+        ('results', results),
+    ))
+
+
+Comparison = collections.namedtuple('Comparison', (
+    'size', 'name', 'baseline', 'current', 'ratio', 'regression'))
+
+
+def compare_results(results, baseline, threshold=DEFAULT_THRESHOLD,
+                    min_seconds=DEFAULT_MIN_SECONDS):
+    """
+    Args:
+        results (dict): see :func:`run_benchmarks`
+        baseline (dict): earlier results (see :func:`run_benchmarks`)
+
+    Keyword Arguments:
+        threshold (float): a benchmark is a regression if it is more than
+            this fraction slower than the baseline
+        min_seconds (float): ... and at least this many seconds slower
+
+    Returns:
+        list[Comparison]: benchmarks in both ``results`` and ``baseline``
+    """
+    comparisons = []
+    for size, size_results in results['results'].items():
+        baseline_results = baseline.get('results', {}).get(size, {})
+        for name, current in size_results.items():
+            before = baseline_results.get(name)
+            if before is None:
+                continue
+            ratio = current / before if before else float('inf')
+            regression = (current > before * (1 + threshold)
+                          and current - before >= min_seconds)
+            comparisons.append(Comparison(
+                size, name, before, current, ratio, regression))
+    return comparisons
+
+
+def format_results(results):
+    """
+    Yields:
+        str: one line for each benchmark
+    """
+    yield "%10s %-30s %12s" % ('size', 'benchmark', 'seconds')
+    for size, size_results in results['results'].items():
+        for name, seconds in size_results.items():
+            yield "%10s %-30s %12.4f" % (size, name, seconds)
+
+
+def format_comparisons(comparisons):
+    """
+    Yields:
+        str: one line for each comparison, and a summary line
+    """
+    yield "%10s %-30s %12s %12s %8s" % (
+        'size', 'benchmark', 'baseline', 'current', 'ratio')
+    regressions = 0
+    for c in comparisons:
+        regressions += c.regression
+        yield "%10s %-30s %12.4f %12.4f %7.2fx%s" % (
+            c.size, c.name, c.baseline, c.current, c.ratio,
+            '  REGRESSION' if c.regression else '')
+    yield "# %d benchmarks compared, %d regressions" % (
+        len(comparisons), regressions)
+
+
+def get_option_parser():
+    prs = optparse.OptionParser(
+        usage="%prog [-s SIZES] [-o RESULTS.json] [--baseline BASE.json]",
+        description="Benchmark pbm on synthetic Bookmarks files")
+    prs.add_option('-s', '--sizes', dest='sizes',
+                   default=','.join(str(x) for x in DEFAULT_SIZES),
+                   help="comma-separated url counts (default: %default)")
+    prs.add_option('-r', '--repeat', dest='repeat', type='int',
+                   default=DEFAULT_REPEAT,
+                   help="runs of each benchmark (default: %default)")
+    prs.add_option('-g', '--groups', dest='groups',
+                   default=','.join(BENCHMARK_GROUPS),
+                   help="comma-separated benchmark groups "
+                        "(default: %default)")
+    prs.add_option('-o', '--output', dest='output',
+                   help="path to write the results JSON to")
+    prs.add_option('--baseline', dest='baseline',
+                   help="results JSON to compare with")
+    prs.add_option('--threshold', dest='threshold', type='float',
+                   default=DEFAULT_THRESHOLD,
+                   help="regression threshold, as a fraction slower "
+                        "(default: %default)")
+    prs.add_option('--min-seconds', dest='min_seconds', type='float',
+                   default=DEFAULT_MIN_SECONDS,
+                   help="ignore differences smaller than this "
+                        "(default: %default)")
+    prs.add_option('--tmpdir', dest='tmpdir',
+                   help="directory for the generated Bookmarks files "
+                        "(default: a temporary directory)")
+    generate_bookmarks.add_generator_options(prs)
+    prs.add_option('-v', '--verbose', dest='verbose', action='store_true')
+    return prs
+
+
+def main(argv=None):
+    prs = get_option_parser()
+    (opts, args) = prs.parse_args(args=argv)
+    logging.basicConfig()
+    # (pbm.main logs at DEBUG, which would be timed)
+    level = logging.INFO if opts.verbose else logging.WARNING
+    logging.getLogger().setLevel(level)
+    pbm.main.log.setLevel(level)
+    sizes = [int(x) for x in opts.sizes.split(',') if x]
+    groups = [x for x in opts.groups.split(',') if x]
+    for group in groups:
+        if group not in BENCHMARK_GROUPS:
+            prs.error("Unknown benchmark group: %r" % group)
+
+    results = run_benchmarks(
+        sizes,
+        repeat=opts.repeat,
+        groups=groups,
+        tmpdir=opts.tmpdir,
+        generator_kwargs=generate_bookmarks.get_generator_kwargs(opts))
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    for line in format_results(results):
+        print(line)
+
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)
+        comparisons = compare_results(results, baseline,
+                                      threshold=opts.threshold,
+                                      min_seconds=opts.min_seconds)
+        print()
+        for line in format_comparisons(comparisons):
+            print(line)
+        if any(c.regression for c in comparisons):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(argv=sys.argv[1:]))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+bench_rdf_uri_escape -- microbenchmark pbm.app.rdf_uri_escape
+
+Compares the previous per-character generator implementation with
+:func:`pbm.app.rdf_uri_escape` on long ``data:`` and ``javascript:``
+URLs (:attr:`BookmarkletsFolderPlugin.default_bookmarklets`) and on
+plain http URLs; each URL is escaped twice, as the tree template does.
+
+.. code:: bash
+
+    python benchmarks/bench_rdf_uri_escape.py -n 20000
+
+"""
+
+import optparse
+import os
+import sys
+import timeit
+
+try:
+    import urllib.parse as urllib_parse
+except ImportError:  # pragma: no cover
+    import urllib as urllib_parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pbm.app  # noqa
+from pbm.plugins.bookmarkletsfolder import BookmarkletsFolderPlugin  # noqa
+
+
+def rdf_uri_escape_generator(url):
+    """
+    The previous implementation (for comparison)
+    """
+    def _quote_URI_chars(url):
+        for char in url:
+            if char in pbm.app.RDF_URI_QUOTECHARS_DICT:
+                yield urllib_parse.quote(char)
+            else:
+                yield char
+    return u''.join(_quote_URI_chars(url))
+
+
+def get_urls():
+    """
+    Returns:
+        list[tuple]: (label, url) pairs
+    """
+    urls = [(bookmarklet['name'], bookmarklet['url'])
+            for bookmarklet in BookmarkletsFolderPlugin.default_bookmarklets]
+    urls.append(('http', u'https://docs.python.org/2/library/re.html#re.sub'))
+    return urls
+
+
+def bench(func, url, number):
+    """
+    Returns:
+        float: microseconds per URL
+    """
+    def run():
+        func(url)
+        func(url)
+    return timeit.timeit(run, number=number) / (2.0 * number) * 1e6
+
+
+def main(argv=None):
+    prs = optparse.OptionParser(
+        usage="%prog [-n NUMBER]",
+        description="Benchmark pbm.app.rdf_uri_escape")
+    prs.add_option('-n', '--number', dest='number', type='int',
+                   default=20000,
+                   help="iterations per URL")
+    (opts, args) = prs.parse_args(args=argv)
+
+    print("%-18s %7s %12s %12s %8s" % (
+        'url', 'length', 'generator_us', 'current_us', 'speedup'))
+    for label, url in get_urls():
+        assert pbm.app.rdf_uri_escape(url) == rdf_uri_escape_generator(url)
+        before = bench(rdf_uri_escape_generator, url, opts.number)
+        after = bench(pbm.app.rdf_uri_escape, url, opts.number)
+        print("%-18s %7d %12.2f %12.2f %7.1fx" % (
+            label[:18], len(url), before, after, before / after))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(argv=sys.argv[1:]))
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+generate_bookmarks -- write a synthetic (seeded) Chromium Bookmarks file
+
+The same options (and ``--seed``) always generate the same file: folders
+``--depth`` levels deep with ``--fanout`` subfolders each (in the
+``bookmark_bar``; and a few in ``other``), and ``--count`` urls spread
+over them, with ``date_added`` values over ``--date-spread`` days.
+A ``--duplicate-rate`` fraction of the urls repeat an earlier url (as
+re-saved bookmarks do), and a ``--starred-ratio`` fraction end with one
+to three ``#`` (see :mod:`pbm.plugins.starred`).
+
+.. code:: bash
+
+    python benchmarks/generate_bookmarks.py -n 100000 -o /tmp/Bookmarks
+
+"""
+
+import codecs
+import collections
+import datetime
+import itertools
+import optparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pbm.serialize  # noqa
+import pbm.utils  # noqa
+
+
+DEFAULT_SEED = 0
+DEFAULT_DEPTH = 3
+DEFAULT_FANOUT = 6
+DEFAULT_DUPLICATE_RATE = 0.05
+DEFAULT_STARRED_RATIO = 0.02
+DEFAULT_DATE_START = datetime.datetime(2010, 1, 1)
+DEFAULT_DATE_SPREAD = 365 * 6
+
+WORDS = (
+    'python', 'bookmarks', 'chromium', 'json', 'tornado', 'jinja',
+    'docs', 'release', 'notes', 'api', 'guide', 'tutorial', 'search',
+    'data', 'science', 'web', 'http', 'cache', 'index', 'tree', 'graph',
+    'linked', 'rdf', 'schema', 'news', 'video', 'music', 'recipes',
+)
+
+DOMAINS = (
+    'example.org', 'example.com', 'docs.python.org', 'github.com',
+    'en.wikipedia.org', 'news.ycombinator.com', 'www.youtube.com',
+    'developer.mozilla.org', 'stackoverflow.com', 'wrdrd.github.io',
+)
+
+
+def datetime_to_longdate(dt):
+    """
+    Args:
+        dt (datetime): UTC datetime
+
+    Returns:
+        int: Chromium longdate (exactly; see :mod:`pbm.pagination`)
+    """
+    delta = dt - datetime.datetime(1970, 1, 1)
+    seconds = delta.days * 86400 + delta.seconds + pbm.utils.DATETIME_CONST
+    return seconds * 1000000 + delta.microseconds
+
+
+def _folder(id_, name, date_added):
+    return collections.OrderedDict((
+        ('children', []),
+        ('date_added', date_added),
+        ('date_modified', date_added),
+        ('id', str(id_)),
+        ('name', name),
+        ('type', 'folder'),
+    ))
+
+
+def generate_bookmarks_dict(count,
+                            depth=DEFAULT_DEPTH,
+                            fanout=DEFAULT_FANOUT,
+                            duplicate_rate=DEFAULT_DUPLICATE_RATE,
+                            starred_ratio=DEFAULT_STARRED_RATIO,
+                            date_start=DEFAULT_DATE_START,
+                            date_spread=DEFAULT_DATE_SPREAD,
+                            seed=DEFAULT_SEED):
+    """
+    Generate a Chromium Bookmarks JSON dict
+
+    Args:
+        count (int): number of urls
+
+    Keyword Arguments:
+        depth (int): folder levels below each root
+        fanout (int): subfolders per folder
+        duplicate_rate (float): fraction of urls which repeat an earlier
+            url (with a new name and date)
+        starred_ratio (float): fraction of urls ending with ``#``
+        date_start (datetime): earliest ``date_added``
+        date_spread (int): ``date_added`` values are spread over this
+            many days after ``date_start``
+        seed (int): random seed
+
+    Returns:
+        OrderedDict: Chromium Bookmarks JSON dict (without a ``checksum``)
+    """
+    rnd = random.Random(seed)
+    ids = itertools.count(1)
+    root_date = str(datetime_to_longdate(date_start))
+    roots = collections.OrderedDict()
+    for key, name in (('bookmark_bar', 'Bookmarks bar'),
+                      ('other', 'Other bookmarks'),
+                      ('synced', 'Mobile bookmarks')):
+        roots[key] = _folder(next(ids), name, root_date)
+
+    # bookmark_bar: depth levels of fanout subfolders; other: one level
+    folders = [roots['bookmark_bar'], roots['other']]
+    level = [roots['bookmark_bar']]
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            for _ in range(fanout):
+                folder = _folder(next(ids), ' '.join(rnd.sample(WORDS, 2)),
+                                 root_date)
+                parent['children'].append(folder)
+                next_level.append(folder)
+        folders.extend(next_level)
+        level = next_level
+    for _ in range(min(fanout, 3)):
+        folder = _folder(next(ids), rnd.choice(WORDS), root_date)
+        roots['other']['children'].append(folder)
+        folders.append(folder)
+
+    start = datetime_to_longdate(date_start)
+    spread = date_spread * 86400 * 1000000
+    urls = []
+    for i in range(count):
+        if urls and rnd.random() < duplicate_rate:
+            url = rnd.choice(urls)
+        else:
+            url = 'https://%s/%s/%d' % (
+                rnd.choice(DOMAINS), rnd.choice(WORDS), i)
+            if rnd.random() < starred_ratio:
+                url += '#' * rnd.randint(1, 3)
+            urls.append(url)
+        date_added = str(start + rnd.randint(0, spread))
+        rnd.choice(folders)['children'].append(collections.OrderedDict((
+            ('date_added', date_added),
+            ('id', str(next(ids))),
+            ('name', ' '.join(rnd.sample(WORDS, 3)).title()),
+            ('type', 'url'),
+            ('url', url),
+        )))
+    return collections.OrderedDict((
+        ('roots', roots),
+        ('version', 1),
+    ))
+
+
+def write_bookmarks(path, count, **kwargs):
+    """
+    Write a generated Bookmarks file (with Chromium's ``checksum``)
+
+    Args:
+        path (str): path to write to
+        count (int): number of urls
+
+    Keyword Arguments:
+        kwargs (dict): see :func:`generate_bookmarks_dict`
+
+    Returns:
+        pbm.serialize.SerializeStats: stats
+    """
+    bookmarks_dict = generate_bookmarks_dict(count, **kwargs)
+    with codecs.open(path, 'w', encoding='utf-8') as f:
+        return pbm.serialize.dump(bookmarks_dict, f, checksum=True)
+
+
+def get_option_parser():
+    prs = optparse.OptionParser(
+        usage="%prog -n COUNT -o PATH [options]",
+        description="Write a synthetic Chromium Bookmarks file")
+    prs.add_option('-n', '--count', dest='count', type='int',
+                   default=10000,
+                   help="number of urls (default: %default)")
+    prs.add_option('-o', '--output', dest='output',
+                   help="path to write the Bookmarks file to")
+    add_generator_options(prs)
+    return prs
+
+
+def add_generator_options(prs):
+    """
+    Add the :func:`generate_bookmarks_dict` options
+    (see :func:`get_generator_kwargs`)
+
+    Args:
+        prs (optparse.OptionParser): option parser
+    """
+    prs.add_option('--depth', dest='depth', type='int',
+                   default=DEFAULT_DEPTH,
+                   help="folder levels (default: %default)")
+    prs.add_option('--fanout', dest='fanout', type='int',
+                   default=DEFAULT_FANOUT,
+                   help="subfolders per folder (default: %default)")
+    prs.add_option('--duplicate-rate', dest='duplicate_rate', type='float',
+                   default=DEFAULT_DUPLICATE_RATE,
+                   help="fraction of repeated urls (default: %default)")
+    prs.add_option('--starred-ratio', dest='starred_ratio', type='float',
+                   default=DEFAULT_STARRED_RATIO,
+                   help="fraction of starred urls (default: %default)")
+    prs.add_option('--date-spread', dest='date_spread', type='int',
+                   default=DEFAULT_DATE_SPREAD,
+                   help="days of date_added values (default: %default)")
+    prs.add_option('--seed', dest='seed', type='int',
+                   default=DEFAULT_SEED,
+                   help="random seed (default: %default)")
+
+
+def get_generator_kwargs(opts):
+    """
+    Args:
+        opts (optparse.Values): options (see :func:`get_option_parser`)
+
+    Returns:
+        dict: :func:`generate_bookmarks_dict` keyword arguments
+    """
+    return dict(
+        depth=opts.depth,
+        fanout=opts.fanout,
+        duplicate_rate=opts.duplicate_rate,
+        starred_ratio=opts.starred_ratio,
+        date_spread=opts.date_spread,
+        seed=opts.seed)
+
+
+def main(argv=None):
+    prs = get_option_parser()
+    (opts, args) = prs.parse_args(args=argv)
+    if not opts.output:
+        prs.error("-o/--output is required")
+    stats = write_bookmarks(opts.output, opts.count,
+                            **get_generator_kwargs(opts))
+    print("# wrote %d urls to %s (checksum %s)" % (
+        opts.count, opts.output, stats.checksum))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(argv=sys.argv[1:]))
@@ -5,23 +5,342 @@ from __future__ import print_function
 pbm/app.py -- pbmweb
 """
 
+import collections
+import datetime
+import email.utils
+import gzip
+import hashlib
+import io
 import json
 import logging
 import os.path
+import re
 
+import jinja2
 import tornado
+import tornado.escape
+import tornado.gen
+import tornado.httputil
+import tornado.iostream
 import tornado.web
 import tornado.ioloop
 
-from jinja_tornado import JinjaApp, JinjaTemplateMixin
+from jinja_tornado import JinjaTemplateMixin
+from jinja_tornado.jinja_tornado import tojson_filter
 
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+import pbm.datasource
 import pbm.main
+import pbm.pagination
+import pbm.search
+import pbm.serialize
 import utils
 
 log = logging.getLogger('pbm.app')
 
 SECURE_USER_COOKIE_KEY = "user"
 
+DEFAULT_RESPONSE_CACHE_SIZE = 64 * 2**20  # bytes
+# don't cache larger response bodies (nor buffer more of a streamed one)
+DEFAULT_RESPONSE_CACHE_ENTRY_SIZE = 4 * 2**20  # bytes
+# don't compress smaller response bodies
+DEFAULT_COMPRESS_MIN_SIZE = 1024  # bytes
+
+
+def gzip_compress(body):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6,
+                       mtime=0) as f:
+        f.write(body)
+    return buf.getvalue()
+
+
+# Content-Encoding -> compress function (in order of preference)
+# (moderate levels: most of the size reduction, for a fraction of the CPU)
+COMPRESSORS = collections.OrderedDict()
+if brotli is not None:
+    COMPRESSORS['br'] = lambda body: brotli.compress(body, quality=5)
+if zstandard is not None:
+    COMPRESSORS['zstd'] = (
+        lambda body: zstandard.ZstdCompressor(level=3).compress(body))
+COMPRESSORS['gzip'] = gzip_compress
+
+
+def parse_accept_encoding(value):
+    """
+    Args:
+        value (str): an ``Accept-Encoding`` header value
+
+    Returns:
+        dict: encoding -> quality (e.g. ``{'gzip': 1.0, 'br': 0.0}``)
+    """
+    qualities = {}
+    for part in (value or '').split(','):
+        params = part.strip().split(';')
+        encoding = params[0].strip().lower()
+        if not encoding:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            name, _, param_value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(param_value)
+                except ValueError:
+                    quality = 0.0
+        qualities[encoding] = quality
+    return qualities
+
+
+class ResponseCacheEntry(
+    collections.namedtuple('ResponseCacheEntry', (
+        'body',
+        'etag',
+        'last_modified',
+        'content_type',
+        'encodings'))):
+
+    """
+    Attributes:
+        encodings (OrderedDict): Content-Encoding -> compressed ``body``
+            (in order of preference)
+    """
+
+    @property
+    def size(self):
+        """
+        Returns:
+            int: total size of ``body`` and its compressed representations
+        """
+        return len(self.body) + sum(len(x) for x in self.encodings.values())
+
+    def get_etag(self, encoding=None):
+        """
+        Returns:
+            str: the ETag of the ``encoding`` representation
+        """
+        if encoding is None:
+            return self.etag
+        return '%s-%s"' % (self.etag[:-1], encoding)
+
+
+class ResponseCache(object):
+
+    """
+    LRU cache of rendered response bodies, bounded by their total size
+
+    Bodies are compressed on an executor thread (not on the IOLoop);
+    an entry is served uncompressed until its encodings are ready.
+
+    Attributes:
+        max_bytes (int): maximum total size of the cached bodies
+        max_entry_bytes (int): maximum size of a cached body
+            (at most ``max_bytes``)
+        nbytes (int): current total size of the cached bodies
+        encodings (tuple[str]): Content-Encodings to precompress cached
+            bodies with (see :data:`COMPRESSORS`)
+        compress_min_size (int): don't compress smaller bodies
+        executor (concurrent.futures.Executor): executor to compress on
+            (default: the IOLoop's default executor)
+        entries (OrderedDict): key -> ResponseCacheEntry
+            (least recently used first)
+        pending (dict): key -> Future of a running :meth:`compress`
+        stats (Counter): ``hit``, ``miss``, ``evict``, ``compress``
+    """
+
+    def __init__(self, max_bytes=DEFAULT_RESPONSE_CACHE_SIZE,
+                 max_entry_bytes=DEFAULT_RESPONSE_CACHE_ENTRY_SIZE,
+                 encodings=None,
+                 compress_min_size=DEFAULT_COMPRESS_MIN_SIZE,
+                 executor=None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        if encodings is None:
+            encodings = tuple(COMPRESSORS)
+        self.encodings = tuple(x for x in COMPRESSORS if x in encodings)
+        self.compress_min_size = compress_min_size
+        self.executor = executor
+        self.nbytes = 0
+        self.entries = collections.OrderedDict()
+        self.pending = {}
+        self.stats = collections.Counter()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def make_entry(body, last_modified=None, content_type=None, etag=None):
+        """
+        Args:
+            body (str): response body (text is UTF-8 encoded)
+
+        Keyword Arguments:
+            last_modified (datetime): ``Last-Modified`` (UTC)
+            content_type (str): ``Content-Type`` (None for the default)
+            etag (str): ``ETag`` (default: a strong ETag; a digest of
+                ``body``)
+
+        Returns:
+            ResponseCacheEntry: a new entry
+        """
+        body = tornado.escape.utf8(body)
+        if etag is None:
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        return ResponseCacheEntry(body, etag, last_modified, content_type,
+                                  collections.OrderedDict())
+
+    def compress(self, body):
+        """
+        Args:
+            body (bytes): response body
+
+        Returns:
+            OrderedDict: Content-Encoding -> compressed ``body`` (for each
+            of :attr:`encodings` which makes ``body`` smaller)
+        """
+        encodings = collections.OrderedDict()
+        if len(body) < self.compress_min_size:
+            return encodings
+        for encoding in self.encodings:
+            compressed = COMPRESSORS[encoding](body)
+            if len(compressed) < len(body):
+                encodings[encoding] = compressed
+        return encodings
+
+    @staticmethod
+    def make_key_etag(key):
+        """
+        Args:
+            key (tuple): cache key (see
+                :meth:`BookmarksBaseHandler.get_response_cache_key`)
+
+        Returns:
+            str: a weak ETag for ``key`` (for a response which is streamed
+            before its digest is known)
+        """
+        return 'W/"%s"' % hashlib.sha1(
+            tornado.escape.utf8(repr(key))).hexdigest()
+
+    def get(self, key):
+        """
+        Returns:
+            ResponseCacheEntry or None: the cached entry for ``key``
+            (which becomes the most recently used)
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.stats['miss'] += 1
+            return None
+        self.entries[key] = entry
+        self.stats['hit'] += 1
+        return entry
+
+    def set(self, key, body, last_modified=None, content_type=None,
+            etag=None):
+        """
+        Cache a response body, evicting least recently used entries;
+        and start compressing it on the executor (see
+        :meth:`compress_later`)
+
+        Args:
+            key (tuple): cache key
+            body (str): response body
+
+        Keyword Arguments:
+            last_modified (datetime): ``Last-Modified`` (UTC)
+            content_type (str): ``Content-Type``
+            etag (str): ``ETag`` (default: see :meth:`make_entry`)
+
+        Returns:
+            ResponseCacheEntry: the new entry (which is not cached if
+            it is larger than ``max_entry_bytes``)
+        """
+        entry = self.make_entry(body, last_modified=last_modified,
+                                content_type=content_type, etag=etag)
+        self.pop(key)
+        size = entry.size
+        if size > self.max_entry_bytes:
+            return entry
+        self.evict(self.max_bytes - size)
+        self.entries[key] = entry
+        self.nbytes += size
+        self.compress_later(key, entry)
+        return entry
+
+    def compress_later(self, key, entry):
+        """
+        Compress ``entry.body`` on the executor; then add the encodings
+        to ``entry`` (if it is still cached for ``key``)
+
+        Returns:
+            Future or None: the running compression (None if the body
+            is not compressed)
+        """
+        if not self.encodings or len(entry.body) < self.compress_min_size:
+            return None
+        io_loop = tornado.ioloop.IOLoop.current()
+        future = io_loop.run_in_executor(self.executor, self.compress,
+                                         entry.body)
+        self.pending[key] = future
+
+        def on_compressed(future):
+            if self.pending.get(key) is future:
+                del self.pending[key]
+            if future.exception() is not None:
+                log.error(('response_cache.compress_error', key,
+                           future.exception()))
+                return
+            encodings = future.result()
+            size = entry.size + sum(len(x) for x in encodings.values())
+            if (self.entries.get(key) is not entry
+                    or size > self.max_entry_bytes):
+                return
+            self.pop(key)
+            entry.encodings.update(encodings)
+            self.evict(self.max_bytes - size)
+            self.entries[key] = entry
+            self.nbytes += size
+            self.stats['compress'] += 1
+
+        io_loop.add_future(future, on_compressed)
+        return future
+
+    def join(self):
+        """
+        Returns:
+            Future: resolves when the running compressions are done
+        """
+        return tornado.gen.multi(list(self.pending.values()))
+
+    def evict(self, max_bytes):
+        """
+        Evict least recently used entries until at most ``max_bytes``
+        are cached
+        """
+        while self.entries and self.nbytes > max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= evicted.size
+            self.stats['evict'] += 1
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry.size
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
 
 class BaseHandler(tornado.web.RequestHandler):
 
@@ -29,7 +348,10 @@ class BaseHandler(tornado.web.RequestHandler):
         return self.get_secure_cookie(SECURE_USER_COOKIE_KEY)
 
 class BaseHandlerJinja(JinjaTemplateMixin, BaseHandler):
-    pass
+
+    def xsrf_form_html(self):
+        # the shared template environment autoescapes (see init_jinja)
+        return jinja2.Markup(super(BaseHandlerJinja, self).xsrf_form_html())
 
 
 class MainHandler(BaseHandlerJinja):
@@ -141,6 +463,80 @@ class LogoutHandler(BaseHandler):
         self.redirect("/")
 
 
+def get_datasource(settings, bookmarks_file, start=None):
+    """
+    Get (or create and start) the shared data source for a Bookmarks file
+
+    Args:
+        settings (dict): application settings
+        bookmarks_file (str): path to a Chromium Bookmarks JSON file
+
+    Keyword Arguments:
+        start (bool): start watching a new data source
+            (default: ``settings['watch_bookmarks_file']``)
+
+    Returns:
+        pbm.datasource.BookmarksDataSource: the shared data source
+    """
+    datasources = settings.setdefault('datasources', {})
+    key = os.path.abspath(bookmarks_file)
+    datasource = datasources.get(key)
+    if datasource is None:
+        datasource = datasources[key] = pbm.datasource.BookmarksDataSource(
+            bookmarks_file,
+            use_cache=settings.get('use_cache'),
+            poll_interval=settings.get(
+                'watch_interval', pbm.datasource.DEFAULT_POLL_INTERVAL))
+        # rebuild a requested search index when the file is reloaded
+        search_indexes = settings.setdefault('search_indexes', {})
+        datasource.add_callback(
+            lambda cb: get_search_index(search_indexes, cb, refresh=True))
+        if start is None:
+            start = settings.get('watch_bookmarks_file')
+        if start:
+            datasource.start()
+    return datasource
+
+
+def get_search_index(search_indexes, cb, refresh=False):
+    """
+    Get the search index of a bookmarks snapshot; building it (once for
+    each snapshot) on the IOLoop's executor
+
+    Args:
+        search_indexes (dict): ``settings['search_indexes']``
+            (bookmarks file path -> (snapshot, version, Future))
+        cb (pbm.main.ChromiumBookmarks): a snapshot (see
+            :func:`get_datasource`)
+
+    Keyword Arguments:
+        refresh (bool): only build an index if one was built for an
+            earlier snapshot of the file (e.g. from a reload callback)
+
+    Returns:
+        Future or None: the :class:`pbm.search.SearchIndex`
+        (see :meth:`pbm.main.ChromiumBookmarks.get_search_index`)
+    """
+    key = os.path.abspath(cb.bookmarks_path)
+    entry = search_indexes.get(key)
+    if entry is not None and entry[0] is cb and entry[1] == cb.version:
+        return entry[2]
+    if refresh and entry is None:
+        return None
+    io_loop = tornado.ioloop.IOLoop.current()
+    future = io_loop.run_in_executor(None, cb.get_search_index)
+    search_indexes[key] = (cb, cb.version, future)
+
+    def on_built(future):
+        if future.exception() is not None:
+            log.error(('search_index.error', key, future.exception()))
+            if search_indexes.get(key, (None, None, None))[2] is future:
+                del search_indexes[key]
+
+    io_loop.add_future(future, on_built)
+    return future
+
+
 class BookmarksBaseHandler(BaseHandler):
 
     def initialize(self,
@@ -148,15 +544,257 @@ class BookmarksBaseHandler(BaseHandler):
                    HTTP_ACCESS_CONTROL_ALLOW_ORIGIN=None):
         if bookmarks_file is None:
             bookmarks_file = self.settings['bookmarks_file']
-            self.cb = self.settings['cb']
-        else:
-            self.cb = pbm.main.ChromiumBookmarks(bookmarks_file)
+        self.cb = get_datasource(self.settings, bookmarks_file).cb
 
         if HTTP_ACCESS_CONTROL_ALLOW_ORIGIN:
             # HTTP CORS
             self.set_header('Access-Control-Allow-Origin',
                             HTTP_ACCESS_CONTROL_ALLOW_ORIGIN)
 
+    def get_response_cache_key(self, *args):
+        """
+        Args:
+            args (tuple): response parameters (e.g. query arguments)
+
+        Returns:
+            tuple or None: a key for this handler and the current bookmarks
+            data version (None if the data has no file version)
+        """
+        if self.cb.source_key is None:
+            return None
+        return ((self.__class__.__name__, self.cb.source_key,
+                 self.cb.version) + args)
+
+    def check_modified_since(self, last_modified):
+        """
+        Returns:
+            bool: True if the request's ``If-Modified-Since`` is not
+            before ``last_modified`` (and a 304 should be returned)
+        """
+        value = self.request.headers.get('If-Modified-Since')
+        if not value or last_modified is None:
+            return False
+        date_tuple = email.utils.parsedate(value)
+        if date_tuple is None:
+            return False
+        if_since = datetime.datetime(*date_tuple[:6])
+        return if_since >= last_modified.replace(microsecond=0)
+
+    def get_last_modified(self):
+        """
+        Returns:
+            datetime or None: the bookmarks file's mtime (UTC)
+        """
+        if self.cb.source_mtime is None:
+            return None
+        return datetime.datetime.utcfromtimestamp(self.cb.source_mtime)
+
+    def set_cache_headers(self, etag, last_modified=None, content_type=None):
+        """
+        Set the ``ETag``, ``Last-Modified``, ``Content-Type``, and
+        ``Vary`` (if responses are precompressed) headers
+
+        Returns:
+            bool: True if the request is conditional and matches
+            (and a 304 should be returned)
+        """
+        response_cache = self.settings.get('response_cache')
+        if response_cache is not None and response_cache.encodings:
+            self.set_header('Vary', 'Accept-Encoding')
+        self.set_header('Etag', etag)
+        if last_modified is not None:
+            self.set_header('Last-Modified', last_modified)
+        if content_type is not None:
+            self.set_header('Content-Type', content_type)
+        if self.request.headers.get('If-None-Match') is not None:
+            return self.check_etag_header()
+        return self.check_modified_since(last_modified)
+
+    def select_encoding(self, encodings):
+        """
+        Args:
+            encodings (iterable[str]): available Content-Encodings
+                (in order of preference)
+
+        Returns:
+            str or None: the first of ``encodings`` which the request's
+            ``Accept-Encoding`` accepts (None for no encoding)
+        """
+        accept = parse_accept_encoding(
+            self.request.headers.get('Accept-Encoding'))
+        for encoding in encodings:
+            if accept.get(encoding, accept.get('*', 0)) > 0:
+                return encoding
+        return None
+
+    def write_entry(self, entry):
+        """
+        Write a :class:`ResponseCacheEntry` (or a 304), precompressed if
+        the request accepts one of its encodings
+        """
+        encoding = self.select_encoding(entry.encodings)
+        if self.set_cache_headers(entry.get_etag(encoding),
+                                  last_modified=entry.last_modified,
+                                  content_type=entry.content_type):
+            self.set_status(304)
+            return
+        if encoding is None:
+            self.write(entry.body)
+            return
+        self.set_header('Content-Encoding', encoding)
+        self.write(entry.encodings[encoding])
+
+    def write_cached(self, render, args=(), content_type=None):
+        """
+        Write a rendered response from the response cache (rendering it
+        on a miss), with ``ETag`` and ``Last-Modified`` headers;
+        or a 304 for a matching conditional request
+
+        Args:
+            render (callable): returns the response body
+
+        Keyword Arguments:
+            args (tuple): response parameters (see
+                :meth:`get_response_cache_key`)
+            content_type (str): ``Content-Type`` (None for the default)
+        """
+        response_cache = self.settings.get('response_cache')
+        key = self.get_response_cache_key(*args)
+        entry = None
+        if response_cache is not None and key is not None:
+            entry = response_cache.get(key)
+        if entry is None:
+            last_modified = self.get_last_modified()
+            if response_cache is not None and key is not None:
+                entry = response_cache.set(key, render(),
+                                           last_modified=last_modified,
+                                           content_type=content_type)
+            else:
+                entry = ResponseCache.make_entry(
+                    render(), last_modified=last_modified,
+                    content_type=content_type)
+        self.write_entry(entry)
+
+    @tornado.gen.coroutine
+    def write_streamed(self, generate, args=(), content_type=None):
+        """
+        Stream a rendered response, flushing each chunk (so the IOLoop
+        serves other requests between chunks, and the client can start
+        rendering the first chunk); or write it from the response cache;
+        or a 304 for a matching conditional request
+
+        A streamed response has a weak ``ETag`` for its cache key (see
+        :meth:`ResponseCache.make_key_etag`), so a conditional request is
+        answered without rendering. The streamed chunks are kept for the
+        response cache until they exceed its ``max_entry_bytes`` (so a
+        large response is not buffered in memory).
+
+        Args:
+            generate (callable): returns an iterable of body chunks
+
+        Keyword Arguments:
+            args (tuple): response parameters (see
+                :meth:`get_response_cache_key`)
+            content_type (str): ``Content-Type`` (None for the default)
+        """
+        response_cache = self.settings.get('response_cache')
+        key = self.get_response_cache_key(*args)
+        last_modified = None
+        buf = None
+        if key is not None:
+            if response_cache is not None:
+                entry = response_cache.get(key)
+                if entry is not None:
+                    self.write_entry(entry)
+                    return
+                buf = []
+            last_modified = self.get_last_modified()
+            if self.set_cache_headers(ResponseCache.make_key_etag(key),
+                                      last_modified=last_modified,
+                                      content_type=content_type):
+                self.set_status(304)
+                return
+        elif content_type is not None:
+            self.set_header('Content-Type', content_type)
+        size = 0
+        for chunk in generate():
+            chunk = tornado.escape.utf8(chunk)
+            if buf is not None:
+                size += len(chunk)
+                if size > response_cache.max_entry_bytes:
+                    buf = None
+                else:
+                    buf.append(chunk)
+            self.write(chunk)
+            try:
+                yield self.flush()
+            except tornado.iostream.StreamClosedError:
+                log.debug(('write_streamed.closed', self.request.uri))
+                return
+        if buf is not None:
+            response_cache.set(key, b''.join(buf),
+                               last_modified=last_modified,
+                               content_type=content_type,
+                               etag=ResponseCache.make_key_etag(key))
+
+    def get_page(self):
+        """
+        Get the requested page of urls, for the ``limit``, ``after``
+        (a cursor), ``since`` (a date), and ``order`` query arguments
+        (see :meth:`pbm.pagination.PageIndex.page`); and set a
+        ``Link: <...>; rel="next"`` header for the next page
+
+        Raises:
+            tornado.web.HTTPError: 400 for an invalid query argument
+
+        Returns:
+            tuple: (:class:`pbm.pagination.Page` or None (if no
+            pagination arguments were given), the next page URL or None,
+            the pagination arguments (for :meth:`get_response_cache_key`))
+        """
+        args = collections.OrderedDict(
+            (name, self.get_query_argument(name, None))
+            for name in ('limit', 'after', 'since', 'order'))
+        if not any(args.values()):
+            return None, None, ()
+        limit = args['limit']
+        try:
+            limit = int(limit) if limit else (
+                pbm.pagination.DEFAULT_PAGE_LIMIT)
+            if not 0 < limit <= pbm.pagination.MAX_PAGE_LIMIT:
+                raise ValueError
+        except ValueError:
+            raise tornado.web.HTTPError(
+                400, "limit must be an integer from 1 to %d" % (
+                    pbm.pagination.MAX_PAGE_LIMIT))
+        since = args['since']
+        try:
+            since = pbm.pagination.parse_since(since) if since else None
+        except ValueError:
+            raise tornado.web.HTTPError(400, "since must be a date")
+        order = args['order'] or ('tree' if since is None else '-date')
+        try:
+            page = self.cb.get_page_index().page(
+                limit=limit, after=args['after'] or None, since=since,
+                order=order)
+        except KeyError:
+            raise tornado.web.HTTPError(400, "after must be a page cursor")
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, str(e))
+        next_url = None
+        if page.next_after is not None:
+            params = [(name, value) for (name, value) in args.items()
+                      if value and name != 'after']
+            params.append(('after', page.next_after))
+            next_url = tornado.httputil.url_concat(self.request.path,
+                                                   params)
+            self.set_header('Link', '<%s>; rel="next"' % next_url)
+        return page, next_url, (limit, args['after'], since, order)
+
+    def get_stream_chunk_size(self):
+        return self.settings.get('stream_chunk_size',
+                                 utils.DEFAULT_CHUNK_SIZE)
+
 
 class BookmarksJSONHandler(BookmarksBaseHandler):
 
@@ -172,74 +810,143 @@ class BookmarksJSONHandler(BookmarksBaseHandler):
                 indent = None
 
         if not indent:
-            self.write(self.cb.bookmarks_dict)
+            self.write_cached(
+                lambda: tornado.escape.json_encode(self.cb.bookmarks_dict),
+                content_type='application/json; charset=UTF-8')
         else:
-            self.set_header('content-type', 'application/json')
-            self.write(json.dumps(self.cb.bookmarks_dict, indent=indent))
+            self.write_cached(
+                lambda: pbm.serialize.dumps(self.cb.bookmarks_dict,
+                                            indent=indent),
+                args=(indent,),
+                content_type='application/json')
 
 
 class BookmarksLinksJSONHandler(BookmarksBaseHandler):
 
     @tornado.web.authenticated
     def get(self):
-        bookmark_urls = [b.get('url') for b in iter(self.cb)]
-        self.write(tornado.escape.json_encode(bookmark_urls))
-        self.set_header('content-type', 'application/json')
+        page, _, args = self.get_page()
+        urls = iter(self.cb) if page is None else page.urls
+        self.write_cached(
+            lambda: tornado.escape.json_encode(
+                [b.get('url') for b in urls]),
+            args=args,
+            content_type='application/json')
+
+
+class BookmarksSearchHandler(BookmarksBaseHandler):
+
+    @tornado.web.authenticated
+    @tornado.gen.coroutine
+    def get(self):
+        query = self.get_query_argument('q', u'')
+        limit = self.get_query_argument('limit', None)
+        try:
+            limit = int(limit) if limit else (
+                pbm.search.DEFAULT_RESULT_LIMIT)
+            if not 0 < limit <= pbm.search.MAX_RESULT_LIMIT:
+                raise ValueError
+        except ValueError:
+            raise tornado.web.HTTPError(
+                400, "limit must be an integer from 1 to %d" % (
+                    pbm.search.MAX_RESULT_LIMIT))
+        results = []
+        if query:
+            index = yield get_search_index(
+                self.settings.setdefault('search_indexes', {}), self.cb)
+            results = index.search(query, limit=limit)
+        self.write({'query': query, 'results': results})
 
 
 class BookmarksListHandler(BookmarksBaseHandler):
     template_path = 'bookmarks_list_partial.jinja'
 
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def get(self):
-        t = utils.get_template(self.template_path)
-        htmlstr = t.render({
+        page, next_url, args = self.get_page()
+        yield self.write_streamed(
+            lambda: self.generate_list(page=page, next_url=next_url),
+            args=args)
+
+    def generate_list(self, page=None, next_url=None):
+        return utils.generate_template(self.template_path, {
             'bookmarks': self.cb,
-            'bookmarks_iter': iter(self.cb)})
-        self.write(htmlstr)
+            'bookmarks_iter': iter(self.cb) if page is None else page.urls,
+            'next_url': next_url},
+            chunk_size=self.get_stream_chunk_size())
 
 
 def format_longdate(longdate):
-    if longdate:
-        return pbm.utils.longdate_to_datetime(longdate).isoformat() + "Z"
-    return longdate
-
-
-import urllib
+    """
+    Returns:
+        str: ISO 8601 UTC datetime (see
+        :func:`pbm.utils.longdates_to_isoformat`); or ``longdate`` if it
+        is empty
+    """
+    return utils.longdates_to_isoformat((longdate,))[0]
 
 
 def build_rdf_uri_quotechars_dict():
-    quotechars = [chr(n) for n in xrange(0x0, 0x20)]
+    """
+    Returns:
+        dict: char -> percent-encoded char, for the chars which are not
+        allowed in an RDF URI reference (controls, space, ``<>"{}|^`\\``)
+    """
+    quotechars = [chr(n) for n in range(0x0, 0x20)]
     quotechars += [c for c in """ <>"{}|^`\\"""]
-    return dict.fromkeys(quotechars)
+    return dict((c, '%%%02X' % ord(c)) for c in quotechars)
 
 
 RDF_URI_QUOTECHARS_DICT = build_rdf_uri_quotechars_dict()
+RDF_URI_QUOTECHARS_RGX = re.compile(
+    u'[%s]' % u''.join(re.escape(c) for c in sorted(RDF_URI_QUOTECHARS_DICT)))
+RDF_URI_ESCAPE_CACHE_SIZE = 4096
+
+
+def _rdf_uri_quotechar(match):
+    return RDF_URI_QUOTECHARS_DICT[match.group()]
+
+
+@utils.lru_cache(maxsize=RDF_URI_ESCAPE_CACHE_SIZE)
+def _rdf_uri_escape(url):
+    return RDF_URI_QUOTECHARS_RGX.sub(_rdf_uri_quotechar, url)
 
 
 def rdf_uri_escape(url):
+    """
+    Percent-encode the chars which are not allowed in an RDF URI
+    reference (see :data:`RDF_URI_QUOTECHARS_DICT`)
 
-    def _quote_URI_chars(url):
-        for char in url:
-            if char in RDF_URI_QUOTECHARS_DICT:
-                yield urllib.quote(char)
-            else:
-                yield char
-    return u''.join(_quote_URI_chars(url))
+    URLs which need escaping (e.g. ``data:`` and ``javascript:`` URLs)
+    are memoized (the tree template escapes each URL twice).
+
+    Args:
+        url (str): URL
+
+    Returns:
+        str: escaped URL
+    """
+    if RDF_URI_QUOTECHARS_RGX.search(url) is None:
+        return url
+    return _rdf_uri_escape(url)
 
 
 class BookmarksTreeHandler(BookmarksBaseHandler):
     template_path = 'bookmarks_tree_partial.jinja'
 
     @tornado.web.authenticated
+    @tornado.gen.coroutine
     def get(self):
-        t = utils.get_template(self.template_path)
-        htmlstr = t.render({
+        yield self.write_streamed(self.generate_tree)
+
+    def generate_tree(self):
+        return utils.generate_template(self.template_path, {
             'bookmarks': self.cb,
             'bookmarks_iter': iter(self.cb),
-            'format_longdate': format_longdate,
-            'rdf_uri_escape': rdf_uri_escape})
-        self.write(htmlstr)
+            'longdate_isoformats': self.cb.get_longdate_isoformats(),
+            'rdf_uri_escape': rdf_uri_escape},
+            chunk_size=self.get_stream_chunk_size())
 
 
 class BookmarksHandler(BaseHandler):
@@ -275,18 +982,43 @@ def make_app(config=None, DEFAULT_COOKIE_SECRET="."):
         'bookmarks_file': os.path.join(
             os.path.dirname(__file__), '..', 'tests', 'data', 'Bookmarks'),
 
-        # jinja2 (jinja_tornado)
-        'template_path': os.path.join(
-            os.path.dirname(__file__), 'templates'),
-        'auto_reload': True,  # TODO: DEBUG
-        'cache_size': 50,
-        'autoescape': True
+        # jinja2 (jinja_tornado; see init_jinja)
+        'template_path': utils.TEMPLATES_PATH,
+        'autoescape': True,
+        # compile all templates at startup (default: unless autoreload
+        # or debug)
+        'precompile_templates': None,
+
+        # load bookmarks_file from the parse cache (see pbm.cache)
+        'use_cache': True,
+        # max total size of cached rendered responses (0 to disable)
+        'response_cache_size': DEFAULT_RESPONSE_CACHE_SIZE,
+        # max size of a cached (or buffered streamed) response
+        'response_cache_entry_size': DEFAULT_RESPONSE_CACHE_ENTRY_SIZE,
+        # precompress cached responses with these Content-Encodings
+        # (default: gzip, and br and zstd if installed)
+        'response_encodings': None,
+        'compress_min_size': DEFAULT_COMPRESS_MIN_SIZE,
+        # flush streamed HTML responses in chunks of this many characters
+        'stream_chunk_size': utils.DEFAULT_CHUNK_SIZE,
+        # reload bookmarks files when they change (see start_watching)
+        'watch_bookmarks_file': True,
+        'watch_interval': pbm.datasource.DEFAULT_POLL_INTERVAL,
     })
     if config is not None:
         _conf.update(config)
 
-    _conf['cb'] = pbm.main.ChromiumBookmarks(
-        _conf['bookmarks_file'])
+    if _conf['response_cache_size']:
+        _conf['response_cache'] = ResponseCache(
+            max_bytes=_conf['response_cache_size'],
+            max_entry_bytes=_conf['response_cache_entry_size'],
+            encodings=_conf['response_encodings'],
+            compress_min_size=_conf['compress_min_size'])
+
+    # (not started until start_watching; e.g. after forking)
+    datasource = get_datasource(_conf, _conf['bookmarks_file'], start=False)
+    _conf['datasource'] = datasource
+    _conf['cb'] = datasource.cb
 
     application = tornado.web.Application([
         (r"/", MainHandler),
@@ -298,15 +1030,66 @@ def make_app(config=None, DEFAULT_COOKIE_SECRET="."):
         (r"/bookmarks/chrome", BookmarksHandler),
         (r"/bookmarks/chrome/json", BookmarksJSONHandler),
         (r"/bookmarks/chrome/links.json", BookmarksLinksJSONHandler),
+        (r"/bookmarks/search", BookmarksSearchHandler),
         (r"/bookmarks/chrome/list", BookmarksListHandler),
         (r"/bookmarks/chrome/tree", BookmarksTreeHandler),
     ], **_conf)
 
-    environment = JinjaApp.init_app(application)  # jinja_tornado
+    environment = init_jinja(application)  # jinja_tornado
+
+    # keep settings['cb'] current
+    datasource.add_callback(
+        lambda cb: application.settings.__setitem__('cb', cb))
 
     return application
 
 
+def init_jinja(application):
+    """
+    Share the process-wide template environment
+    (:func:`pbm.utils.get_environment`) with the jinja_tornado handlers;
+    and, in production (without autoreload or debug), compile all of the
+    templates now rather than on the first requests
+
+    Args:
+        application (tornado.web.Application): see :func:`make_app`
+
+    Returns:
+        jinja2.Environment: the shared environment
+    """
+    settings = application.settings
+    debug = bool(settings.get('autoreload') or settings.get('debug'))
+    environment = utils.get_environment(auto_reload=debug)
+    environment.filters.update(
+        tojson=tojson_filter,
+        xhtml_escape=tornado.escape.xhtml_escape,
+        url_escape=tornado.escape.url_escape,
+        squeeze=tornado.escape.squeeze,
+        linkify=tornado.escape.linkify)
+    application.jinja_environment = environment
+    settings['jinja_environment'] = environment
+    precompile = settings.get('precompile_templates')
+    if precompile is None:
+        precompile = not debug
+    if precompile:
+        utils.precompile_templates(environment)
+    return environment
+
+
+def start_watching(application):
+    """
+    Start watching the application's bookmarks files
+    (call this in each server process; after forking)
+
+    Args:
+        application (tornado.web.Application): see :func:`make_app`
+    """
+    if not application.settings.get('watch_bookmarks_file'):
+        return
+    for datasource in application.settings['datasources'].values():
+        datasource.start()
+
+
 import unittest
 
 
@@ -366,6 +1149,11 @@ def main(argv=None):
                    dest='debug',
                    action='store_true')
 
+    prs.add_option('--no-watch',
+                   dest='no_watch',
+                   action='store_true',
+                   help='Do not reload the bookmarks file when it changes')
+
     prs.add_option('-v', '--verbose',
                    dest='verbose',
                    action='store_true',)
@@ -403,6 +1191,8 @@ def main(argv=None):
         n_procs = 1
     if opts.open_browser:
         conf['open_browser'] = True
+    if opts.no_watch:
+        conf['watch_bookmarks_file'] = False
     app = make_app(conf)
 
     import tornado.httpserver
@@ -414,6 +1204,7 @@ def main(argv=None):
         server = tornado.httpserver.HTTPServer(app)
         server.bind(opts.port, address=opts.host)
         server.start(n_procs)  # forks one process per cpu
+        start_watching(app)
 
         if conf.get('open_browser', None) is not None:
             import subprocess
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+pbm/cache.py -- persistent parse cache for Bookmarks JSON files
+
+Each Bookmarks file is cached as a :mod:`marshal`-ed
+:class:`pbm.store.BookmarkStore` (array columns as bytes) under
+``$XDG_CACHE_HOME/pbm`` (default: ``~/.cache/pbm``), keyed on the file's
+path, size, mtime, and inode; so an unchanged file is not re-parsed.
+
+State which pbm keeps about a Bookmarks file between runs (e.g. folder
+digests, see :mod:`pbm.merkle`) is kept there too (as JSON), rather
+than in the file: Chromium syncs the file's ``meta_info`` to every
+device.
+
+.. code:: python
+
+    store = load_store('./path/to/Bookmarks')  # parse and save, or load
+    update_state('./path/to/Bookmarks', merkle={})
+    load_state('./path/to/Bookmarks').get('merkle')
+
+"""
+
+import hashlib
+import json
+import logging
+import marshal
+import os
+import sys
+
+import pbm.fileio as fileio
+import pbm.store as store
+
+log = logging.getLogger(__name__)
+
+
+# increment when the cached data layout changes
+CACHE_VERSION = 4
+# increment when the state layout changes
+STATE_VERSION = 1
+
+
+def get_cache_dir(environ=None):
+    """
+    Keyword Arguments:
+        environ (dict): environment (default: ``os.environ``)
+
+    Returns:
+        str: ``$XDG_CACHE_HOME/pbm`` (default: ``~/.cache/pbm``)
+    """
+    if environ is None:
+        environ = os.environ
+    cache_home = (environ.get('XDG_CACHE_HOME')
+                  or os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'pbm')
+
+
+def get_file_key(path):
+    """
+    Args:
+        path (str): path to a Bookmarks JSON file
+
+    Raises:
+        OSError: if ``path`` does not exist
+
+    Returns:
+        tuple: (abspath, size, mtime, inode)
+    """
+    st = os.stat(path)
+    mtime = getattr(st, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = repr(st.st_mtime)
+    return (os.path.abspath(path), st.st_size, mtime, st.st_ino)
+
+
+def _path_hexdigest(path):
+    abspath = os.path.abspath(path)
+    if not isinstance(abspath, bytes):
+        abspath = abspath.encode('utf-8')
+    return hashlib.sha1(abspath).hexdigest()
+
+
+def get_cache_path(path, cache_dir=None):
+    """
+    Args:
+        path (str): path to a Bookmarks JSON file
+
+    Keyword Arguments:
+        cache_dir (str): default: :func:`get_cache_dir`
+
+    Returns:
+        str: path to the cache file for ``path`` (for this python version,
+        because the marshal format differs between versions)
+    """
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    return os.path.join(cache_dir, "%s.py%d%d.marshal" % (
+        _path_hexdigest(path), sys.version_info[0], sys.version_info[1]))
+
+
+def get_state_path(path, cache_dir=None):
+    """
+    Args:
+        path (str): path to a Bookmarks JSON file
+
+    Keyword Arguments:
+        cache_dir (str): default: :func:`get_cache_dir`
+
+    Returns:
+        str: path to the state file for ``path``
+    """
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    return os.path.join(cache_dir, "%s.state.json" % _path_hexdigest(path))
+
+
+def load_state(path, cache_dir=None):
+    """
+    Load the state which pbm keeps for ``path``
+
+    Args:
+        path (str): path to a Bookmarks JSON file
+
+    Keyword Arguments:
+        cache_dir (str): default: :func:`get_cache_dir`
+
+    Returns:
+        dict: the state (empty if there is none; ``key`` is the
+        :func:`get_file_key` of ``path`` when the state was last saved)
+    """
+    state_path = get_state_path(path, cache_dir=cache_dir)
+    try:
+        with open(state_path, 'rb') as f:
+            state = json.loads(f.read().decode('utf-8'))
+        if state.get('version') != STATE_VERSION:
+            log.debug(('cache.state_version', path, state_path))
+            return {}
+    except (IOError, OSError) as e:
+        log.debug(('cache.state_miss', path, state_path, e))
+        return {}
+    except (ValueError, AttributeError) as e:
+        log.info(('cache.state_invalid', path, state_path, e))
+        return {}
+    return state
+
+
+def update_state(path, cache_dir=None, **values):
+    """
+    Atomically update the state which pbm keeps for ``path``
+
+    Args:
+        path (str): path to a Bookmarks JSON file
+
+    Keyword Arguments:
+        cache_dir (str): default: :func:`get_cache_dir`
+        values (dict): state keys to set (JSON-serializable values)
+
+    Returns:
+        str or None: path to the state file (None if it was not written)
+    """
+    state_path = get_state_path(path, cache_dir=cache_dir)
+    state = load_state(path, cache_dir=cache_dir)
+    state.update(values)
+    state['version'] = STATE_VERSION
+    try:
+        state['key'] = get_file_key(path)
+        dirname = os.path.dirname(state_path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        data = json.dumps(state, sort_keys=True)
+        fileio.atomic_write(state_path, lambda f: f.write(data),
+                            fsync=False)
+    except (IOError, OSError) as e:
+        log.info(('cache.state_save_error', path, state_path, e))
+        return None
+    log.debug(('cache.state_save', path, state_path))
+    return state_path
+
+
+def load(path, cache_dir=None):
+    """
+    Load the cached store for ``path``, if it is current
+
+    Args:
+        path (str): path to a Bookmarks JSON file
+
+    Keyword Arguments:
+        cache_dir (str): default: :func:`get_cache_dir`
+
+    Returns:
+        BookmarkStore or None: None on a cache miss
+    """
+    cache_path = get_cache_path(path, cache_dir=cache_dir)
+    try:
+        key = get_file_key(path)
+        with open(cache_path, 'rb') as f:
+            data = marshal.load(f)
+        if data.get('version') != CACHE_VERSION or data.get('key') != key:
+            log.debug(('cache.stale', path, cache_path))
+            return None
+        bookmark_store = store.BookmarkStore.from_marshal_data(data['store'])
+    except (IOError, OSError) as e:
+        log.debug(('cache.miss', path, cache_path, e))
+        return None
+    except (EOFError, ValueError, TypeError, KeyError, AttributeError) as e:
+        log.info(('cache.invalid', path, cache_path, e))
+        return None
+    log.debug(('cache.hit', path, cache_path))
+    return bookmark_store
+
+
+def save(path, bookmark_store, key, cache_dir=None):
+    """
+    Atomically write the cached store for ``path``
+
+    Args:
+        path (str): path to a Bookmarks JSON file
+        bookmark_store (BookmarkStore): the parsed ``path``
+        key (tuple): :func:`get_file_key` from before ``path`` was parsed
+
+    Keyword Arguments:
+        cache_dir (str): default: :func:`get_cache_dir`
+
+    Returns:
+        str or None: path to the cache file (None if it was not written)
+    """
+    cache_path = get_cache_path(path, cache_dir=cache_dir)
+    try:
+        if get_file_key(path) != key:
+            log.info(('cache.changed_while_parsing', path))
+            return None
+        dirname = os.path.dirname(cache_path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        data = marshal.dumps({
+            'version': CACHE_VERSION,
+            'key': key,
+            'store': bookmark_store.to_marshal_data()})
+        fileio.atomic_write(cache_path, lambda f: f.write(data),
+                            encoding=None, fsync=False)
+    except (IOError, OSError, ValueError) as e:
+        log.info(('cache.save_error', path, cache_path, e))
+        return None
+    log.debug(('cache.save', path, cache_path))
+    return cache_path
+
+
+def load_store(path, cache_dir=None):
+    """
+    Load ``path`` from the cache; or parse it and update the cache
+
+    Args:
+        path (str): path to a Bookmarks JSON file
+
+    Keyword Arguments:
+        cache_dir (str): default: :func:`get_cache_dir`
+
+    Returns:
+        BookmarkStore: the parsed ``path``
+    """
+    bookmark_store = load(path, cache_dir=cache_dir)
+    if bookmark_store is None:
+        try:
+            key = get_file_key(path)
+        except OSError:
+            key = None  # from_path raises IOError (as read_bookmarks does)
+        bookmark_store = store.BookmarkStore.from_path(path)
+        if key is not None:
+            save(path, bookmark_store, key, cache_dir=cache_dir)
+    return bookmark_store
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+pbm/datasource.py -- a watched, shared Bookmarks snapshot for pbmweb
+
+A :class:`BookmarksDataSource` holds the current
+:class:`pbm.main.ChromiumBookmarks` snapshot of a Bookmarks file.
+When the file changes (inotify, if ``pyinotify`` is installed;
+otherwise polling), the file is re-parsed on an executor thread and the
+snapshot is swapped on the IOLoop; so handlers never parse the file
+and never block the loop.
+
+.. code:: python
+
+    datasource = BookmarksDataSource('./path/to/Bookmarks')
+    datasource.start()  # (after forking)
+    cb = datasource.cb  # the current snapshot
+
+"""
+
+import collections
+import logging
+import os
+
+import tornado.ioloop
+
+try:
+    import pyinotify
+except ImportError:  # pragma: no cover
+    pyinotify = None
+
+import pbm.cache as cache
+import pbm.main
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_POLL_INTERVAL = 2.0  # seconds
+DEFAULT_DEBOUNCE = 0.25  # seconds
+
+
+class BookmarksDataSource(object):
+
+    """
+    A watched :class:`pbm.main.ChromiumBookmarks` snapshot
+
+    Attributes:
+        bookmarks_path (str): path to the watched Bookmarks file
+        cb (ChromiumBookmarks): the current snapshot
+        generation (int): number of snapshot swaps
+        watcher (str or None): ``inotify``, ``poll``, or None (stopped)
+        stats (Counter): ``reload``, ``error``
+    """
+
+    def __init__(self, bookmarks_path,
+                 use_cache=False,
+                 poll_interval=DEFAULT_POLL_INTERVAL,
+                 debounce=DEFAULT_DEBOUNCE,
+                 executor=None):
+        """
+        Args:
+            bookmarks_path (str): path to a Chromium Bookmarks JSON file
+
+        Keyword Arguments:
+            use_cache (bool): load with the parse cache (see :mod:`pbm.cache`)
+            poll_interval (float): seconds between checks, without inotify
+            debounce (float): seconds to wait for more changes before
+                re-parsing
+            executor (concurrent.futures.Executor): executor to re-parse on
+                (default: the IOLoop's default executor)
+        """
+        self.bookmarks_path = bookmarks_path
+        self.use_cache = use_cache
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.executor = executor
+        self.generation = 0
+        self.watcher = None
+        self.stats = collections.Counter()
+        self.io_loop = None
+        self._callbacks = []
+        self._loading = None
+        self._pending = False
+        self._timeout = None
+        self._failed_key = None
+        self._periodic = None
+        self._notifier = None
+        self.cb = self.load()
+
+    def load(self):
+        """
+        Parse the Bookmarks file (on an executor thread, after the first load)
+
+        Returns:
+            ChromiumBookmarks: a new snapshot (with ``bookmarks_dict`` built)
+        """
+        cb = pbm.main.ChromiumBookmarks(self.bookmarks_path,
+                                        use_cache=self.use_cache)
+        cb.bookmarks_dict
+        return cb
+
+    def add_callback(self, callback):
+        """
+        Args:
+            callback (callable): called with each new snapshot (on the IOLoop)
+        """
+        self._callbacks.append(callback)
+
+    def is_stale(self):
+        """
+        Returns:
+            bool: True if the file has changed since the snapshot was read
+            (False while the file is missing; e.g. mid-rename)
+        """
+        try:
+            key = cache.get_file_key(self.bookmarks_path)
+        except OSError:
+            return False
+        return key != self.cb.source_key and key != self._failed_key
+
+    def start(self, io_loop=None):
+        """
+        Start watching the file (with inotify, or else by polling)
+
+        Keyword Arguments:
+            io_loop (IOLoop): default: ``IOLoop.current()``
+
+        Returns:
+            str: ``inotify`` or ``poll``
+        """
+        if self.watcher is not None:
+            return self.watcher
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.current()
+        if pyinotify is not None and self._start_inotify():
+            self.watcher = 'inotify'
+        else:
+            self._periodic = tornado.ioloop.PeriodicCallback(
+                self.check, self.poll_interval * 1000)
+            self._periodic.start()
+            self.watcher = 'poll'
+        log.info(('datasource.start', self.bookmarks_path, self.watcher))
+        return self.watcher
+
+    def _start_inotify(self):
+        dirname, basename = os.path.split(
+            os.path.abspath(self.bookmarks_path))
+
+        def handle(event):
+            if event.name == basename:
+                self.schedule_reload()
+
+        try:
+            wm = pyinotify.WatchManager()
+            # Chromium (and pbm) replace the file with a rename
+            mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO |
+                    pyinotify.IN_CREATE)
+            wm.add_watch(dirname, mask, proc_fun=handle, quiet=False)
+            self._notifier = pyinotify.TornadoAsyncNotifier(
+                wm, self.io_loop)
+        except (OSError, IOError, pyinotify.PyinotifyError) as e:
+            log.info(('datasource.inotify_error', dirname, e))
+            return False
+        return True
+
+    def stop(self):
+        """
+        Stop watching the file
+        """
+        if self._periodic is not None:
+            self._periodic.stop()
+            self._periodic = None
+        if self._notifier is not None:
+            self._notifier.stop()
+            self._notifier = None
+        if self._timeout is not None:
+            self.io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+        self.watcher = None
+
+    def check(self):
+        """
+        Schedule a reload if the file has changed (see :meth:`is_stale`)
+        """
+        if (self._loading is None and self._timeout is None
+                and self.is_stale()):
+            self.schedule_reload()
+
+    def schedule_reload(self):
+        """
+        Reload after ``debounce`` seconds without further changes
+        """
+        if self.io_loop is None:
+            self.io_loop = tornado.ioloop.IOLoop.current()
+        if self._timeout is not None:
+            self.io_loop.remove_timeout(self._timeout)
+        self._timeout = self.io_loop.call_later(self.debounce, self.reload)
+
+    def reload(self):
+        """
+        Re-parse the file on the executor; then swap the snapshot on the
+        IOLoop (if a reload is already running, reload again after it)
+
+        Returns:
+            Future: the running reload
+        """
+        self._timeout = None
+        if self.io_loop is None:
+            self.io_loop = tornado.ioloop.IOLoop.current()
+        if self._loading is not None:
+            self._pending = True
+            return self._loading
+        try:
+            key = cache.get_file_key(self.bookmarks_path)
+        except OSError:
+            key = None
+        future = self.io_loop.run_in_executor(self.executor, self.load)
+        self._loading = future
+        self.io_loop.add_future(
+            future, lambda future: self._on_loaded(future, key))
+        return future
+
+    def _on_loaded(self, future, key):
+        self._loading = None
+        try:
+            cb = future.result()
+        except Exception as e:
+            # e.g. a partially written file: keep the current snapshot
+            # (until the file changes again)
+            self._failed_key = key
+            self.stats['error'] += 1
+            log.error(('datasource.reload_error', self.bookmarks_path, e))
+        else:
+            self.cb = cb
+            self._failed_key = None
+            self.generation += 1
+            self.stats['reload'] += 1
+            log.info(('datasource.reload', self.bookmarks_path,
+                      self.generation))
+            for callback in self._callbacks:
+                callback(cb)
+        if self._pending:
+            self._pending = False
+            self.reload()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+pbm/diff.py -- structural diff of two Bookmarks files
+
+Both trees are hashed (:mod:`pbm.merkle`) and walked together from the
+``roots``: subtrees with the same digest are skipped in O(1); children
+of changed folders are paired by digest and then folders by name. Whole
+subtrees that changed folders are matched by digest (``moved``); the
+remaining urls are matched by ``guid``, then ``url``, then ``name``, and
+reported as ``moved``, ``renamed``, or ``changed``; unmatched urls are
+``added`` or ``removed``. Unchanged bookmarks cost (almost) nothing but
+hashing; so diffing two large, mostly similar files is mostly parsing.
+
+.. code:: python
+
+    changes = diff_files('./Bookmarks.2016-01-01T00:00:00.bkp',
+                         './Bookmarks')
+    for line in format_text(changes):
+        print(line)
+
+"""
+
+import collections
+import logging
+
+import pbm.merkle as merkle
+
+log = logging.getLogger(__name__)
+
+
+DIFF_ROOTS = ('bookmark_bar', 'other', 'synced')
+
+# kind -> text prefix
+CHANGE_KINDS = collections.OrderedDict((
+    ('added', '+'),
+    ('removed', '-'),
+    ('moved', '>'),
+    ('renamed', '~'),
+    ('changed', '*'),
+))
+
+
+class Change(
+    collections.namedtuple('Change', (
+        'kind',
+        'type',
+        'name',
+        'url',
+        'path',
+        'old_name',
+        'old_url',
+        'old_path'))):
+
+    """
+    Attributes:
+        kind (str): one of :data:`CHANGE_KINDS`
+        type (str): ``url`` or ``folder``
+        name (str): name (in the new tree; the old name if ``removed``)
+        url (str or None): url (in the new tree; the old url if
+            ``removed``)
+        path (tuple[str]): parent folder path (the root key and folder
+            names) in the new tree (in the old tree if ``removed``)
+        old_name (str or None): name in the old tree
+        old_url (str or None): url in the old tree
+        old_path (tuple[str] or None): parent folder path in the old tree
+    """
+
+    def to_dict(self):
+        """
+        Returns:
+            OrderedDict: this change (as JSON-serializable values)
+        """
+        return collections.OrderedDict(
+            (field, list(value) if isinstance(value, tuple) else value)
+            for field, value in zip(self._fields, self))
+
+
+class _Side(object):
+
+    """
+    One tree's digests and unmatched nodes
+    """
+
+    def __init__(self, bookmarks_dict):
+        self.roots = bookmarks_dict.get('roots', {})
+        self.hashes = {}
+        for key in DIFF_ROOTS:
+            node = self.roots.get(key)
+            if isinstance(node, dict):
+                merkle.compute_hashes(node, hashes=self.hashes)
+        self.urls = []  # [(node, path)]
+        self.folders = collections.defaultdict(list)  # digest: [(node, path)]
+
+    def digest(self, node):
+        return self.hashes[id(node)]
+
+    def add_unmatched(self, node, path):
+        if node.get('type') == 'folder':
+            self.folders[self.digest(node)].append((node, path))
+        elif node.get('type') == 'url':
+            self.urls.append((node, path))
+
+    def flatten_folders(self):
+        """
+        Move the urls of every unmatched folder into ``urls``
+        """
+        for digest in sorted(self.folders):
+            for folder, path in self.folders[digest]:
+                stack = [(folder, path + (folder.get('name'),))]
+                while stack:
+                    node, node_path = stack.pop()
+                    for child in reversed(node.get('children') or ()):
+                        if child.get('type') == 'folder':
+                            stack.append(
+                                (child, node_path + (child.get('name'),)))
+                        elif child.get('type') == 'url':
+                            self.urls.append((child, node_path))
+        self.folders.clear()
+
+
+def _diff_folders(old, new, old_folder, new_folder, old_path, new_path):
+    stack = [(old_folder, new_folder, old_path, new_path)]
+    while stack:
+        old_folder, new_folder, old_path, new_path = stack.pop()
+        if old.digest(old_folder) == new.digest(new_folder):
+            continue
+        new_by_digest = collections.defaultdict(collections.deque)
+        new_children = new_folder.get('children') or []
+        for index, child in enumerate(new_children):
+            new_by_digest[new.digest(child)].append(index)
+        unmatched_new = set(range(len(new_children)))
+        old_rest = []
+        for child in old_folder.get('children') or ():
+            indexes = new_by_digest.get(old.digest(child))
+            if indexes:
+                unmatched_new.discard(indexes.popleft())
+            else:
+                old_rest.append(child)
+        new_rest = [new_children[i] for i in sorted(unmatched_new)]
+
+        new_folders_by_name = collections.defaultdict(collections.deque)
+        for child in new_rest:
+            if child.get('type') == 'folder':
+                new_folders_by_name[child.get('name')].append(child)
+        paired = set()
+        for child in old_rest:
+            if child.get('type') == 'folder':
+                candidates = new_folders_by_name.get(child.get('name'))
+                if candidates:
+                    other = candidates.popleft()
+                    paired.add(id(other))
+                    stack.append((
+                        child, other,
+                        old_path + (child.get('name'),),
+                        new_path + (other.get('name'),)))
+                    continue
+            old.add_unmatched(child, old_path)
+        for child in new_rest:
+            if id(child) not in paired:
+                new.add_unmatched(child, new_path)
+
+
+def _match_urls(old, new, keyfunc):
+    new_by_key = collections.defaultdict(collections.deque)
+    for index, (node, _) in enumerate(new.urls):
+        key = keyfunc(node)
+        if key:
+            new_by_key[key].append(index)
+    pairs = []
+    matched_new = set()
+    old_rest = []
+    for item in old.urls:
+        key = keyfunc(item[0])
+        indexes = new_by_key.get(key) if key else None
+        if indexes:
+            index = indexes.popleft()
+            matched_new.add(index)
+            pairs.append((item, new.urls[index]))
+        else:
+            old_rest.append(item)
+    old.urls = old_rest
+    new.urls = [item for index, item in enumerate(new.urls)
+                if index not in matched_new]
+    return pairs
+
+
+def _pair_changes(old_item, new_item):
+    (old_node, old_path), (new_node, new_path) = old_item, new_item
+    name, url = new_node.get('name'), new_node.get('url')
+    old_name, old_url = old_node.get('name'), old_node.get('url')
+
+    def change(kind):
+        return Change(kind, 'url', name, url, new_path,
+                      old_name, old_url, old_path)
+
+    found = False
+    if old_path != new_path:
+        found = True
+        yield change('moved')
+    if old_name != name:
+        found = True
+        yield change('renamed')
+    if old_url != url or not found:
+        yield change('changed')
+
+
+def diff_bookmarks(old_dict, new_dict):
+    """
+    Diff two Bookmarks JSON dicts
+
+    Args:
+        old_dict (dict): the old Bookmarks JSON dict
+        new_dict (dict): the new Bookmarks JSON dict
+
+    Returns:
+        list[Change]: folders moved (whole subtrees), then urls
+        moved/renamed/changed, removed, and added
+    """
+    old, new = _Side(old_dict), _Side(new_dict)
+    for key in DIFF_ROOTS:
+        old_root, new_root = old.roots.get(key), new.roots.get(key)
+        old_root = old_root if isinstance(old_root, dict) else None
+        new_root = new_root if isinstance(new_root, dict) else None
+        if old_root is not None and new_root is not None:
+            _diff_folders(old, new, old_root, new_root, (key,), (key,))
+        else:
+            for side, root in ((old, old_root), (new, new_root)):
+                for child in (root or {}).get('children') or ():
+                    side.add_unmatched(child, (key,))
+
+    changes = []
+    for digest, old_items in sorted(old.folders.items()):
+        new_items = new.folders.get(digest)
+        while old_items and new_items:
+            (old_node, old_path) = old_items.pop(0)
+            (new_node, new_path) = new_items.pop(0)
+            changes.append(Change(
+                'moved', 'folder', new_node.get('name'), None, new_path,
+                old_node.get('name'), None, old_path))
+    old.flatten_folders()
+    new.flatten_folders()
+
+    for keyfunc in (lambda node: node.get('guid'),
+                    lambda node: node.get('url'),
+                    lambda node: node.get('name')):
+        for old_item, new_item in _match_urls(old, new, keyfunc):
+            changes.extend(_pair_changes(old_item, new_item))
+    for node, path in old.urls:
+        changes.append(Change('removed', 'url', node.get('name'),
+                              node.get('url'), path, None, None, None))
+    for node, path in new.urls:
+        changes.append(Change('added', 'url', node.get('name'),
+                              node.get('url'), path, None, None, None))
+    log.debug(('diff_bookmarks', collections.Counter(
+        change.kind for change in changes)))
+    return changes
+
+
+def diff_files(old_path, new_path):
+    """
+    Diff two Bookmarks files (see :func:`diff_bookmarks`)
+
+    Args:
+        old_path (str): path to the old Chromium Bookmarks JSON file
+        new_path (str): path to the new Chromium Bookmarks JSON file
+
+    Returns:
+        list[Change]: the changes
+    """
+    # pbm.main imports this module
+    import pbm.main
+    read_bookmarks = pbm.main.ChromiumBookmarks.read_bookmarks
+    return diff_bookmarks(read_bookmarks(old_path), read_bookmarks(new_path))
+
+
+def _format_path(path):
+    return u'/'.join(path or ())
+
+
+def format_text(changes):
+    """
+    Args:
+        changes (iterable[Change]): see :func:`diff_bookmarks`
+
+    Yields:
+        str: one line for each change, and a summary line
+    """
+    counts = collections.Counter()
+    for change in changes:
+        counts[change.kind] += 1
+        prefix = CHANGE_KINDS[change.kind]
+        target = change.url if change.type == 'url' else (
+            _format_path(change.path + (change.name,)) + u'/')
+        if change.kind == 'moved':
+            detail = u"%s -> %s" % (_format_path(change.old_path),
+                                    _format_path(change.path))
+        elif change.kind == 'renamed':
+            detail = u"%r -> %r" % (change.old_name, change.name)
+        elif change.kind == 'changed':
+            detail = u"%s -> %s" % (change.old_url, change.url)
+        else:
+            detail = u"%s\t%r" % (_format_path(change.path), change.name)
+        yield u"%s %s\t%s" % (prefix, target, detail)
+    yield u"# " + u", ".join(
+        u"%d %s" % (counts[kind], kind) for kind in CHANGE_KINDS)
+
+
+def to_json_dict(changes):
+    """
+    Args:
+        changes (iterable[Change]): see :func:`diff_bookmarks`
+
+    Returns:
+        OrderedDict: ``{"counts": {kind: n}, "changes": [...]}``
+    """
+    changes = [change.to_dict() for change in changes]
+    counts = collections.Counter(change['kind'] for change in changes)
+    return collections.OrderedDict((
+        ('counts', collections.OrderedDict(
+            (kind, counts[kind]) for kind in CHANGE_KINDS)),
+        ('changes', changes),
+    ))
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+pbm/fileio.py -- atomic writes and backups for Bookmarks JSON files
+
+Write to a temporary file in the same directory, ``fsync`` it, and
+``rename`` it over the destination; so the destination is either the
+old file or the complete new file (never a truncated file).
+
+The old file is kept as a backup by hardlinking its inode
+(or, where hardlinks are not supported, with a reflink or a copy).
+This is safe because neither pbm nor Chromium rewrites a Bookmarks
+file in place.
+
+.. code:: python
+
+    atomic_write(path, lambda f: f.write(data),
+                 backup_path=get_backup_path(path))
+    prune_backups(path, keep=10)
+
+"""
+
+import codecs
+import datetime
+import errno
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+log = logging.getLogger(__name__)
+
+
+BACKUP_SUFFIX = '.bkp'
+BACKUP_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# <path>.<datetime>[.n].bkp (the part after <path>)
+BACKUP_NAME_RGX = re.compile(
+    r'^\.(?P<datetime>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})'
+    r'[^.]*(?:\.(?P<n>\d+))?\.bkp$')
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def get_backup_path(path, dt=None):
+    """
+    Args:
+        path (str): path to the file to back up
+
+    Keyword Arguments:
+        dt (datetime): backup datetime (default: now)
+
+    Returns:
+        str: an unused ``<path>.<datetime>[.n].bkp`` path
+    """
+    if dt is None:
+        dt = datetime.datetime.now()
+    prefix = "%s.%s" % (path, dt.strftime("%FT%T%z"))
+    backup_path = prefix + BACKUP_SUFFIX
+    n = 0
+    while os.path.lexists(backup_path):
+        n += 1
+        backup_path = "%s.%d%s" % (prefix, n, BACKUP_SUFFIX)
+    return backup_path
+
+
+def reflink(src, dst):
+    """
+    Clone ``src`` to ``dst`` (copy-on-write; Linux ``FICLONE``)
+
+    Raises:
+        OSError, IOError: if the platform or filesystem
+            does not support reflinks
+    """
+    import fcntl
+    with open(src, 'rb') as s:
+        with open(dst, 'wb') as d:
+            try:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            except (IOError, OSError):
+                d.close()
+                os.remove(dst)
+                raise
+    shutil.copystat(src, dst)
+
+
+def backup_file(src, dst):
+    """
+    Keep the current contents of ``src`` at ``dst``
+    (without copying the bytes, where possible)
+
+    ``src`` must then only be replaced (e.g. with :func:`atomic_write`),
+    not modified in place; as ``dst`` may be a hardlink to the same inode.
+
+    Args:
+        src (str): path to the file to back up
+        dst (str): backup path (which must not exist)
+
+    Returns:
+        str: ``link``, ``reflink``, or ``copy``
+    """
+    try:
+        os.link(src, dst)
+        return 'link'
+    except (AttributeError, OSError) as e:
+        if getattr(e, 'errno', None) == errno.EEXIST:
+            raise
+        log.debug(('backup_file.link', src, dst, e))
+    try:
+        reflink(src, dst)
+        return 'reflink'
+    except (ImportError, IOError, OSError) as e:
+        log.debug(('backup_file.reflink', src, dst, e))
+    shutil.copy2(src, dst)
+    return 'copy'
+
+
+def replace(src, dst):
+    """
+    Atomically rename ``src`` over ``dst``
+    """
+    _replace = getattr(os, 'replace', None)
+    if _replace is not None:
+        return _replace(src, dst)
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # windows (python 2): rename does not overwrite
+        if os.name != 'nt' or not os.path.exists(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
+
+
+def fsync_dir(dirname):
+    """
+    ``fsync`` a directory (so that a rename is durable); a no-op where
+    directories cannot be opened (e.g. windows)
+    """
+    try:
+        fd = os.open(dirname, os.O_RDONLY)
+    except (AttributeError, OSError):
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, write,
+                 encoding='utf8',
+                 backup_path=None,
+                 check=None,
+                 fsync=True):
+    """
+    Atomically replace ``path`` with the text written by ``write``
+
+    Args:
+        path (str): path to the file to (over)write
+        write (callable): called with a text file object
+            (or a binary file object, if ``encoding`` is None)
+
+    Keyword Arguments:
+        encoding (str): text encoding (None to write bytes)
+        backup_path (str): if ``path`` exists, keep it at this path
+            (see :func:`backup_file`)
+        check (callable): called with the path of the complete
+            temporary file and the return value of ``write``,
+            before it replaces ``path`` (raise to abort)
+        fsync (bool): ``fsync`` the file and the directory
+
+    Returns:
+        object: the return value of ``write``
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=dirname,
+        prefix='.%s.' % os.path.basename(path),
+        suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            output = write(codecs.getwriter(encoding)(f)
+                           if encoding is not None else f)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        if check is not None:
+            check(tmp_path, output)
+        if os.path.exists(path):
+            # mkstemp creates files with mode 0600
+            shutil.copymode(path, tmp_path)
+            if backup_path is not None:
+                method = backup_file(path, backup_path)
+                log.info(('backup', method, backup_path))
+        replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if fsync:
+        fsync_dir(dirname)
+    return output
+
+
+def list_backups(path):
+    """
+    Args:
+        path (str): path to a file with ``<path>.<datetime>.bkp`` backups
+
+    Returns:
+        list[tuple]: ``(datetime, backup_path)`` tuples, newest first
+        (the datetime is parsed from the filename)
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    basename = os.path.basename(path)
+    backups = []
+    try:
+        filenames = os.listdir(dirname)
+    except OSError:
+        return backups
+    for filename in filenames:
+        if not filename.startswith(basename):
+            continue
+        match = BACKUP_NAME_RGX.match(filename[len(basename):])
+        if match is None:
+            continue
+        try:
+            dt = datetime.datetime.strptime(
+                match.group('datetime'), BACKUP_DATETIME_FORMAT)
+        except ValueError:
+            continue
+        backups.append(
+            ((dt, int(match.group('n') or 0)),
+             (dt, os.path.join(dirname, filename))))
+    backups.sort(reverse=True)
+    return [backup for (key, backup) in backups]
+
+
+def prune_backups(path, keep=None, max_age=None, now=None):
+    """
+    Remove old ``<path>.<datetime>.bkp`` backups
+
+    Args:
+        path (str): path to a file with backups
+
+    Keyword Arguments:
+        keep (int): keep at most this many (of the newest) backups
+        max_age (timedelta or float): remove backups older than this
+            (timedelta, or a number of seconds)
+        now (datetime): default: now
+
+    Returns:
+        list[str]: removed backup paths
+    """
+    if keep is None and max_age is None:
+        return []
+    if max_age is not None and not isinstance(max_age, datetime.timedelta):
+        max_age = datetime.timedelta(seconds=max_age)
+    if now is None:
+        now = datetime.datetime.now()
+    removed = []
+    for n, (dt, backup_path) in enumerate(list_backups(path)):
+        if ((keep is not None and n >= keep)
+                or (max_age is not None and now - dt > max_age)):
+            os.remove(backup_path)
+            removed.append(backup_path)
+    if removed:
+        log.info(('prune_backups', removed))
+    return removed
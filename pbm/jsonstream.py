@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+pbm/jsonstream.py -- incremental Chromium Bookmarks JSON parser
+
+Scan a Bookmarks JSON file in fixed-size chunks and yield one event per
+``url`` and ``folder`` node, without building the whole ``bookmarks_dict``.
+
+.. code:: python
+
+    for event in iter_bookmark_events('./path/to/Bookmarks'):
+        print(event.type, event.root, event.node.get('name'))
+
+"""
+
+import codecs
+import collections
+import json
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_CHUNK_SIZE = 2**16
+
+WHITESPACE_RGX = re.compile(r'[ \t\n\r]*')
+CONTAINER_START_RGX = re.compile(r'[\[{]')
+
+
+class StreamEvent(
+        collections.namedtuple('StreamEvent', (
+            'type',
+            'root',
+            'path',
+            'node'))):
+    """
+    A parsed ``url`` or ``folder`` node
+
+    Attributes:
+        type (str): ``url`` or ``folder``
+        root (str): ``roots`` key (e.g. ``bookmark_bar``, ``other``)
+        path (list[dict]): ancestor folder dicts (root folder first)
+        node (dict): the node; a folder's ``children`` are always ``[]``
+            (they are yielded as separate events before the folder)
+
+    .. note:: Ancestor folder dicts in ``path`` are filled in as their
+       fields are parsed. Chromium writes ``children`` before ``name``
+       and ``id``, so those fields of an ancestor are only complete once
+       that ancestor's own ``folder`` event has been yielded.
+    """
+
+
+class BookmarksStreamParser(object):
+
+    """
+    Incremental (chunked) parser for a Chromium Bookmarks JSON file
+
+    Folder nodes are parsed key by key so that ``children`` are never
+    accumulated in memory; flat nodes (``url`` nodes) are decoded in one
+    ``raw_decode`` call. Memory use is bounded by the chunk size, the
+    folder depth, and the size of the largest single node.
+
+    Attributes:
+        header (OrderedDict): top-level keys other than ``roots``
+            (e.g. ``checksum``, ``version``), available after iterating
+        roots_extra (OrderedDict): ``roots`` keys which are not folders
+            (e.g. ``sync_transaction_version``)
+    """
+
+    def __init__(self, fileobj, chunk_size=None):
+        """
+        Args:
+            fileobj (file): a file-like object which yields unicode text
+
+        Keyword Arguments:
+            chunk_size (int): number of characters to read at a time
+        """
+        self.fileobj = fileobj
+        if chunk_size is None:
+            chunk_size = DEFAULT_CHUNK_SIZE
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder(
+            object_pairs_hook=collections.OrderedDict)
+        self.buf = u''
+        self.pos = 0
+        self.eof = False
+        self.header = collections.OrderedDict()
+        self.roots_extra = collections.OrderedDict()
+
+    def __iter__(self):
+        return self.iter_events()
+
+    def _fill(self, size=None):
+        """
+        Read another chunk into the buffer, discarding consumed text
+
+        Returns:
+            bool: False if the end of the file was already reached
+        """
+        if self.eof:
+            return False
+        data = self.fileobj.read(size or self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        """
+        Skip whitespace and return the next character ('' at EOF)
+        """
+        while True:
+            self.pos = WHITESPACE_RGX.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return u''
+
+    def _expect(self, char):
+        _char = self._peek()
+        if _char != char:
+            raise ValueError("Expected %r at offset %d, found %r" % (
+                char, self.pos, _char))
+        self.pos += 1
+
+    def _read_value(self):
+        """
+        Decode one complete JSON value (of any type) at the current offset
+
+        Returns:
+            object: the decoded value
+        """
+        self._peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer may be truncated
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            if not self._fill(size):
+                continue
+            size *= 2
+
+    def _iter_keys(self):
+        """
+        Iterate over the keys of the JSON object at the current offset;
+        the caller must consume each value before requesting the next key
+
+        Yields:
+            str: object key
+        """
+        self._expect(u'{')
+        if self._peek() == u'}':
+            self.pos += 1
+            return
+        while True:
+            key = self._read_value()
+            self._expect(u':')
+            yield key
+            char = self._peek()
+            self.pos += 1
+            if char == u'}':
+                return
+            elif char != u',':
+                raise ValueError("Expected ',' or '}' at offset %d, "
+                                 "found %r" % (self.pos - 1, char))
+
+    def _is_flat_object(self):
+        """
+        Returns:
+            bool: True if the object at the current offset has no nested
+            objects or arrays before its first ``}`` (e.g. a url node)
+        """
+        while True:
+            close = self.buf.find(u'}', self.pos + 1)
+            if close != -1:
+                return CONTAINER_START_RGX.search(
+                    self.buf, self.pos + 1, close) is None
+            if not self._fill():
+                return False
+
+    def iter_events(self):
+        """
+        Parse the file, yielding a :class:`StreamEvent` for each node
+
+        Yields:
+            StreamEvent: url and folder events, in document order
+            (urls pre-order; each folder after all of its children)
+        """
+        for key in self._iter_keys():
+            if key == 'roots':
+                for event in self._iter_roots():
+                    yield event
+            else:
+                self.header[key] = self._read_value()
+
+    def _iter_roots(self):
+        for key in self._iter_keys():
+            if self._peek() == u'{':
+                for event in self._iter_node(key, []):
+                    yield event
+            else:
+                self.roots_extra[key] = self._read_value()
+
+    def _iter_node(self, root, path):
+        if self._is_flat_object():
+            node = self._read_value()
+            if 'children' in node:
+                # the first '}' was inside a string: already fully parsed
+                for event in iter_node_events(node, root, path):
+                    yield event
+                return
+        else:
+            node = collections.OrderedDict()
+            for key in self._iter_keys():
+                if key != 'children':
+                    node[key] = self._read_value()
+                    continue
+                node[key] = []
+                if self._peek() != u'[':
+                    self._read_value()
+                    continue
+                self.pos += 1
+                _path = path + [node]
+                if self._peek() == u']':
+                    self.pos += 1
+                    continue
+                while True:
+                    if self._peek() == u'{':
+                        for event in self._iter_node(root, _path):
+                            yield event
+                    else:
+                        self._read_value()
+                    char = self._peek()
+                    self.pos += 1
+                    if char == u']':
+                        break
+                    elif char != u',':
+                        raise ValueError(
+                            "Expected ',' or ']' at offset %d, "
+                            "found %r" % (self.pos - 1, char))
+        _type = node.get('type')
+        if _type == 'url':
+            yield StreamEvent('url', root, path, node)
+        elif _type == 'folder' or 'children' in node:
+            yield StreamEvent('folder', root, path, node)
+
+
+def iter_node_events(node, root, path):
+    """
+    Yield the same events as :class:`BookmarksStreamParser` for a node
+    which has already been loaded into memory
+
+    Args:
+        node (dict): a url or folder node
+        root (str): ``roots`` key
+        path (list[dict]): ancestor folder dicts
+
+    Yields:
+        StreamEvent: url and folder events
+    """
+    _type = node.get('type')
+    if _type == 'folder' or 'children' in node:
+        _path = path + [node]
+        for child in node.get('children') or []:
+            if child and hasattr(child, 'get'):
+                for event in iter_node_events(child, root, _path):
+                    yield event
+        yield StreamEvent('folder', root, path, node)
+    elif _type == 'url':
+        yield StreamEvent('url', root, path, node)
+
+
+def iter_bookmark_events(bookmarks_path, chunk_size=None):
+    """
+    Stream events from a Chromium Bookmarks JSON file
+
+    Args:
+        bookmarks_path (str): path to a Chromium Bookmarks JSON file
+
+    Keyword Arguments:
+        chunk_size (int): number of characters to read at a time
+
+    Yields:
+        StreamEvent: url and folder events, in document order
+    """
+    with codecs.open(bookmarks_path, encoding='utf-8') as f:
+        for event in BookmarksStreamParser(f, chunk_size=chunk_size):
+            yield event
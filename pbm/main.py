@@ -26,14 +26,25 @@ import json
 import logging
 import os
 import platform as _platform_
-import shutil
 import sys
 
 from collections import namedtuple
 
 import pbm.app
+import pbm.cache as cache
+import pbm.diff as diff
+import pbm.fileio as fileio
+import pbm.jsonstream as jsonstream
+import pbm.merge as merge
+import pbm.merkle as merkle
+import pbm.pagination as pagination
+import pbm.profiles as profiles
+import pbm.search as search
+import pbm.serialize as serialize
+import pbm.store as store
 import pbm.utils as utils
 import pbm.plugins as plugins
+import pbm.plugins.dedupe as dedupe
 
 
 
@@ -61,6 +72,29 @@ class URL(
         x.pop('date_modified_')
         return x
 
+    JSON_FIELDS = (
+        'type',
+        'id',
+        'name',
+        'url',
+        'path',
+        'date_added',
+        'date_modified')
+
+    @classmethod
+    def json_from_dict(cls, node, **kwargs):
+        """
+        ``URL.from_dict(node, **kwargs).to_json()``, without converting
+        the longdates to datetimes
+
+        Returns:
+            OrderedDict: URL dict
+        """
+        x = collections.OrderedDict(
+            (key, node.get(key)) for key in cls.JSON_FIELDS)
+        x['path'] = kwargs.get('path', x['path'])
+        return x
+
     @classmethod
     def from_dict(cls, node, **kwargs):
         return cls(
@@ -175,27 +209,73 @@ class ChromiumBookmarks(object):
                  bookmarks_dict=None,
                  skiplist=None,
                  ids=None,
-                 conf=None):
+                 conf=None,
+                 use_cache=False,
+                 cache_dir=None):
+        """
+        Keyword Arguments:
+            bookmarks_path (str): path to a Chromium Bookmarks JSON file
+            bookmarks_dict (dict): an already loaded bookmarks dict
+            skiplist (list): folder names to skip
+            ids (iterator): node id generator (default: :meth:`get_ids`)
+            conf (dict): plugin configuration
+            use_cache (bool): load ``bookmarks_path`` from the parse cache
+                (see :mod:`pbm.cache`); ``bookmarks_dict`` is then only
+                built from the cached store when it is first accessed
+            cache_dir (str): see :func:`pbm.cache.get_cache_dir`
+        """
         self.bookmarks_path = bookmarks_path
+        self.cache_dir = cache_dir
+        self.version = 0
+        self._bookmarks_list = None
+        self._bookmarks_list_version = None
+        self._page_index = None
+        self._page_index_version = None
+        self._longdate_isoformats = None
+        self._longdate_isoformats_version = None
+        self._subtree_hashes = None
+        self._subtree_hashes_version = None
+        self._search_index = None
+        self._search_index_version = None
+        self._bookmark_store = None
+        # state values to save when the bookmarks are next written
+        # (see get_state and pbm.cache.update_state)
+        self.pending_state = collections.OrderedDict()
+        # the file (size, mtime, inode) and mtime the bookmarks were read
+        # from; None for a bookmarks_dict (see pbm.cache.get_file_key)
+        self.source_key = self.source_mtime = None
+        if bookmarks_dict is None and bookmarks_path:
+            try:
+                self.source_key = cache.get_file_key(bookmarks_path)
+                self.source_mtime = os.path.getmtime(bookmarks_path)
+            except OSError:
+                pass  # reading raises IOError
         if bookmarks_dict is not None:
             self.bookmarks_dict = bookmarks_dict
         else:
             if bookmarks_path:
-                self.bookmarks_dict = self.read_bookmarks(self.bookmarks_path)
+                if use_cache:
+                    self._bookmarks_dict = None
+                    self._bookmark_store = cache.load_store(
+                        self.bookmarks_path, cache_dir=cache_dir)
+                else:
+                    self.bookmarks_dict = self.read_bookmarks(
+                        self.bookmarks_path)
             else:
                 raise Exception("must specify either bookmarks_dict or "
                                 "bookmarks_path")
 
-        if 'checksum' in self.bookmarks_dict:
-            self.bookmarks_dict.pop('checksum')
+        # the checksum is recomputed when the bookmarks are serialized
+        if self._bookmark_store is not None:
+            self.checksum = self._bookmark_store.checksum
+        else:
+            self.checksum = self.bookmarks_dict.pop('checksum', None)
 
         if skiplist is None:
             skiplist = self.skiplist
         self.skiplist = skiplist
 
-        if ids is None:
-            ids = self.get_ids()
-        self.ids = ids
+        self._ids = ids
 
         if conf is None:
             conf = {}
@@ -217,26 +297,226 @@ class ChromiumBookmarks(object):
         # TODO: bookmarks_list is filtered, iter_bookmarks and __iter__ are not
         # TODO: find
 
+    @property
+    def ids(self):
+        """
+        Node id generator (default: :meth:`get_ids`, on first access)
+        """
+        if self._ids is None:
+            self._ids = self.get_ids()
+        return self._ids
+
+    @ids.setter
+    def ids(self, ids):
+        self._ids = ids
+
     def __iter__(self):
         """
         Returns:
             iterable: ChromiumBookmarks.iter_bookmarks(**self)
+            (or the urls of the cached store, before ``bookmarks_dict``
+            is built)
         """
+        if self._bookmarks_dict is None and self._bookmark_store is not None:
+            return self._bookmark_store.iter_urls()
         return self.iter_bookmarks(
             self.bookmarks_path,
             bookmarks_dict=self.bookmarks_dict)
 
+    @property
+    def bookmarks_dict(self):
+        if self._bookmarks_dict is None and self._bookmark_store is not None:
+            # the same bookmarks (so this is not a new version)
+            self._bookmarks_dict = self._bookmark_store.to_bookmarks_dict()
+        return self._bookmarks_dict
+
+    @bookmarks_dict.setter
+    def bookmarks_dict(self, bookmarks_dict):
+        self._bookmarks_dict = bookmarks_dict
+        self._bookmark_store = None
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Increment the mutation version (and so invalidate cached views
+        like :attr:`bookmarks_list`)
+
+        Call this after mutating ``bookmarks_dict`` in place.
+
+        Returns:
+            int: the new mutation version
+        """
+        self.version += 1
+        return self.version
+
     @property
     def bookmarks_list(self):
-        return list(self.iter_bookmarks(
-            bookmarks_dict=self.bookmarks_dict,
-            filterfunc=self.chrome_filterfunc))
+        """
+        A flattened, filtered (:meth:`chrome_filterfunc`) list of URL dicts,
+        cached until the next :meth:`invalidate`
+
+        .. note:: The list is shared between reads; do not mutate it
+
+        Returns:
+            list[dict]: URL dicts
+        """
+        if self._bookmarks_list_version != self.version:
+            self._bookmarks_list = list(self.iter_bookmarks(
+                bookmarks_dict=self.bookmarks_dict,
+                filterfunc=self.chrome_filterfunc))
+            self._bookmarks_list_version = self.version
+        return self._bookmarks_list
+
+    def get_page_index(self):
+        """
+        An ordered index of the urls (``iter(self)``) for cursor
+        pagination, cached until the next :meth:`invalidate`
+
+        Returns:
+            pbm.pagination.PageIndex: the index
+        """
+        if self._page_index_version != self.version:
+            self._page_index = pagination.PageIndex(iter(self))
+            self._page_index_version = self.version
+        return self._page_index
+
+    def get_subtree_hashes(self):
+        """
+        Subtree digests of ``bookmarks_dict`` (each computed on first
+        use; see :mod:`pbm.merkle`), and the digests saved when pbm last
+        wrote ``bookmarks_path``; cached until the next :meth:`invalidate`
+
+        Returns:
+            pbm.merkle.SubtreeHashes: the digests
+        """
+        if self._subtree_hashes_version != self.version:
+            stored = None
+            if self.bookmarks_path:
+                stored = merkle.load_hexdigests(self.bookmarks_path,
+                                                cache_dir=self.cache_dir)
+            self._subtree_hashes = merkle.SubtreeHashes(stored=stored)
+            self._subtree_hashes_version = self.version
+        return self._subtree_hashes
+
+    def get_state(self, key, default=None):
+        """
+        Args:
+            key (str): a pbm state key (see :func:`pbm.cache.load_state`)
+
+        Keyword Arguments:
+            default (object): returned if there is no value for ``key``
+
+        Returns:
+            object: the value set with :meth:`set_state`, or else the value
+            saved when pbm last wrote ``bookmarks_path``
+        """
+        if key in self.pending_state:
+            return self.pending_state[key]
+        if not self.bookmarks_path:
+            return default
+        return cache.load_state(self.bookmarks_path,
+                                cache_dir=self.cache_dir).get(key, default)
+
+    def set_state(self, key, value):
+        """
+        Set a pbm state value, which :meth:`organize` saves (outside of
+        the Bookmarks file, which Chromium syncs) after it writes
+        the bookmarks
+
+        Args:
+            key (str): a pbm state key
+            value (object): a JSON-serializable value
+        """
+        self.pending_state[key] = value
+
+    def get_search_index(self):
+        """
+        A full-text index of the urls (see :mod:`pbm.search`), built from
+        the parsed bookmarks (not saved), cached until the next
+        :meth:`invalidate`
+
+        Returns:
+            pbm.search.SearchIndex: the index
+        """
+        if self._search_index_version != self.version:
+            version = self.version
+            # a cached store is only current until the first invalidate
+            bookmark_store = self._bookmark_store
+            if bookmark_store is None or version:
+                bookmark_store = self.to_bookmark_store()
+            self._search_index = search.SearchIndex.from_store(
+                bookmark_store, key=self.source_key)
+            self._search_index_version = version
+        return self._search_index
+
+    def get_longdate_isoformats(self):
+        """
+        ISO 8601 strings for every ``date_added`` and ``date_modified``
+        in ``bookmarks_dict`` (for templates; see
+        :func:`pbm.utils.longdates_to_isoformat`), cached until the next
+        :meth:`invalidate`
+
+        Returns:
+            dict: longdate -> ISO string (e.g. ``2014-07-29T00:12:01Z``)
+        """
+        if self._longdate_isoformats_version != self.version:
+            longdates = set()
+            nodes = [node for node in self.bookmarks_dict['roots'].values()
+                     if hasattr(node, 'get')]
+            while nodes:
+                node = nodes.pop()
+                for attr in ('date_added', 'date_modified'):
+                    longdate = node.get(attr)
+                    if longdate is not None:
+                        longdates.add(longdate)
+                nodes.extend(x for x in node.get('children') or ()
+                             if hasattr(x, 'get'))
+            longdates = list(longdates)
+            self._longdate_isoformats = dict(zip(
+                longdates, utils.longdates_to_isoformat(longdates)))
+            self._longdate_isoformats_version = self.version
+        return self._longdate_isoformats
 
     @staticmethod
     def read_bookmarks(path):
         with codecs.open(path, encoding='utf-8') as f:
             return json.load(f, object_pairs_hook=collections.OrderedDict)
 
+    @staticmethod
+    def read_bookmark_store(path):
+        """
+        Incrementally parse a Bookmarks JSON file into a columnar store
+
+        Args:
+            path (str): path to a Chromium Bookmarks JSON file
+
+        Returns:
+            pbm.store.BookmarkStore: (without building a ``bookmarks_dict``)
+        """
+        return store.BookmarkStore.from_path(path)
+
+    def to_bookmark_store(self):
+        """
+        Returns:
+            pbm.store.BookmarkStore: a columnar copy of ``bookmarks_dict``
+        """
+        return store.BookmarkStore.from_bookmarks_dict(self.bookmarks_dict)
+
+    @classmethod
+    def from_bookmark_store(cls, bookmark_store, **kwargs):
+        """
+        Args:
+            bookmark_store (pbm.store.BookmarkStore): store to export
+
+        Keyword Arguments:
+            kwargs (dict): passed through to :class:`ChromiumBookmarks`
+
+        Returns:
+            ChromiumBookmarks: with the store exported to ``bookmarks_dict``
+        """
+        return cls(bookmarks_dict=bookmark_store.to_bookmarks_dict(),
+                   **kwargs)
+
     @staticmethod
     def print_bookmarks(bookmarks):
         for x in bookmarks:
@@ -258,6 +538,7 @@ class ChromiumBookmarks(object):
     @bookmark_bar.setter
     def bookmark_bar(self, nodes):
         self.bookmarks_dict['roots']['bookmark_bar']['children'] = nodes
+        self.invalidate()
 
     def add_bookmark_bar_folder(
             self,
@@ -420,16 +701,17 @@ class ChromiumBookmarks(object):
                                 item, filterfunc=filterfunc):
                             yield b
                     elif _item_type == 'url':
-                        yield URL.from_dict(item).to_json()
+                        yield URL.json_from_dict(item)
         elif _type == 'url':
-            yield URL.from_dict(node).to_json()
+            yield URL.json_from_dict(node)
 
     @classmethod
     def iter_bookmarks(
             cls,
             bookmarks_path=None,
             bookmarks_dict=None,
-            filterfunc=None):
+            filterfunc=None,
+            stream=False):
         """
         Args:
             bookmarks_path (path): path to Chromium Bookmarks JSON to read first
@@ -437,6 +719,9 @@ class ChromiumBookmarks(object):
         Keyword Arguments:
             bookmarks_dict (dict): an already loaded bookmarks dict
             filterfunc (None, True, callable): default, all, True to include
+            stream (bool): if True and ``bookmarks_dict`` is None,
+                incrementally parse ``bookmarks_path``
+                (see :meth:`stream_bookmarks`)
 
         Yields:
             iterable: chain(map(cls.walk_bookmarks, ['bookmarks_bar', 'other']))
@@ -445,6 +730,9 @@ class ChromiumBookmarks(object):
             if bookmarks_path is None:
                 raise Exception("must specify either bookmarks_dict "
                                 "or bookmarks_list")
+            if stream:
+                return cls.stream_bookmarks(bookmarks_path,
+                                            filterfunc=filterfunc)
             bookmarks_dict = cls.read_bookmarks(bookmarks_path)
         return itertools.chain(
             cls.walk_bookmarks(bookmarks_dict['roots']['bookmark_bar'],
@@ -452,6 +740,67 @@ class ChromiumBookmarks(object):
             cls.walk_bookmarks(bookmarks_dict['roots']['other'],
                                filterfunc=filterfunc))
 
+    @staticmethod
+    def stream_bookmarks(bookmarks_path,
+                         filterfunc=None,
+                         roots=('bookmark_bar', 'other'),
+                         chunk_size=None):
+        """
+        Incrementally parse a Chromium Bookmarks JSON file; yielding urls
+        (in bounded memory, without building a ``bookmarks_dict``)
+
+        Args:
+            bookmarks_path (str): path to Chromium Bookmarks JSON to read
+
+        Keyword Arguments:
+            filterfunc (None, True, callable): default, all, True to include
+                (applied to each url and to each of its ancestor folders;
+                see :class:`pbm.jsonstream.StreamEvent`)
+            roots (tuple[str]): ``roots`` keys to include
+            chunk_size (int): number of characters to read at a time
+
+        Yields:
+            dict: URL dicts (as :meth:`walk_bookmarks`), in document order
+
+        .. note:: Chromium writes a folder's ``children`` before its
+           ``name`` and ``type``; so with a ``filterfunc``, urls are held
+           until each of their ancestor folders has been parsed (at most
+           the urls of one top-level folder at a time).
+        """
+        check = filterfunc not in (None, True)
+        # urls held until their ancestors are complete: [(node, path)]
+        pending = collections.deque()
+        # id(folder) -> folder: folders whose events have been read
+        # (kept alive, so that ids are not reused, while urls are pending)
+        complete = {}
+
+        def is_complete(path):
+            return all(id(x) in complete for x in path[1:])
+
+        for event in jsonstream.iter_bookmark_events(bookmarks_path,
+                                                     chunk_size=chunk_size):
+            if event.root not in roots:
+                continue
+            if not check:
+                if event.type == 'url':
+                    yield URL.json_from_dict(event.node)
+                continue
+            if event.type == 'url':
+                if not filterfunc(event.node):
+                    continue
+                if not pending and is_complete(event.path):
+                    yield URL.json_from_dict(event.node)
+                else:
+                    pending.append((event.node, event.path))
+            elif event.type == 'folder' and pending:
+                complete[id(event.node)] = event.node
+                while pending and is_complete(pending[0][1]):
+                    node, path = pending.popleft()
+                    if all(filterfunc(x) for x in path[1:]):
+                        yield URL.json_from_dict(node)
+                if not pending:
+                    complete.clear()
+
     @staticmethod
     def urlskip(url):
         # strip apps, bookmarklets, and data URIs
@@ -498,7 +847,7 @@ class ChromiumBookmarks(object):
             name = lookup(b, 'name', '')
             return ChromiumBookmarks.folderskip(name)
         else:
-            log.debug("Unknown type: %r" % (type_, b))
+            log.debug("Unknown type: %r (%r)", type_, b)
         return True
 
     @staticmethod
@@ -527,7 +876,9 @@ class ChromiumBookmarks(object):
         else:
             raise Exception("Must specify bookmarks_obj or bookmarks_path")
 
-        pluginseq = plugins.PluginSequence(pluginstrs=pluginstrs)
+        if conf is None:
+            conf = bookmarks_obj.conf
+        pluginseq = plugins.PluginSequence(pluginstrs=pluginstrs, conf=conf)
         bookmarks_obj = pluginseq.run(bookmarks_obj)
         assert bookmarks_obj
         # log.debug(('bookmarks_obj',
@@ -552,28 +903,90 @@ class ChromiumBookmarks(object):
             return o.to_json()
         return None
 
+    def verify_checksum(self):
+        """
+        Check the ``checksum`` read from the Bookmarks file
+        (see :func:`pbm.serialize.compute_checksum`)
+
+        Returns:
+            bool or None: True if it matches the current bookmarks,
+            False if not, None if there was no ``checksum``
+        """
+        if self.checksum is None:
+            return None
+        return serialize.compute_checksum(self.bookmarks_dict) == self.checksum
+
     @staticmethod
-    def _to_json(bookmarks_dict):
-        output_json = json.dumps(bookmarks_dict,
-                                 default=ChromiumBookmarks._json_default,
-                                 indent=2)
-        assert json.loads(output_json) == bookmarks_dict
+    def _to_json(bookmarks_dict, indent=2, verify=False, backend=None,
+                 checksum=True):
+        """
+        Serialize Chromium Bookmarks JSON (see :mod:`pbm.serialize`)
+
+        Args:
+            bookmarks_dict (dict): Chromium Bookmarks JSON dict
+
+        Keyword Arguments:
+            indent (None, int): indent (None for compact output)
+            verify (bool): check the node counts and digest of the output
+            backend (None, str): see :func:`pbm.serialize.get_backend`
+            checksum (bool): compute and write Chromium's ``checksum``
+
+        Returns:
+            str: JSON
+        """
+        serializer = serialize.BookmarksSerializer(
+            indent=indent,
+            default=ChromiumBookmarks._json_default,
+            backend=backend,
+            verify=verify,
+            checksum=checksum)
+        output_json = serializer.dumps(bookmarks_dict)
+        if verify:
+            serialize.verify_json(output_json, serializer.stats)
         return output_json
 
-    def to_json(self):
-        return self._to_json(self.bookmarks_dict)
+    def to_json(self, indent=2, verify=False):
+        return self._to_json(self.bookmarks_dict,
+                             indent=indent,
+                             verify=verify)
 
     @staticmethod
-    def organize_bookmarks_json(data, bookmarks_path, prompt=True):
+    def organize_bookmarks_json(data, bookmarks_path, prompt=True,
+                                verify=False,
+                                keep_backups=None,
+                                max_backup_age=None,
+                                cache_dir=None,
+                                state=None):
         """
         Overwrite Bookmarks JSON file, prompt by default, and store a backup
 
+        A dict is written with a recomputed Chromium ``checksum``
+        (so that Chromium does not discard or re-checksum the file);
+        and each folder's subtree digest is saved in the pbm state for
+        the file (so that the next run can skip unchanged folders; see
+        :mod:`pbm.merkle`).
+
+        The new file is written to a temporary file, fsync'd, and renamed
+        over ``bookmarks_path``; the old file is kept as a
+        ``<bookmarks_path>.<datetime>.bkp`` hardlink (or reflink, or copy)
+        (see :mod:`pbm.fileio`).
+
         Args:
-            data (dict): JSON-serializable object(s)
+            data (str or dict): JSON string, or a Chromium Bookmarks JSON
+                dict to serialize straight to the file, in chunks
             bookmarks_path (str): path to Bookmarks JSON file to write to
 
         Keyword Arguments:
             prompt (bool): prompt before overwriting
+            verify (bool): check the node counts and digest of the
+                written file (if ``data`` is a dict) before replacing
+                ``bookmarks_path``
+            keep_backups (int): keep at most this many ``.bkp`` backups
+            max_backup_age (timedelta or float): remove ``.bkp`` backups
+                older than this (timedelta, or a number of seconds)
+            cache_dir (str): see :func:`pbm.cache.get_cache_dir`
+            state (dict): other pbm state values to save once the file
+                is written (e.g. :attr:`ChromiumBookmarks.pending_state`)
 
         Returns:
             bool: True
@@ -586,21 +999,40 @@ class ChromiumBookmarks(object):
                     raise Exception()
                     return False
 
-        bookmarks_bkp_path = "%s.%s.bkp" % (
-            bookmarks_path,
-            datetime.datetime.now().strftime("%FT%T%z"))
+        def write(f):
+            if hasattr(data, 'items'):
+                return serialize.dump(
+                    data, f,
+                    default=ChromiumBookmarks._json_default,
+                    verify=verify,
+                    checksum=True,
+                    merkle=True)
+            f.write(data)
 
-        if os.path.exists(bookmarks_path):
-            shutil.copy(bookmarks_path, bookmarks_bkp_path)
+        def check(tmp_path, stats):
+            if verify and stats is not None:
+                serialize.verify_file(tmp_path, stats)
 
-        with codecs.open(bookmarks_path, 'w', encoding='utf8') as f:
-            f.write(data)
+        stats = fileio.atomic_write(
+            bookmarks_path,
+            write,
+            backup_path=fileio.get_backup_path(bookmarks_path),
+            check=check)
+        state = dict(state or ())
+        if stats is not None and stats.merkle is not None:
+            state[merkle.STATE_KEY] = stats.merkle
+        if state:
+            cache.update_state(bookmarks_path, cache_dir=cache_dir, **state)
+        fileio.prune_backups(bookmarks_path,
+                             keep=keep_backups,
+                             max_age=max_backup_age)
 
         bkp_file = bookmarks_path + '.bak'
         os.path.exists(bkp_file) and os.remove(bkp_file)
         return True
 
-    def organize(self, dest=None, prompt=True):
+    def organize(self, dest=None, prompt=True, verify=False,
+                 keep_backups=None, max_backup_age=None):
         """
         Overwrite Bookmarks JSON file
 
@@ -611,6 +1043,11 @@ class ChromiumBookmarks(object):
             dest (str): path to Bookmarks JSON file to write to
                         (default: self.bookmarks_path)
             prompt (bool): prompt before overwriting
+            verify (bool): check the node counts and digest of the
+                written file
+            keep_backups (int): keep at most this many ``.bkp`` backups
+            max_backup_age (timedelta or float): remove ``.bkp`` backups
+                older than this (timedelta, or a number of seconds)
 
         Returns:
             bool: True
@@ -621,11 +1058,15 @@ class ChromiumBookmarks(object):
             bookmarks_obj=self,
             # bookmarks_path=self.bookmarks_path,
             conf=self.conf)
-        bookmarks_json = self._to_json(bookmarks_dict)
         return self.organize_bookmarks_json(
-            bookmarks_json,
+            bookmarks_dict,
             dest,
-            prompt=prompt)
+            prompt=prompt,
+            verify=verify,
+            keep_backups=keep_backups,
+            max_backup_age=max_backup_age,
+            cache_dir=self.cache_dir,
+            state=self.pending_state)
 
 
 def get_chromedir(platform, release):
@@ -748,6 +1189,13 @@ def get_option_parser():
                    dest='print_json_link_list',
                    action='store_true')
 
+    prs.add_option('-s', '--search',
+                   dest='search',
+                   action='store',
+                   metavar='QUERY',
+                   help=("Search bookmark names, URLs, and folder names "
+                         "(with an index in the pbm cache dir)"))
+
     prs.add_option('--print-html', '--print-html-tree', '--html',
                    dest='print_html_tree',
                    action='store_true')
@@ -775,6 +1223,65 @@ def get_option_parser():
                    dest='skip_prompt',
                    action='store_true',
                    help="Skip organize prompt")
+    prs.add_option('--verify',
+                   dest='verify',
+                   action='store_true',
+                   help="Check the node counts and digest of the written file")
+    prs.add_option('--keep-backups',
+                   dest='keep_backups',
+                   type='int',
+                   help="Keep at most this many .bkp backups")
+    prs.add_option('--max-backup-age',
+                   dest='max_backup_age',
+                   type='float',
+                   help="Remove .bkp backups older than this many days")
+    prs.add_option('--dedupe-key',
+                   dest='dedupe_key',
+                   type='choice',
+                   choices=list(dedupe.DEDUPE_KEYS),
+                   help=("Dedupe urls by: %s (default: %s)" % (
+                       ', '.join(dedupe.DEDUPE_KEYS),
+                       dedupe.DEFAULT_DEDUPE_KEY)))
+    prs.add_option('--incremental',
+                   dest='datefolders_incremental',
+                   action='store_true',
+                   help=("Only file new bookmarks into the existing "
+                         "date folders (and skip the year folders which "
+                         "are unchanged since pbm last wrote them)"))
+    prs.add_option('--all-profiles',
+                   dest='all_profiles',
+                   action='store_true',
+                   help=("Parse and transform (and, with -w, organize) "
+                         "every profile's Bookmarks (or each Bookmarks "
+                         "path argument) in parallel; and print a report"))
+    prs.add_option('-j', '--jobs',
+                   dest='jobs',
+                   type='int',
+                   help=("Number of --all-profiles worker processes "
+                         "(default: the number of CPUs)"))
+    prs.add_option('--merge',
+                   dest='merge_output',
+                   action='store',
+                   metavar='OUTPUT',
+                   help=("Merge the urls of the Bookmarks path arguments "
+                         "(e.g. profiles and .bkp backups) by date_added, "
+                         "deduped by --dedupe-key, into a new OUTPUT "
+                         "Bookmarks file"))
+    prs.add_option('--diff',
+                   dest='diff',
+                   action='store_true',
+                   help=("Print the added, removed, moved, and renamed "
+                         "bookmarks between two Bookmarks path arguments "
+                         "(OLD NEW)"))
+    prs.add_option('--diff-json',
+                   dest='diff_json',
+                   action='store_true',
+                   help="Print the --diff as JSON")
+    prs.add_option('--no-cache',
+                   dest='no_cache',
+                   action='store_true',
+                   help=("Do not read or write the parse cache "
+                         "($XDG_CACHE_HOME/pbm)"))
 
     prs.add_option('-v', '--verbose',
                    dest='verbose',
@@ -829,19 +1336,93 @@ def main(argv=None,
     if len(args):
         opts.bookmarks_path = args[0]
 
-    cb = ChromiumBookmarks(opts.bookmarks_path)
+    conf = {}
+    if opts.dedupe_key:
+        conf['dedupe_key'] = opts.dedupe_key
+    if opts.datefolders_incremental:
+        conf['datefolders_incremental'] = True
+
+    if opts.merge_output:
+        if not args:
+            prs.error("--merge requires Bookmarks path arguments")
+        stats = merge.merge_bookmarks(args, opts.merge_output,
+                                      key=opts.dedupe_key)
+        log.info(('merge', opts.merge_output, stats))
+        print("# merged %d urls (%d duplicates) from %d files into %s" % (
+            stats.written, stats.duplicates, stats.inputs,
+            opts.merge_output), file=stdout)
+        return 0
+
+    if opts.diff or opts.diff_json:
+        if len(args) != 2:
+            prs.error("--diff requires two Bookmarks path arguments")
+        changes = diff.diff_files(args[0], args[1])
+        if opts.diff_json:
+            print(json.dumps(diff.to_json_dict(changes), indent=2),
+                  file=stdout)
+        else:
+            for line in diff.format_text(changes):
+                print(line, file=stdout)
+        return 0
+
+    if opts.all_profiles:
+        if opts.organize and not opts.skip_prompt:
+            prs.error("--all-profiles --organize requires --yes")
+        paths = list(args) or list(list_profile_bookmarks())
+        results = profiles.process_profiles(
+            paths,
+            processes=opts.jobs,
+            conf=conf,
+            organize=opts.organize,
+            verify=opts.verify,
+            keep_backups=opts.keep_backups,
+            max_backup_age=(
+                None if opts.max_backup_age is None
+                else datetime.timedelta(days=opts.max_backup_age)),
+            use_cache=not opts.no_cache)
+        for line in profiles.format_report(results):
+            print(line, file=stdout)
+        return 0 if all(result.ok for result in results) else 1
+
+    # --print-all and --print-json-link-list only need the url nodes,
+    # so stream them instead of loading the whole bookmarks_dict
+    # (the HTML templates need a ChromiumBookmarks)
+    stream = ((opts.print_all or opts.print_json_link_list)
+              and not (opts.print_html_link_list or opts.print_html_tree
+                       or opts.organize))
+    # --organize rewrites the file, so it always re-parses it
+    use_cache = not (opts.no_cache or opts.organize)
+
+    if opts.search is not None:
+        index = search.get_index(opts.bookmarks_path, use_cache=use_cache)
+        for result in index.search(opts.search):
+            url = URL.from_dict(result)
+            print(url.to_console_str(), file=stdout)
+            print("# --------------------", file=stdout)
+        return 0
+    if stream:
+        # read the parse cache only if it is current (a miss streams)
+        bookmark_store = (cache.load(opts.bookmarks_path) if use_cache
+                          else None)
+        if bookmark_store is not None:
+            cb = bookmark_store.iter_urls()
+        else:
+            cb = ChromiumBookmarks.iter_bookmarks(opts.bookmarks_path,
+                                                  stream=True)
+    else:
+        cb = ChromiumBookmarks(opts.bookmarks_path, conf=conf,
+                               use_cache=use_cache)
 
     if (opts.print_all
             or opts.print_json_link_list
             or opts.print_html_tree):
         if opts.sort_by_date:
-            sorted_bookmarks = sorted(
-                cb,
-                key=lambda x: (
-                    x.get('date_modified', 0)
-                    or x.get('date_added', 0)),
+            bookmarks_list = list(cb)
+            order = utils.argsort_longdates(
+                (x.get('date_modified') or x.get('date_added')
+                 for x in bookmarks_list),
                 reverse=opts.sort_reverse)
-            bookmarks_iter = sorted_bookmarks
+            bookmarks_iter = [bookmarks_list[i] for i in order]
         else:
             bookmarks_iter = cb
 
@@ -861,16 +1442,24 @@ def main(argv=None,
             elif opts.print_html_tree:
                 template_name = 'bookmarks_tree_partial.jinja'
 
-            t = utils.get_template(template_name)
-            htmlstr = t.render({
-                'bookmarks': cb,
-                'bookmarks_iter': iter(cb),
-                'format_longdate': pbm.app.format_longdate,
-                'rdf_uri_escape': pbm.app.rdf_uri_escape})
-            print(htmlstr, file=stdout)
+            # write each chunk as it is rendered
+            for chunk in utils.generate_template(template_name, {
+                    'bookmarks': cb,
+                    'bookmarks_iter': iter(cb),
+                    'longdate_isoformats': cb.get_longdate_isoformats(),
+                    'rdf_uri_escape': pbm.app.rdf_uri_escape}):
+                print(chunk, end='', file=stdout)
+                stdout.flush()
+            print(u'', file=stdout)
 
     if opts.organize:
-        cb.organize(prompt=(not opts.skip_prompt))
+        cb.organize(
+            prompt=(not opts.skip_prompt),
+            verify=opts.verify,
+            keep_backups=opts.keep_backups,
+            max_backup_age=(
+                None if opts.max_backup_age is None
+                else datetime.timedelta(days=opts.max_backup_age)))
 
     return 0
 
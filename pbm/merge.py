@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+pbm/merge.py -- merge many Bookmarks files (and backups) into one
+
+Each input's urls are streamed (:meth:`ChromiumBookmarks.stream_bookmarks`)
+and sorted by ``date_added`` in bounded runs (spilled to temporary
+files); the sorted inputs are k-way merged with a heap, deduped on the
+fly (see :mod:`pbm.plugins.dedupe`; the oldest url is kept), and
+written, with new ids, to the ``bookmark_bar`` of one new Bookmarks
+file. Memory is proportional to the number of inputs (and runs) and to
+the set of dedupe keys; not to the number of urls.
+
+.. code:: python
+
+    stats = merge_bookmarks(['./Default/Bookmarks',
+                             './Default/Bookmarks.2016-01-01T00:00:00.bkp'],
+                            './Merged/Bookmarks',
+                            key='url')
+
+"""
+
+import collections
+import heapq
+import json
+import logging
+import tempfile
+
+import pbm.fileio as fileio
+import pbm.serialize as serialize
+import pbm.utils as utils
+from pbm.plugins.dedupe import DedupeObj
+
+log = logging.getLogger(__name__)
+
+
+# urls per sorted run (held in memory while sorting each run)
+DEFAULT_RUN_SIZE = 50000
+
+MERGE_ROOTS = ('bookmark_bar', 'other', 'synced')
+
+# output roots: key, id, name
+OUTPUT_ROOTS = (
+    ('bookmark_bar', '1', 'Bookmarks bar'),
+    ('other', '2', 'Other bookmarks'),
+    ('synced', '3', 'Mobile bookmarks'),
+)
+
+_CHILDREN_MARKER = u'pbm.merge:children'
+_CHECKSUM_MARKER = u'pbm.merge:checksum'
+
+
+MergeStats = collections.namedtuple('MergeStats', (
+    'inputs',
+    'urls',
+    'duplicates',
+    'written',
+    'runs',
+    'checksum'))
+
+
+def _write_run(run, tmpdir=None):
+    f = tempfile.TemporaryFile(mode='w+b', dir=tmpdir)
+    for item in run:
+        f.write(json.dumps(item).encode('utf-8'))
+        f.write(b'\n')
+    f.seek(0)
+    return f
+
+
+def _read_run(f):
+    try:
+        for line in f:
+            date, seq, url = json.loads(
+                line.decode('utf-8'),
+                object_pairs_hook=collections.OrderedDict)
+            yield date, seq, url
+    finally:
+        f.close()
+
+
+def iter_sorted_urls(path, run_size=DEFAULT_RUN_SIZE, tmpdir=None,
+                     roots=MERGE_ROOTS, stats=None):
+    """
+    Stream the urls of a Bookmarks file in ``date_added`` order
+    (an external merge sort: runs of ``run_size`` urls are sorted in
+    memory and spilled to temporary files, then merged)
+
+    Args:
+        path (str): path to a Chromium Bookmarks JSON file
+
+    Keyword Arguments:
+        run_size (int): urls per sorted run
+        tmpdir (str): directory for the run files (default: tempfile's)
+        roots (tuple[str]): ``roots`` keys to read
+        stats (Counter): counts ``url`` and ``run``
+
+    Yields:
+        tuple: (date_added (int), sequence number (int), URL dict);
+        urls with the same date are in document order
+    """
+    if stats is None:
+        stats = collections.Counter()
+    run = []
+    runs = []
+    # pbm.main imports this module
+    import pbm.main
+    urls = pbm.main.ChromiumBookmarks.stream_bookmarks(path, roots=roots)
+    for seq, url in enumerate(urls):
+        stats['url'] += 1
+        run.append((utils.parse_longdate(url.get('date_added')) or 0,
+                    seq, url))
+        if len(run) >= run_size:
+            run.sort()
+            runs.append(_write_run(run, tmpdir=tmpdir))
+            run = []
+    run.sort()
+    if not runs:
+        stats['run'] += 1
+        for item in run:
+            yield item
+        return
+    if run:
+        runs.append(_write_run(run, tmpdir=tmpdir))
+        del run
+    stats['run'] += len(runs)
+    log.debug(('merge.iter_sorted_urls.runs', path, len(runs)))
+    for item in heapq.merge(*[_read_run(f) for f in runs]):
+        yield item
+
+
+def iter_merged_urls(paths, key=None, run_size=DEFAULT_RUN_SIZE,
+                     tmpdir=None, stats=None):
+    """
+    K-way merge the urls of Bookmarks files by ``date_added``; skipping
+    duplicates (the oldest url is kept)
+
+    Args:
+        paths (list[str]): paths to Chromium Bookmarks JSON files
+
+    Keyword Arguments:
+        key (None, str, callable): dedupe key (see
+            :func:`pbm.plugins.dedupe.get_dedupe_keyfunc`)
+        run_size (int): see :func:`iter_sorted_urls`
+        tmpdir (str): see :func:`iter_sorted_urls`
+        stats (Counter): counts ``url``, ``run``, and ``duplicate``
+
+    Yields:
+        dict: URL dicts
+    """
+    if stats is None:
+        stats = collections.Counter()
+    dedupe_obj = DedupeObj(key=key)
+
+    def iter_input(index, path):
+        for date, seq, url in iter_sorted_urls(path, run_size=run_size,
+                                               tmpdir=tmpdir, stats=stats):
+            yield date, index, seq, url
+
+    for _, _, _, url in heapq.merge(*[iter_input(index, path)
+                                      for index, path in enumerate(paths)]):
+        if dedupe_obj.is_duplicate_bookmark(url):
+            stats['duplicate'] += 1
+            continue
+        yield url
+
+
+def make_output_skeleton(date_added=None):
+    """
+    Keyword Arguments:
+        date_added (str): root folders' ``date_added`` (default: now)
+
+    Returns:
+        OrderedDict: a Bookmarks JSON dict with empty roots
+        (and placeholders for the ``bookmark_bar`` children and the
+        ``checksum``)
+    """
+    if date_added is None:
+        date_added = str(int(utils.get_datetime_now_longdate()))
+    roots = collections.OrderedDict()
+    for key, id_, name in OUTPUT_ROOTS:
+        roots[key] = collections.OrderedDict((
+            ('children', []),
+            ('date_added', date_added),
+            ('date_modified', '0'),
+            ('id', id_),
+            ('name', name),
+            ('type', 'folder'),
+        ))
+    roots['bookmark_bar']['children'].append(_CHILDREN_MARKER)
+    return collections.OrderedDict((
+        ('roots', roots),
+        ('version', 1),
+        ('checksum', _CHECKSUM_MARKER),
+    ))
+
+
+def write_merged(urls, f, indent=serialize.DEFAULT_INDENT, date_added=None,
+                 stats=None):
+    """
+    Write a Bookmarks JSON file with ``urls`` in its ``bookmark_bar``
+    (one url at a time; with new ids and Chromium's ``checksum``)
+
+    Args:
+        urls (iterable[dict]): URL dicts
+        f (file): text file object to write to
+
+    Keyword Arguments:
+        indent (int): JSON indent
+        date_added (str): root folders' ``date_added`` (default: now)
+        stats (Counter): counts ``written``
+
+    Returns:
+        str: the ``checksum``
+    """
+    if stats is None:
+        stats = collections.Counter()
+    skeleton = make_output_skeleton(date_added=date_added)
+    roots = skeleton['roots']
+    text = serialize.dumps(skeleton, indent=indent, backend='json')
+    children_marker = json.dumps(_CHILDREN_MARKER)
+    start = text.index(children_marker)
+    line_start = text.rindex('\n', 0, start) + 1
+    prefix = text[:line_start]
+    node_indent = text[line_start:start]
+    suffix = text[start + len(children_marker):]
+    # (as json.dumps: ', ' on python 2)
+    item_separator = json.JSONEncoder(indent=indent).item_separator
+
+    checksum = serialize.BookmarksChecksum(roots=roots)
+    checksum.start_root('bookmark_bar')
+    checksum.update_node(roots['bookmark_bar'])
+    f.write(prefix)
+    next_id = len(OUTPUT_ROOTS) + 1
+    for url in urls:
+        node = collections.OrderedDict((
+            ('date_added', url.get('date_added')),
+            ('id', str(next_id)),
+            ('name', url.get('name')),
+            ('type', 'url'),
+            ('url', url.get('url')),
+        ))
+        next_id += 1
+        checksum.update_node(node)
+        if stats['written']:
+            f.write(item_separator + u'\n')
+        f.write(node_indent)
+        f.write(serialize.dumps(node, indent=indent, backend='json').replace(
+            u'\n', u'\n' + node_indent))
+        stats['written'] += 1
+    checksum.end_root('bookmark_bar')
+    for key, _, _ in OUTPUT_ROOTS[1:]:
+        checksum.start_root(key)
+        checksum.update_node(roots[key])
+        checksum.end_root(key)
+    hexdigest = checksum.hexdigest()
+    f.write(suffix.replace(json.dumps(_CHECKSUM_MARKER),
+                           json.dumps(hexdigest)))
+    return hexdigest
+
+
+def merge_bookmarks(paths, output_path, key=None, run_size=DEFAULT_RUN_SIZE,
+                    tmpdir=None, backup=True):
+    """
+    Merge Bookmarks files into one new Bookmarks file
+    (see :func:`iter_merged_urls` and :func:`write_merged`)
+
+    Args:
+        paths (list[str]): paths to Chromium Bookmarks JSON files
+            (e.g. profiles and their ``.bkp`` backups)
+        output_path (str): path to write the merged Bookmarks file to
+
+    Keyword Arguments:
+        key (None, str, callable): dedupe key (see
+            :func:`pbm.plugins.dedupe.get_dedupe_keyfunc`)
+        run_size (int): see :func:`iter_sorted_urls`
+        tmpdir (str): see :func:`iter_sorted_urls`
+        backup (bool): keep an existing ``output_path`` as a ``.bkp``
+            (see :func:`pbm.fileio.get_backup_path`)
+
+    Returns:
+        MergeStats: counts and the ``checksum``
+    """
+    paths = list(paths)
+    stats = collections.Counter()
+    urls = iter_merged_urls(paths, key=key, run_size=run_size,
+                            tmpdir=tmpdir, stats=stats)
+    checksum = fileio.atomic_write(
+        output_path,
+        lambda f: write_merged(urls, f, stats=stats),
+        backup_path=(fileio.get_backup_path(output_path)
+                     if backup else None))
+    return MergeStats(
+        inputs=len(paths),
+        urls=stats['url'],
+        duplicates=stats['duplicate'],
+        written=stats['written'],
+        runs=stats['run'],
+        checksum=checksum)
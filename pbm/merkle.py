@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+pbm/merkle.py -- content hashes of bookmark subtrees
+
+Each node's digest covers its own content (``type``, ``name``, ``url``,
+``date_added``) and, in order, its children's digests; so two subtrees
+with the same digest have the same content, and comparing two subtrees
+costs O(1) once they are hashed. ``id``, ``guid``, ``date_modified``,
+and ``meta_info`` are not hashed: they change when a file is rewritten
+(or synced) without changing its bookmarks.
+
+Each folder's digest (by folder ``id``) is saved in the pbm state for
+the file when pbm writes a Bookmarks file (see :func:`save_hexdigests`
+and :func:`pbm.cache.update_state`; not in the file's ``meta_info``,
+which Chromium syncs); so the next run can tell which subtrees changed
+since (see :meth:`SubtreeHashes.changed`).
+
+.. code:: python
+
+    hashes = compute_hashes(bookmarks_dict['roots']['bookmark_bar'])
+    hexdigest(hashes[id(node)])
+
+    subtree_hashes = SubtreeHashes(stored=load_hexdigests(path))
+    subtree_hashes.changed(folder)  # since save_hexdigests
+
+"""
+
+import collections
+import hashlib
+import logging
+
+import pbm.cache as cache
+
+log = logging.getLogger(__name__)
+
+try:
+    text_type = unicode
+except NameError:  # pragma: no cover
+    text_type = str
+
+
+HASH_FIELDS = ('type', 'name', 'url', 'date_added')
+
+# pbm state key: folder id -> the folder's hexdigest when pbm last
+# wrote the file
+STATE_KEY = 'merkle'
+
+HASH_ROOTS = ('bookmark_bar', 'other', 'synced')
+
+_SEPARATOR = b'\x00'
+_CHILDREN = b'\x01'
+
+
+def _field_bytes(value):
+    if value is None:
+        return b''
+    if not isinstance(value, text_type):
+        value = text_type(value)
+    return value.encode('utf-8')
+
+
+def node_digest(node, child_digests=()):
+    """
+    Args:
+        node (dict): a bookmarks node (URL or folder dict)
+
+    Keyword Arguments:
+        child_digests (iterable[bytes]): the digests of ``node``'s
+            children (in order)
+
+    Returns:
+        bytes: the SHA1 digest of ``node``'s :data:`HASH_FIELDS` and
+        ``child_digests``
+    """
+    h = hashlib.sha1()
+    h.update(_SEPARATOR.join(_field_bytes(node.get(field))
+                             for field in HASH_FIELDS))
+    h.update(_CHILDREN)
+    for digest in child_digests:
+        h.update(digest)
+    return h.digest()
+
+
+def compute_hashes(node, hashes=None):
+    """
+    Hash every node of a subtree (iteratively, children first)
+
+    Args:
+        node (dict): a bookmarks node (e.g. a ``roots`` folder)
+
+    Keyword Arguments:
+        hashes (dict): dict to add the digests to
+            (e.g. to hash several roots into one dict)
+
+    Returns:
+        dict: ``id(node)`` -> digest (bytes); for every node in the
+        subtree (the nodes must outlive the dict)
+    """
+    if hashes is None:
+        hashes = {}
+    stack = [(node, False)]
+    while stack:
+        _node, visited = stack.pop()
+        children = _node.get('children') or ()
+        if visited or not children:
+            hashes[id(_node)] = node_digest(
+                _node, (hashes[id(child)] for child in children))
+            continue
+        stack.append((_node, True))
+        stack.extend((child, False) for child in reversed(children))
+    return hashes
+
+
+def hexdigest(digest):
+    """
+    Args:
+        digest (bytes): a digest from :func:`node_digest`
+
+    Returns:
+        str: the digest as hex
+    """
+    return ''.join('%02x' % c for c in bytearray(digest))
+
+
+class SubtreeHashes(object):
+
+    """
+    Subtree digests (computed on first use, for each subtree asked
+    about), and the digests saved by the last :func:`save_hexdigests`
+
+    Digests are keyed by ``id(node)``: an instance is only valid until
+    the tree is next mutated (see
+    :meth:`pbm.main.ChromiumBookmarks.get_subtree_hashes`).
+    """
+
+    def __init__(self, stored=None):
+        """
+        Keyword Arguments:
+            stored (dict): folder id -> hexdigest (see
+                :func:`load_hexdigests`)
+        """
+        self.hashes = {}
+        self.stored = stored if stored is not None else {}
+        # keep the hashed subtrees (and so their ids) alive
+        self._nodes = []
+
+    def digest(self, node):
+        """
+        Args:
+            node (dict): a bookmarks node
+
+        Returns:
+            bytes: the digest of ``node``'s subtree
+        """
+        digest = self.hashes.get(id(node))
+        if digest is None:
+            compute_hashes(node, hashes=self.hashes)
+            self._nodes.append(node)
+            digest = self.hashes[id(node)]
+        return digest
+
+    def hexdigest(self, node):
+        """
+        Args:
+            node (dict): a bookmarks node
+
+        Returns:
+            str: the digest of ``node``'s subtree, as hex
+        """
+        return hexdigest(self.digest(node))
+
+    def stored_hexdigest(self, node):
+        """
+        Args:
+            node (dict): a folder node
+
+        Returns:
+            str or None: the saved hexdigest of the folder with
+            ``node``'s id (None if there is none)
+        """
+        return self.stored.get(text_type(node.get('id')))
+
+    def changed(self, node):
+        """
+        Args:
+            node (dict): a folder node
+
+        Returns:
+            bool: True if ``node``'s subtree changed since its digest was
+            saved (or if no digest was saved)
+        """
+        stored = self.stored_hexdigest(node)
+        return stored is None or stored != self.hexdigest(node)
+
+
+def folder_hexdigests(bookmarks_dict, subtree_hashes=None):
+    """
+    Args:
+        bookmarks_dict (dict): Chromium Bookmarks JSON dict
+
+    Keyword Arguments:
+        subtree_hashes (SubtreeHashes): already computed digests
+
+    Returns:
+        OrderedDict: folder id (str) -> hexdigest; for every folder in
+        the :data:`HASH_ROOTS`
+    """
+    if subtree_hashes is None:
+        subtree_hashes = SubtreeHashes()
+    roots = bookmarks_dict.get('roots') or {}
+    hexdigests = collections.OrderedDict()
+    for key in HASH_ROOTS:
+        root = roots.get(key)
+        if not hasattr(root, 'get'):
+            continue
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node.get('type') != 'folder':
+                continue
+            hexdigests[text_type(node.get('id'))] = (
+                subtree_hashes.hexdigest(node))
+            stack.extend(reversed(node.get('children') or ()))
+    return hexdigests
+
+
+def load_hexdigests(bookmarks_path, cache_dir=None):
+    """
+    Args:
+        bookmarks_path (str): path to a Bookmarks JSON file
+
+    Keyword Arguments:
+        cache_dir (str): see :func:`pbm.cache.get_cache_dir`
+
+    Returns:
+        dict: folder id -> hexdigest, as saved by :func:`save_hexdigests`
+    """
+    return cache.load_state(bookmarks_path, cache_dir=cache_dir).get(
+        STATE_KEY) or {}
+
+
+def save_hexdigests(bookmarks_path, hexdigests, cache_dir=None):
+    """
+    Save the folder digests of the file pbm just wrote
+
+    Args:
+        bookmarks_path (str): path to the Bookmarks JSON file
+        hexdigests (dict): see :func:`folder_hexdigests`
+
+    Keyword Arguments:
+        cache_dir (str): see :func:`pbm.cache.get_cache_dir`
+
+    Returns:
+        str or None: path to the state file (None if it was not written)
+    """
+    return cache.update_state(bookmarks_path, cache_dir=cache_dir,
+                              **{STATE_KEY: hexdigests})
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+pbm/pagination.py -- cursor pagination over bookmark urls
+
+A :class:`PageIndex` is built once per bookmarks version (see
+:meth:`pbm.main.ChromiumBookmarks.get_page_index`): the urls in tree
+order and the positions sorted by ``date_added``; so each page
+(``limit`` urls after an ``after`` cursor; optionally ``since`` a date)
+costs O(limit), not O(total).
+
+A cursor names the last url of the previous page, so that pages
+continue when urls are added (e.g. after a reload):
+``<date_added>:<id>:<n>`` in a date order (the ``n``-th url with that
+date and id; located with ``bisect``), and ``<id>:<n>`` in tree order
+(ids are not unique: Chromium and pbm both write duplicate ids).
+If a date cursor's url is gone, the next page starts with the urls
+with the cursor's date (so no url is skipped).
+
+.. code:: python
+
+    index = PageIndex(iter(cb))
+    page = index.page(limit=100, order='-date')  # the newest 100
+    page = index.page(limit=100, order='-date', after=page.next_after)
+
+"""
+
+import array
+import bisect
+import collections
+import datetime
+import logging
+import re
+
+import pbm.utils as utils
+
+log = logging.getLogger(__name__)
+
+try:
+    text_type = unicode
+except NameError:  # pragma: no cover
+    text_type = str
+
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 10000
+
+# tree: document order; date: oldest first; -date: newest first
+ORDERS = ('tree', 'date', '-date')
+
+ISO_DATE_RGX = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?)?Z?$')
+
+
+class Page(collections.namedtuple('Page', ('urls', 'next_after'))):
+
+    """
+    Attributes:
+        urls (list[dict]): URL dicts
+        next_after (str or None): the ``after`` cursor for the next page
+            (None if this is the last page)
+    """
+
+
+def parse_since(value):
+    """
+    Args:
+        value (str): a Chromium longdate, or an ISO 8601 date or
+            datetime (UTC; e.g. ``2016-01-31`` or ``2016-01-31T12:00:00Z``)
+
+    Raises:
+        ValueError: if ``value`` is not a date
+
+    Returns:
+        int: Chromium longdate
+    """
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    match = ISO_DATE_RGX.match(value)
+    if match is None:
+        raise ValueError("Unsupported date: %r" % value)
+    parts = match.groups()
+    microsecond = int((parts[6] or '0').ljust(6, '0'))
+    dt = datetime.datetime(*[int(x or 0) for x in parts[:6]],
+                           microsecond=microsecond)
+    # (exactly; utils.datetime_to_longdate rounds through a float)
+    delta = dt - datetime.datetime(1970, 1, 1)
+    seconds = delta.days * 86400 + delta.seconds + utils.DATETIME_CONST
+    return seconds * 1000000 + delta.microseconds
+
+
+class PageIndex(object):
+
+    """
+    Ordered index over bookmark urls (for cursor pagination)
+
+    Attributes:
+        urls (list[dict]): URL dicts (in tree order)
+        by_date (array): positions, sorted by ``date_added``
+            (stable; missing dates sort first)
+        dates (list[int]): the sorted ``date_added`` values
+        positions (dict): id (str) -> positions (in tree order)
+    """
+
+    def __init__(self, urls):
+        """
+        Args:
+            urls (iterable[dict]): URL dicts (e.g. ``iter(cb)``)
+        """
+        self.urls = list(urls)
+        date_added = [url.get('date_added') for url in self.urls]
+        self.by_date = array.array(
+            'l', utils.argsort_longdates(date_added))
+        self.dates = [utils.parse_longdate(date_added[x]) or 0
+                      for x in self.by_date]
+        self.positions = {}
+        for position, url in enumerate(self.urls):
+            self.positions.setdefault(
+                text_type(url.get('id')), []).append(position)
+
+    def __len__(self):
+        return len(self.urls)
+
+    def _date_index(self, rank, order):
+        # rank in a date order -> index into by_date and dates
+        return rank if order == 'date' else len(self.urls) - 1 - rank
+
+    def make_cursor(self, rank, order='tree'):
+        """
+        Args:
+            rank (int): position of a url in ``order``
+
+        Keyword Arguments:
+            order (str): one of :data:`ORDERS`
+
+        Returns:
+            str: an ``after`` cursor for the url
+        """
+        if order == 'tree':
+            id_ = text_type(self.urls[rank].get('id'))
+            n = bisect.bisect_left(self.positions[id_], rank)
+            return u'%s:%d' % (id_, n)
+        i = self._date_index(rank, order)
+        date = self.dates[i]
+        id_ = text_type(self.urls[self.by_date[i]].get('id'))
+        lo = bisect.bisect_left(self.dates, date)
+        n = sum(1 for x in self.by_date[lo:i]
+                if text_type(self.urls[x].get('id')) == id_)
+        return u'%d:%s:%d' % (date, id_, n)
+
+    def parse_cursor(self, after, order='tree'):
+        """
+        Args:
+            after (str): an ``after`` cursor (see :meth:`make_cursor`)
+
+        Keyword Arguments:
+            order (str): one of :data:`ORDERS`
+
+        Raises:
+            KeyError: if ``after`` is not a cursor (in ``order``); or if
+                a tree cursor's url is not in this index
+
+        Returns:
+            int: the position (in ``order``) after which the next page
+            starts
+        """
+        after = text_type(after)
+        try:
+            if order == 'tree':
+                id_, n = after.rsplit(u':', 1)
+                n = int(n)
+                if n < 0:
+                    raise ValueError(n)
+                return self.positions[id_][n]
+            date, _, rest = after.partition(u':')
+            id_, n = rest.rsplit(u':', 1)
+            date, n = int(date), int(n)
+            if n < 0:
+                raise ValueError(n)
+        except (KeyError, IndexError, ValueError):
+            raise KeyError(after)
+        lo = bisect.bisect_left(self.dates, date)
+        hi = bisect.bisect_right(self.dates, date, lo)
+        for i in range(lo, hi):
+            if text_type(self.urls[self.by_date[i]].get('id')) == id_:
+                if not n:
+                    break
+                n -= 1
+        else:
+            # the url is gone: start with the urls with this date
+            i = lo - 1 if order == 'date' else hi
+        return i if order == 'date' else len(self.urls) - 1 - i
+
+    def page(self, limit=DEFAULT_PAGE_LIMIT, after=None, since=None,
+             order='tree'):
+        """
+        Args:
+            limit (int): maximum number of urls
+
+        Keyword Arguments:
+            after (str): the previous page's ``next_after`` cursor
+            since (int): only urls added at or after this Chromium longdate
+                (requires a date ``order``)
+            order (str): one of :data:`ORDERS`
+
+        Raises:
+            KeyError: if ``after`` is not a cursor for this index
+            ValueError: for an unsupported ``order`` (or ``since`` with
+                tree order)
+
+        Returns:
+            Page: the page
+        """
+        if order not in ORDERS:
+            raise ValueError("Unsupported order: %r" % order)
+        if since is not None and order == 'tree':
+            raise ValueError("since requires a date order")
+        count = len(self.urls)
+        start, end = 0, count
+        if since is not None:
+            if order == 'date':
+                start = bisect.bisect_left(self.dates, since)
+            else:
+                end = count - bisect.bisect_left(self.dates, since)
+        if after is not None:
+            start = max(start, self.parse_cursor(after, order) + 1)
+        stop = min(start + limit, end)
+        if order == 'tree':
+            urls = self.urls[start:stop]
+        elif order == 'date':
+            urls = [self.urls[x] for x in self.by_date[start:stop]]
+        else:
+            urls = [self.urls[self.by_date[count - 1 - i]]
+                    for i in range(start, stop)]
+        next_after = None
+        if urls and stop < end:
+            next_after = self.make_cursor(stop - 1, order)
+        return Page(urls, next_after)
@@ -7,8 +7,10 @@ import datetime
 import importlib
 import inspect
 import logging
+import time
 
 
+import pbm.merkle as merkle
 import pbm.utils as utils
 iteritems = utils.iteritems
 
@@ -23,6 +25,16 @@ class PromiumPlugin(object):
         'postprocess_bookmarks'
     ]
 
+    # True if this plugin calls ``bookmarks_obj.invalidate()`` itself
+    # after mutating ``bookmarks_dict`` in place; otherwise
+    # PluginSequence.run invalidates cached views after each step
+    invalidates_caches = False
+
+    # one of PLUGIN_FUNCS: in that phase, PluginSequence.run calls
+    # visit_folder / visit_url from one traversal shared by all of the
+    # visiting plugins, and then calls finish instead of the phase function
+    visit_phase = None
+
     def __init__(self, conf=None):
         if conf is None:
             conf = {}
@@ -37,6 +49,66 @@ class PromiumPlugin(object):
     def postprocess_bookmarks(self, bookmarks_obj):
         return bookmarks_obj
 
+    def start(self, bookmarks_obj):
+        """
+        Called before the traversal (see :meth:`PluginSequence.visit`)
+
+        Args:
+            bookmarks_obj (ChromiumBookmarks): bookmarks object
+        """
+        return None
+
+    def visit_folder(self, node, path):
+        """
+        Visit a (filtered) folder node
+
+        Args:
+            node (dict): folder node (do not mutate)
+            path (list[dict]): ancestor folder nodes (root folder first)
+
+        Returns:
+            bool: False to skip this folder's children (for this plugin)
+        """
+        return True
+
+    def visit_url(self, node, path):
+        """
+        Visit a (filtered) url node
+
+        Args:
+            node (dict): url node (do not mutate)
+            path (list[dict]): ancestor folder nodes (root folder first)
+        """
+        return None
+
+    def finish(self, bookmarks_obj):
+        """
+        Called after the traversal, in place of the ``visit_phase`` function
+
+        Args:
+            bookmarks_obj (ChromiumBookmarks): bookmarks object
+
+        Returns:
+            ChromiumBookmarks: transformed bookmarks_obj
+        """
+        return bookmarks_obj
+
+    @staticmethod
+    def subtree_changed(bookmarks_obj, node):
+        """
+        Whether a folder's subtree changed since pbm last wrote it
+        (so a plugin can skip untouched folders; see
+        :meth:`PluginSequence.get_subtree_hashes`)
+
+        Args:
+            bookmarks_obj (ChromiumBookmarks): bookmarks object
+            node (dict): folder node (in ``bookmarks_obj.bookmarks_dict``)
+
+        Returns:
+            bool: True if changed (or never written by pbm)
+        """
+        return PluginSequence.get_subtree_hashes(bookmarks_obj).changed(node)
+
 
 TRACE = logging.DEBUG + 1
 logging.addLevelName('TRACE', TRACE)
@@ -57,10 +129,14 @@ class PluginSequence(object):
 
     PLUGIN_FUNCS = PromiumPlugin.PLUGIN_FUNCS
 
-    def __init__(self, pluginstrs=None, conf=None):
+    def __init__(self, pluginstrs=None, conf=None, fused=True):
         if conf is None:
             conf = {}
         self.conf = conf
+        self.fused = fused
+        self.walks = collections.Counter()
+        # seconds spent in each PLUGIN_FUNCS phase (by the last run)
+        self.timings = collections.OrderedDict()
         self.pluginstrs = pluginstrs
         self.plugins = None
         if pluginstrs is not None:
@@ -137,40 +213,125 @@ class PluginSequence(object):
                 plugins_list = self.load_plugins(pluginstrs)
 
         # collect Plugin.PLUGIN_FUNCS into a sequence dict
+        # (with Plugin.finish in place of the Plugin.visit_phase function)
         plugins_dict = collections.OrderedDict()
         seq_dict = collections.OrderedDict()
+        visitors_dict = collections.OrderedDict()
         for i, Plugin_cls in enumerate(plugins_list):
             key = (i, Plugin_cls)
             plugin = plugins_dict[key] = Plugin_cls(self.conf)
+            visit_phase = getattr(plugin, 'visit_phase', None)
             for fn_name in self.PLUGIN_FUNCS:
-                _fn = getattr(plugin, fn_name, None)
+                if self.fused and fn_name == visit_phase:
+                    visitors_dict.setdefault(fn_name, []).append(plugin)
+                    _fn = plugin.finish
+                else:
+                    _fn = getattr(plugin, fn_name, None)
                 if _fn:
                     list_ = seq_dict.setdefault(fn_name, [])
                     list_.append(((key, fn_name), _fn))
 
         # run each function in the sequence dict
         # and make assertions
+        self.timings = collections.OrderedDict()
         for fn_name, seq in iteritems(seq_dict):
             log.debug(('sequence.step', fn_name))
+            visitors = visitors_dict.get(fn_name)
+            start = time.time()
             for key, _fn in seq:
                 mrostr = inspect.getmro(_fn.__class__)
                 if not hasattr(bookmarks_obj, 'bookmarks_dict'):
                     raise Exception((_fn, bookmarks_obj))
 
+                # one traversal for all of this phase's visiting plugins,
+                # just before the first of them
+                if visitors and _fn.__self__ in visitors:
+                    self.visit(bookmarks_obj, visitors)
+                    self.walks[fn_name] += 1
+                    visitors = None
+
                 log.debug(('sequence.step.%s' % fn_name, _fn))
                 bookmarks_obj_2 = _fn(bookmarks_obj)
                 if not bookmarks_obj_2:
                     raise Exception(mrostr, bookmarks_obj_2)
                 if not hasattr(bookmarks_obj_2, 'bookmarks_dict'):
                     raise Exception((_fn, bookmarks_obj_2))
+                if not getattr(_fn.__self__, 'invalidates_caches', False):
+                    invalidate = getattr(bookmarks_obj_2, 'invalidate', None)
+                    if invalidate is not None:
+                        invalidate()
 
                 # XXX
                 #log.debug(('sequence.step.%s' % fn_name, _fn,
                 #           bookmarks_obj_2.bookmarks_dict))
                 bookmarks_obj = bookmarks_obj_2
+            self.timings[fn_name] = time.time() - start
 
         return bookmarks_obj
 
+    @staticmethod
+    def get_subtree_hashes(bookmarks_obj):
+        """
+        Args:
+            bookmarks_obj (ChromiumBookmarks): bookmarks object
+
+        Returns:
+            pbm.merkle.SubtreeHashes: subtree digests of the current
+            ``bookmarks_dict`` (see
+            :meth:`pbm.main.ChromiumBookmarks.get_subtree_hashes`) and
+            the digests stored when pbm last wrote it
+        """
+        get_subtree_hashes = getattr(bookmarks_obj, 'get_subtree_hashes',
+                                     None)
+        if get_subtree_hashes is not None:
+            return get_subtree_hashes()
+        return merkle.SubtreeHashes()
+
+    @staticmethod
+    def visit(bookmarks_obj, visitors, filterfunc=None):
+        """
+        Walk the (filtered) ``bookmark_bar`` and ``other`` roots once;
+        calling ``start`` and then ``visit_folder`` and ``visit_url``
+        on each visitor
+
+        Args:
+            bookmarks_obj (ChromiumBookmarks): bookmarks object
+            visitors (list[PromiumPlugin]): visiting plugins
+
+        Keyword Arguments:
+            filterfunc (None, callable): True to include
+                (default: ``bookmarks_obj.chrome_filterfunc``, as
+                ``bookmarks_obj.bookmarks_list``)
+        """
+        if filterfunc is None:
+            filterfunc = bookmarks_obj.chrome_filterfunc
+
+        def visit_folder(folder, path, visitors):
+            visitors = [v for v in visitors
+                        if v.visit_folder(folder, path) is not False]
+            if not visitors:
+                return
+            _path = path + [folder]
+            for item in folder.get('children', []) or []:
+                if not (item and hasattr(item, 'get') and 'type' in item):
+                    continue
+                if not filterfunc(item):
+                    continue
+                _item_type = item.get('type')
+                if _item_type == 'folder':
+                    visit_folder(item, _path, visitors)
+                elif _item_type == 'url':
+                    for v in visitors:
+                        v.visit_url(item, _path)
+
+        for v in visitors:
+            v.start(bookmarks_obj)
+
+        roots = bookmarks_obj.bookmarks_dict['roots']
+        for key in ('bookmark_bar', 'other'):
+            if key in roots:
+                visit_folder(roots[key], [], visitors)
+
 
 __all__ = ['PromiumPlugin', 'DEFAULT_PLUGINS', 'PluginSequence',
            'get_datetime_now_longdate']
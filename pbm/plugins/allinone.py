@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 
+import pbm.main
 import pbm.plugins
 import pbm.utils
 
@@ -11,6 +12,12 @@ log = logging.getLogger(__name__)
 
 class AdditionalAllFolderPlugin(pbm.plugins.PromiumPlugin):
     folder_name__ = 'all'
+    invalidates_caches = True
+    visit_phase = 'postprocess_bookmarks'
+
+    def __init__(self, conf=None):
+        super(AdditionalAllFolderPlugin, self).__init__(conf=conf)
+        self.bookmarks_list = []
 
     def preprocess_bookmarks(self, bookmarks_obj):
         bookmarks_dict = bookmarks_obj.bookmarks_dict
@@ -25,15 +32,29 @@ class AdditionalAllFolderPlugin(pbm.plugins.PromiumPlugin):
         nodes = bookmarks_dict['roots']['other']['children']
         nodes = [n for n in nodes if n.get('name') != self.folder_name__]
         bookmarks_dict['roots']['other']['children'] = nodes
+        bookmarks_obj.invalidate()
         return bookmarks_obj
 
-    def duplicate_list(self, bookmarks_obj):
-        for bookmark in bookmarks_obj.bookmarks_list:
+    def duplicate_list(self, bookmarks_obj, bookmarks_list=None):
+        if bookmarks_list is None:
+            bookmarks_list = bookmarks_obj.bookmarks_list
+        for bookmark in bookmarks_list:
             b = bookmark.copy()
             b['id'] = bookmarks_obj.ids.next()
             yield b
 
-    def postprocess_bookmarks(self, bookmarks_obj):
+    def visit_url(self, node, path):
+        self.bookmarks_list.append(pbm.main.URL.json_from_dict(node))
+
+    def finish(self, bookmarks_obj):
+        """
+        :meth:`postprocess_bookmarks` with the visited ``bookmarks_list``
+        """
+        return self.postprocess_bookmarks(
+            bookmarks_obj,
+            bookmarks_list=self.bookmarks_list)
+
+    def postprocess_bookmarks(self, bookmarks_obj, bookmarks_list=None):
         """
         add all (unfiltered) bookmarks to one folder
         """
@@ -42,9 +63,11 @@ class AdditionalAllFolderPlugin(pbm.plugins.PromiumPlugin):
             {'type': 'folder',
              'id': bookmarks_obj.ids.next(),
              'name': 'all',
-             'children': list(self.duplicate_list(bookmarks_obj)),
+             'children': list(self.duplicate_list(
+                 bookmarks_obj, bookmarks_list=bookmarks_list)),
              'date_added': datetime_current,
              'date_modified': datetime_current})
         (bookmarks_obj
          .bookmarks_dict['roots']['other']['children'].append(all_folder))
+        bookmarks_obj.invalidate()
         return bookmarks_obj
@@ -15,6 +15,7 @@ class BookmarkletsFolderPlugin(pbm.plugins.PromiumPlugin):
     Add a 'bookmarklets' folder with a default set of bookmarklets
     """
     folder_name = 'bookmarklets'
+    invalidates_caches = True
     default_bookmarklets = [
         {"url":
             'data:text/html, <html style="font-family:Helvetica; background: #333; width: 400px; margin: 0 auto; color: white;" contenteditable><title>todo</title>==================<br>todo<br>==================<br>.',
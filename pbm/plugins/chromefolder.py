@@ -7,6 +7,7 @@ import pbm.utils
 
 class ChromeFolderPlugin(pbm.plugins.PromiumPlugin):
     folder_name = 'chrome'
+    invalidates_caches = True
     urls = [
         "chrome://bookmarks",
         "chrome://history",
@@ -4,10 +4,12 @@ from __future__ import print_function
 
 # from pbm.pbm import PromiumPlugin
 
+import bisect
 import collections
 import datetime
 import itertools
 import logging
+import re
 
 import pbm.main
 import pbm.plugins
@@ -16,6 +18,52 @@ import pbm.utils
 log = logging.getLogger(__name__)
 
 
+DATEFOLDER_NAME_RGX = re.compile(r'^(\d{4})(?:-(\d{1,2}))?(?:-(\d{1,2}))?$')
+
+# pbm state key (see pbm.cache.load_state): the largest date_added filed
+# so far (not in bookmark_bar['meta_info'], which Chromium syncs)
+WATERMARK_KEY = 'datefolders_watermark'
+
+
+def datefolder_key(name):
+    """
+    Args:
+        name (str): folder name (e.g. ``2014``, ``2014-8``, ``2014-8-22``)
+
+    Returns:
+        tuple[int] or None: ``(year,)``, ``(year, month)``, or
+        ``(year, month, day)``; None if ``name`` is not a date folder name
+    """
+    if not name:
+        return None
+    match = DATEFOLDER_NAME_RGX.match(name)
+    if match is None:
+        return None
+    return tuple(int(x) for x in match.groups() if x is not None)
+
+
+def new_datefolder(ids, key):
+    """
+    Args:
+        ids (iterator): node id iterator
+        key (tuple[int]): ``(year,)``, ``(year, month)``, or
+            ``(year, month, day)``
+
+    Returns:
+        dict: an empty date folder node
+    """
+    _key = tuple(key) + (1,) * (3 - len(key))
+    _date = pbm.utils.datetime_to_longdate(datetime.datetime(*_key))
+    return {
+        "type": "folder",
+        "id": ids.next(),
+        "name": '-'.join(str(s) for s in key),
+        "children": [],
+        "date_added": _date,
+        "date_modified": _date,
+    }
+
+
 class DateBasedFoldersPlugin(pbm.plugins.PromiumPlugin):
 
     """
@@ -26,14 +74,128 @@ class DateBasedFoldersPlugin(pbm.plugins.PromiumPlugin):
             2014-08
                 2014-08-22
 
+    Configuration:
+        ``conf['datefolders_incremental']``: if True, only file the
+        bookmarks which are not already in a date folder into the existing
+        date folders (see :meth:`file_bookmarks`); the first run (without
+        a watermark in the pbm state for the file) is a full rebuild
+
+        ``conf['datefolders_skip_unchanged']`` (default:
+        ``datefolders_incremental``): year folders which are unchanged since pbm last wrote them (see
+        :meth:`PromiumPlugin.subtree_changed`) are not walked or rebuilt;
+        bookmarks from other folders are filed into them (see
+        :meth:`file_bookmarks`)
+
+    Attributes:
+        stats (Counter): statistics from the last incremental run
+            (or ``unchanged`` year folder and ``filed`` counts)
+        unchanged (dict): ``(year,)`` -> unchanged year folder
+
     .. note:: This plugin should be called first, as it overwrites
         bookmark_bar
     """
+    invalidates_caches = True
+    visit_phase = 'process_bookmarks'
+
+    def __init__(self, conf=None):
+        super(DateBasedFoldersPlugin, self).__init__(conf=conf)
+        self.incremental = bool(self.conf.get('datefolders_incremental'))
+        self.skip_unchanged = bool(
+            self.conf.get('datefolders_skip_unchanged', self.incremental))
+        self.bookmarks_list = []
+        self.bookmarks_obj = None
+        self.bookmark_bar = None
+        self.watermark = None
+        self.unchanged = {}
+        self.stats = collections.Counter()
+
+    def start(self, bookmarks_obj):
+        self.bookmarks_list = []
+        self.bookmarks_obj = bookmarks_obj
+        self.bookmark_bar = bookmarks_obj.bookmarks_dict['roots']['bookmark_bar']
+        self.watermark = None
+        self.unchanged = {}
+        if self.incremental:
+            self.watermark = self.get_watermark(bookmarks_obj)
+
+    def visit_folder(self, node, path):
+        if not (len(path) == 1 and path[0] is self.bookmark_bar):
+            return True
+        key = datefolder_key(node.get('name'))
+        if key is None or len(key) != 1:
+            return True
+        # incremental: skip the already-filed (year) date folders
+        if self.watermark is not None:
+            return False
+        # skip the year folders which are unchanged since the last write
+        if (self.skip_unchanged
+                and key not in self.unchanged
+                and not self.subtree_changed(self.bookmarks_obj, node)):
+            self.unchanged[key] = node
+            return False
+        return True
+
+    def visit_url(self, node, path):
+        self.bookmarks_list.append(pbm.main.URL.json_from_dict(node))
+
+    def finish(self, bookmarks_obj):
+        """
+        :meth:`process_bookmarks` with the visited ``bookmarks_list``
+        """
+        return self.process_bookmarks(
+            bookmarks_obj,
+            bookmarks_list=self.bookmarks_list)
+
+    @staticmethod
+    def get_watermark(bookmarks_obj):
+        """
+        Returns:
+            int or None: the persisted watermark (None if there is none)
+        """
+        return pbm.utils.parse_longdate(
+            bookmarks_obj.get_state(WATERMARK_KEY))
+
+    @staticmethod
+    def set_watermark(bookmarks_obj, watermark):
+        """
+        Set the watermark, which is saved in the pbm state when the
+        bookmarks are written (see :meth:`ChromiumBookmarks.set_state`)
+        """
+        bookmarks_obj.set_state(WATERMARK_KEY, int(watermark))
+
+    def process_bookmarks(self, bookmarks_obj, bookmarks_list=None):
+        if bookmarks_list is None and (self.incremental or
+                                       self.skip_unchanged):
+            # collect the bookmarks which are not in a skipped date folder
+            pbm.plugins.PluginSequence.visit(bookmarks_obj, [self])
+            bookmarks_list = self.bookmarks_list
+        if self.incremental:
+            watermark = self.get_watermark(bookmarks_obj)
+            if watermark is not None:
+                self.stats = self.file_bookmarks(
+                    bookmarks_obj, bookmarks_list, watermark=watermark)
+                log.info(('datefolders.incremental', dict(self.stats)))
+                bookmarks_obj.invalidate()
+                return bookmarks_obj
 
-    def process_bookmarks(self, bookmarks_obj):
         # log.debug(('dbmarksobj',
         #  bookmarks_obj.bookmarks_dict, bookmarks_obj.bookmarks_list))
-        datefolder_nodes = self.reorganize_by_date(bookmarks_obj)
+        unchanged_list = []
+        if self.unchanged:
+            # file the bookmarks dated in an unchanged year folder into it;
+            # rebuild the other year folders
+            ymds = pbm.utils.longdates_to_ymd(
+                [b.get('date_added') for b in bookmarks_list])
+            rebuild_list = []
+            for ymd, b in zip(ymds, bookmarks_list):
+                if ymd is not None and ymd[:1] in self.unchanged:
+                    unchanged_list.append(b)
+                else:
+                    rebuild_list.append(b)
+            bookmarks_list = rebuild_list
+        datefolder_nodes = self.reorganize_by_date(
+            bookmarks_obj,
+            bookmarks_list=bookmarks_list)
         bookmark_bar = (
             bookmarks_obj.bookmarks_dict['roots']['bookmark_bar']['children'])
         existing_folders = collections.OrderedDict(
@@ -52,10 +214,132 @@ class DateBasedFoldersPlugin(pbm.plugins.PromiumPlugin):
                     bookmark_bar.insert(n, node)
             # log.debug(('DATEFOLDER node', n, node))
         # log.debug(('datefolder_nodes', datefolder_nodes))
+        if self.unchanged:
+            self.stats = self.file_bookmarks(
+                bookmarks_obj, unchanged_list, update_watermark=False)
+            self.stats['unchanged'] = len(self.unchanged)
+            log.info(('datefolders.unchanged', dict(self.stats)))
+        if self.incremental:
+            watermark = max(
+                [pbm.utils.parse_longdate(b.get('date_added')) or 0
+                 for b in bookmarks_list or []] or [0])
+            self.set_watermark(bookmarks_obj, watermark)
+        bookmarks_obj.invalidate()
         return bookmarks_obj
 
     @staticmethod
-    def reorganize_by_date(bookmarks_obj, filterfunc=None):
+    def file_bookmarks(bookmarks_obj, bookmarks_list, watermark=None,
+                       filterfunc=None, update_watermark=True):
+        """
+        Insert bookmarks into the existing date folders
+        (creating only the year, month, and day folders which are missing)
+
+        Each bookmark is inserted with a binary search of its (sorted)
+        year, month, and day folders; folders which already contain
+        each bookmark are not modified.
+
+        Args:
+            bookmarks_obj (ChromiumBookmarks): bookmarks object
+            bookmarks_list (list[dict]): URL dicts to file (e.g. the
+                bookmarks which are not in a date folder)
+
+        Keyword Arguments:
+            watermark (int): the largest date_added already filed; a
+                bookmark with a newer date_added is not checked for an
+                existing copy in its day folder
+            filterfunc (None, True, callable): default, all, True to include
+            update_watermark (bool): set the new watermark
+                (see :meth:`set_watermark` and ``--incremental``)
+
+        Returns:
+            Counter: ``filed``, ``existing`` (already filed), and
+            ``folders`` (folders created) counts
+        """
+        if filterfunc is True:
+            def filterfunc(x):
+                return True
+        elif filterfunc is None:
+            filterfunc = pbm.main.ChromiumBookmarks.chrome_filterfunc
+
+        stats = collections.Counter()
+        bookmark_bar = bookmarks_obj.bookmarks_dict['roots']['bookmark_bar']
+        children = bookmark_bar['children']
+        year_folders = dict(
+            (datefolder_key(x.get('name')), x) for x in children
+            if len(datefolder_key(x.get('name')) or ()) == 1)
+        sorted_keys = {}  # id(children list) -> sorted keys of the list
+
+        def get_sorted_keys(folder, keyfunc):
+            keys = sorted_keys.get(id(folder['children']))
+            if keys is None:
+                keys = sorted_keys[id(folder['children'])] = [
+                    keyfunc(x) for x in folder['children']]
+            return keys
+
+        def get_year_folder(key):
+            folder = year_folders.get(key)
+            if folder is not None:
+                return folder
+            folder = year_folders[key] = new_datefolder(bookmarks_obj.ids, key)
+            stats['folders'] += 1
+            # after the last earlier year folder; before the first later one
+            n = 0
+            for i, x in enumerate(children):
+                _key = datefolder_key(x.get('name'))
+                if _key is not None and len(_key) == 1:
+                    if _key > key:
+                        n = i
+                        break
+                    n = i + 1
+            children.insert(n, folder)
+            return folder
+
+        def get_subfolder(parent, key):
+            keys = get_sorted_keys(
+                parent, lambda x: datefolder_key(x.get('name')) or ())
+            n = bisect.bisect_left(keys, key)
+            if n < len(keys) and keys[n] == key:
+                return parent['children'][n]
+            folder = new_datefolder(bookmarks_obj.ids, key)
+            stats['folders'] += 1
+            parent['children'].insert(n, folder)
+            keys.insert(n, key)
+            return folder
+
+        def date_added_key(x):
+            return pbm.utils.parse_longdate(x.get('date_added')) or 0
+
+        bookmarks_filtered = [b for b in bookmarks_list if filterfunc(b)]
+        longdates = [b.get('date_added') for b in bookmarks_filtered]
+        ymds = pbm.utils.longdates_to_ymd(longdates)
+        for i in pbm.utils.argsort_longdates(longdates):
+            ymd, b = ymds[i], bookmarks_filtered[i]
+            if ymd is None or b.get('type') != 'url':
+                continue
+            folder = get_year_folder(ymd[:1])
+            folder = get_subfolder(folder, ymd[:2])
+            folder = get_subfolder(folder, ymd)
+            keys = get_sorted_keys(folder, date_added_key)
+            date_added = date_added_key(b)
+            lo = bisect.bisect_left(keys, date_added)
+            hi = bisect.bisect_right(keys, date_added, lo)
+            if watermark is None or date_added <= watermark:
+                url = b.get('url')
+                if any(x.get('url') == url
+                       for x in folder['children'][lo:hi]):
+                    stats['existing'] += 1
+                    continue
+            folder['children'].insert(hi, pbm.main.URL.json_from_dict(b))
+            keys.insert(hi, date_added)
+            stats['filed'] += 1
+            if watermark is None or date_added > watermark:
+                watermark = date_added
+        if update_watermark and watermark is not None:
+            DateBasedFoldersPlugin.set_watermark(bookmarks_obj, watermark)
+        return stats
+
+    @staticmethod
+    def reorganize_by_date(bookmarks_obj, filterfunc=None, bookmarks_list=None):
         """
         Reorganize bookmarks into date-based folders
 
@@ -69,6 +353,8 @@ class DateBasedFoldersPlugin(pbm.plugins.PromiumPlugin):
 
         Keyword Arguments:
             filterfunc (None, True, callable): default, all, True to include
+            bookmarks_list (list[dict]): URL dicts to reorganize
+                (default: ``bookmarks_obj.bookmarks_list``)
 
         Returns:
             list[dict]: nested JSON-serializable bookmarks folder and url dicts
@@ -84,28 +370,27 @@ class DateBasedFoldersPlugin(pbm.plugins.PromiumPlugin):
         # ids = itertools.count(id_max + 1)
         ids = bookmarks_obj.ids
 
-        bookmarks_iter_filtered = (
-            pbm.main.URL.from_dict(b) for b in
-            bookmarks_obj.bookmarks_list
-            if filterfunc(b))
+        if bookmarks_list is None:
+            bookmarks_list = bookmarks_obj.bookmarks_list
 
-        def longdate_ymd_key(x):
-            log.debug(('longdate_', x.date_added_))
-            return (x.date_added_.year,
-                    x.date_added_.month,
-                    x.date_added_.day)
+        bookmarks_filtered = [b for b in bookmarks_list if filterfunc(b)]
 
-        bookmarks_list = sorted(bookmarks_iter_filtered,
-                                key=lambda x: x.date_added_)
-        log.info(('bookmarks_list_abc', bookmarks_list))
+        # convert and sort the date_added column in one batch
+        longdates = [b.get('date_added') for b in bookmarks_filtered]
+        ymds = pbm.utils.longdates_to_ymd(longdates)
+        bookmarks_list = [
+            (ymds[i], bookmarks_filtered[i])
+            for i in pbm.utils.argsort_longdates(longdates)
+            if ymds[i] is not None]
+        log.info(('bookmarks_list_abc', len(bookmarks_list)))
         if not bookmarks_list:
             return []
 
         bookmarks_by_day = itertools.groupby(
             bookmarks_list,
-            lambda x: longdate_ymd_key(x))
+            lambda x: x[0])
 
-        bookmarks_by_day = [(x, list(iterable))
+        bookmarks_by_day = [(x, [b for (_ymd, b) in iterable])
                             for (x, iterable) in bookmarks_by_day]
 
         bookmarks_by_day_month = itertools.groupby(bookmarks_by_day,
@@ -123,41 +408,15 @@ class DateBasedFoldersPlugin(pbm.plugins.PromiumPlugin):
 
         nodes = []
         for year, by_year in bookmarks_by_day_month_year:
-            _date = pbm.utils.datetime_to_longdate(
-                datetime.datetime(int(year), 1, 1))
-            year_folder = {
-                "type": "folder",
-                "id": ids.next(),
-                "name": str(year),
-                "children": [],
-                "date_added": _date,
-                "date_modified": _date,
-            }
+            year_folder = new_datefolder(ids, (year,))
             for month, by_day in by_year:
-                _date = pbm.utils.datetime_to_longdate(
-                    datetime.datetime(int(year), int(month[-1]), 1))
-                month_folder = {
-                    "type": "folder",
-                    "id": ids.next(),
-                    "name": '-'.join(str(s) for s in month),
-                    "children": [],
-                    "date_added": _date,
-                    "date_modified": _date,
-                }
+                month_folder = new_datefolder(ids, month)
                 for day, iterable in by_day:
-                    _date = pbm.utils.datetime_to_longdate(
-                        datetime.datetime(int(year), int(month[-1]), int(day[-1])))
-                    day_folder = {
-                        "type": "folder",
-                        "id": ids.next(),
-                        "name": '-'.join(str(s) for s in day),
-                        "children": [],
-                        "date_added": _date,
-                        "date_modified": _date,
-                    }
+                    day_folder = new_datefolder(ids, day)
                     for b in iterable:
-                        if b.type == 'url':
-                            day_folder['children'].append(b.to_json())
+                        if b.get('type') == 'url':
+                            day_folder['children'].append(
+                                pbm.main.URL.json_from_dict(b))
                     month_folder['children'].append(day_folder)
                 year_folder['children'].append(month_folder)
             nodes.append(year_folder)
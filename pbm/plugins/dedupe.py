@@ -1,26 +1,121 @@
-
 import collections
 import logging
 
+try:
+    from urlparse import urlsplit, urlunsplit
+except ImportError:  # pragma: no cover
+    from urllib.parse import urlsplit, urlunsplit
+
 import pbm.plugins
+import pbm.utils
 
 log = logging.getLogger(__name__)
 
 
+DEFAULT_PORTS = {
+    'http': 80,
+    'https': 443,
+    'ftp': 21,
+}
+
+
+def normalize_url(url):
+    """
+    Normalize a URL for comparison
+
+    * lowercase the scheme and the host
+    * drop the default port for the scheme
+    * an empty path (with a host) is ``/``
+
+    The query string and the fragment are kept (see :mod:`pbm.plugins.starred`)
+
+    Args:
+        url (str): URL
+
+    Returns:
+        str: normalized URL
+    """
+    if not url:
+        return url
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc
+    if netloc:
+        userinfo, at, _ = netloc.rpartition('@')
+        host = parts.hostname or ''
+        if ':' in host:
+            host = '[%s]' % host  # IPv6
+        if port is not None and port != DEFAULT_PORTS.get(scheme):
+            host = '%s:%d' % (host, port)
+        netloc = userinfo + at + host
+    path = parts.path
+    if netloc and not path:
+        path = '/'
+    return urlunsplit((scheme, netloc, path, parts.query, parts.fragment))
+
+
+DEDUPE_KEYS = collections.OrderedDict((
+    ('url_date', lambda node: (node.get('url'), node.get('date_added'))),
+    ('url', lambda node: node.get('url')),
+    ('normalized_url', lambda node: normalize_url(node.get('url'))),
+    ('name_url', lambda node: (node.get('name'), node.get('url'))),
+))
+DEFAULT_DEDUPE_KEY = 'url_date'
+
+
+def get_dedupe_keyfunc(key=None):
+    """
+    Args:
+        key (None, str, callable): a :data:`DEDUPE_KEYS` name
+            (default: :data:`DEFAULT_DEDUPE_KEY`) or a function of a url node
+
+    Returns:
+        callable: function which returns a hashable dedupe key for a url node
+    """
+    if key is None:
+        key = DEFAULT_DEDUPE_KEY
+    if callable(key):
+        return key
+    try:
+        return DEDUPE_KEYS[key]
+    except KeyError:
+        raise ValueError("Unknown dedupe key: %r (choose from: %s)" % (
+            key, ', '.join(DEDUPE_KEYS)))
+
+
 class DedupeObj(object):
 
-    def __init__(self):
-        self.dict = collections.OrderedDict()
+    """
+    Tracks the dedupe keys of the url nodes seen so far
+
+    Attributes:
+        keyfunc (callable): function which returns a url node's dedupe key
+        seen (set): dedupe keys seen so far
+        stats (Counter): ``url`` (urls checked), ``duplicate`` (urls removed)
+    """
+
+    def __init__(self, key=None):
+        """
+        Keyword Arguments:
+            key (None, str, callable): see :func:`get_dedupe_keyfunc`
+        """
+        self.keyfunc = get_dedupe_keyfunc(key)
+        self.seen = set()
+        self.stats = collections.Counter()
 
     def is_duplicate_bookmark(self, node):
         if node.get('type') == 'url':
-            url = node.get('url')
-            date = node.get('date_added')
-            key = (url, date)
-            if key not in self.dict:
-                self.dict[key] = True
+            key = self.keyfunc(node)
+            self.stats['url'] += 1
+            if key not in self.seen:
+                self.seen.add(key)
                 return False
             else:
+                self.stats['duplicate'] += 1
                 log.debug("duplicate: %r" % node)
                 return True
         else:
@@ -29,39 +124,60 @@ class DedupeObj(object):
 
 
 class DedupePlugin(pbm.plugins.PromiumPlugin):
+    """
+    Remove duplicate url nodes (keeping the first, in document order)
+
+    Configuration:
+        ``conf['dedupe_key']``: one of :data:`DEDUPE_KEYS`
+        (default: :data:`DEFAULT_DEDUPE_KEY`)
+
+    Attributes:
+        stats (Counter): statistics from the last run
+            (see :class:`DedupeObj`)
+    """
+    invalidates_caches = True
+
+    def __init__(self, conf=None):
+        super(DedupePlugin, self).__init__(conf=conf)
+        self.stats = collections.Counter()
 
     def preprocess_bookmarks(self, bookmarks_obj):
         bookmarks_dict = bookmarks_obj.bookmarks_dict
+        dedupe_obj = DedupeObj(key=self.conf.get('dedupe_key'))
         bookmarks_obj.bookmarks_dict = (
-            self.dedupe_bookmarks_dict(bookmarks_dict))
+            self.dedupe_bookmarks_dict(bookmarks_dict,
+                                       dedupe_obj=dedupe_obj))
+        self.stats = dedupe_obj.stats
+        log.info(('dedupe', dict(self.stats)))
         return bookmarks_obj
 
     @staticmethod
-    def dedupe_bookmarks_list(bookmarks_list):
-        dedupe_dict = collections.OrderedDict()
+    def dedupe_bookmarks_list(bookmarks_list, key=None):
+        dedupe_obj = DedupeObj(key=key)
         for bookmark in bookmarks_list:
-            url = bookmark.get('url')
-            date = bookmark.get('date')
-            key = (url, date)
-            if key not in dedupe_dict:
-                dedupe_dict[key] = bookmark
-            else:
-                continue
-        return pbm.utils.itervalues(dedupe_dict)
+            if not dedupe_obj.is_duplicate_bookmark(bookmark):
+                yield bookmark
 
     @staticmethod
-    def dedupe_bookmarks_dict(bookmarks_dict):
+    def dedupe_bookmarks_dict(bookmarks_dict, dedupe_obj=None):
+        if dedupe_obj is None:
+            dedupe_obj = DedupeObj()
         DedupePlugin.walk_and_dedupe_bookmarks(
-            bookmarks_dict['roots']['bookmark_bar'])
+            bookmarks_dict['roots']['bookmark_bar'],
+            dedupe_obj=dedupe_obj)
         DedupePlugin.walk_and_dedupe_bookmarks(
-            bookmarks_dict['roots']['other'])
+            bookmarks_dict['roots']['other'],
+            dedupe_obj=dedupe_obj)
         return bookmarks_dict
 
     @staticmethod
     def walk_and_dedupe_bookmarks(node, dedupe_obj=None, folder=None):
         """
         Walk a Chromium Bookmarks dict recursively; removing duplicates
-        (where type=='url' and (url, date) are the same)
+        (url nodes with the same ``dedupe_obj`` key)
+
+        Each folder's ``children`` list is rebuilt (in place) in one pass,
+        so this is linear in the number of nodes.
 
         Args:
             node (dict): dict to traverse (type:url|folder, children:[]])
@@ -70,6 +186,9 @@ class DedupePlugin(pbm.plugins.PromiumPlugin):
             dedupe_obj (DedupeObj): obj w/ is_duplicate_bookmark method
             folder (dict): current folder dict
 
+        Returns:
+            DedupeObj: dedupe_obj (see ``dedupe_obj.stats``)
+
         .. note:: This function has side effects (it mutates the nodes)
 
         """
@@ -77,25 +196,27 @@ class DedupePlugin(pbm.plugins.PromiumPlugin):
             dedupe_obj = DedupeObj()
         _type = node.get('type')
         if _type == 'folder':
-            folder = node
-            for item in node['children'] or []:
-                if not (item and hasattr(item, 'get') and 'type' in item):
-                    continue
-                _item_type = item.get('type')
-                if _item_type == 'folder':
-                    DedupePlugin.walk_and_dedupe_bookmarks(
-                        item,
-                        dedupe_obj=dedupe_obj,
-                        folder=folder)
-                elif _item_type == 'url':
-                    if dedupe_obj.is_duplicate_bookmark(item):
-                        _len_before = len(folder['children'])
-                        folder['children'].remove(item)
-                        _len_after = len(folder['children'])
-                        if _len_after >= _len_before:
-                            raise Exception(folder['children'])
+            children = node.get('children')
+            if not children:
+                return dedupe_obj
+            _children = []
+            for item in children:
+                if item and hasattr(item, 'get') and 'type' in item:
+                    _item_type = item.get('type')
+                    if _item_type == 'folder':
+                        DedupePlugin.walk_and_dedupe_bookmarks(
+                            item,
+                            dedupe_obj=dedupe_obj,
+                            folder=node)
+                    elif _item_type == 'url':
+                        if dedupe_obj.is_duplicate_bookmark(item):
+                            continue
+                _children.append(item)
+            if len(_children) != len(children):
+                children[:] = _children
         elif _type == 'url':
             if dedupe_obj.is_duplicate_bookmark(node):
                 if folder is None:
                     raise Exception('folder is None')
                 folder['children'].remove(node)
+        return dedupe_obj
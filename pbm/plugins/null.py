@@ -10,6 +10,7 @@ log = logging.getLogger(__name__)
 
 
 class NullPlugin(pbm.plugins.PromiumPlugin):
+    invalidates_caches = True
 
     def preprocess_bookmarks(self, bookmarks_obj):
         return bookmarks_obj
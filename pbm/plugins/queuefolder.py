@@ -9,6 +9,7 @@ log = logging.getLogger(__name__)
 
 class QueueFolderPlugin(pbm.plugins.PromiumPlugin):
     folder_name = 'queue'
+    invalidates_caches = True
 
     def check_node_ids(self, bookmarks_obj):
         nodes = [n for n in
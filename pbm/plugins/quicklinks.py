@@ -13,6 +13,7 @@ log = logging.getLogger(__name__)
 
 class QuicklinksFolderPlugin(pbm.plugins.PromiumPlugin):
     DEFAULT_NODE_PREFIX = 'quicklinks'
+    invalidates_caches = True
 
     def __init__(self, conf=None, node_prefix=None):
         self.conf = conf if conf else {}
@@ -32,6 +33,7 @@ class QuicklinksFolderPlugin(pbm.plugins.PromiumPlugin):
         (bookmarks_obj
          .bookmarks_dict['roots']['bookmark_bar']['children']
          .extend(self.build_nodes(bookmarks_obj.ids)))
+        bookmarks_obj.invalidate()
         return bookmarks_obj
 
     def match_prefix(self, name):
@@ -52,6 +52,12 @@ def split_starcount_fragment(urlstr):
 class StarredFolderPlugin(pbm.plugins.PromiumPlugin):
     STARRED_FOLDER_TITLE = 'starred'
     folder_name = 'starred'
+    invalidates_caches = True
+    visit_phase = 'postprocess_bookmarks'
+
+    def __init__(self, conf=None):
+        super(StarredFolderPlugin, self).__init__(conf=conf)
+        self.base_url_map = collections.OrderedDict()
 
     def preprocess_bookmarks(self, bookmarks_obj):
         """
@@ -71,19 +77,37 @@ class StarredFolderPlugin(pbm.plugins.PromiumPlugin):
             folder_name=self.folder_name,
             folder=starred_folder_node)
 
+    def visit_url(self, node, path):
+        self.add_to_base_url_map(self.base_url_map, node)
+
+    def finish(self, bookmarks_obj):
+        """
+        :meth:`postprocess_bookmarks` with the visited ``base_url_map``
+        """
+        starred_folder_node = self.build_bookmarks_json(
+            bookmarks_obj,
+            base_url_map=self.base_url_map)
+        return bookmarks_obj.add_bookmark_bar_folder(
+            folder_name=self.folder_name,
+            folder=starred_folder_node)
+
     @staticmethod
-    def build_base_url_map(bookmarks_list):
+    def add_to_base_url_map(base_url_map, bookmark):
+        if 'url' in bookmark:
+            base_url, starstr, starcount = split_starcount_fragment(
+                bookmark.get('url'))
+            if starcount:
+                bookmark_dict = bookmark.copy()
+                bookmark_dict['base_url'] = base_url
+                bookmark_dict['starcount'] = starcount
+                base_url_map.setdefault(base_url, [])
+                base_url_map[base_url].append(bookmark_dict)
+
+    @classmethod
+    def build_base_url_map(cls, bookmarks_list):
         base_url_map = collections.OrderedDict()
         for bookmark in bookmarks_list:
-            if 'url' in bookmark:
-                base_url, starstr, starcount = split_starcount_fragment(
-                    bookmark.get('url'))
-                if starcount:
-                    bookmark_dict = bookmark.copy()
-                    bookmark_dict['base_url'] = base_url
-                    bookmark_dict['starcount'] = starcount
-                    base_url_map.setdefault(base_url, [])
-                    base_url_map[base_url].append(bookmark_dict)
+            cls.add_to_base_url_map(base_url_map, bookmark)
         return base_url_map
 
     @staticmethod
@@ -146,8 +170,10 @@ class StarredFolderPlugin(pbm.plugins.PromiumPlugin):
         return output
 
     @classmethod
-    def build_bookmarks_json(cls, bookmarks_obj):
-        base_url_map = cls.build_base_url_map(bookmarks_obj.bookmarks_list)
+    def build_bookmarks_json(cls, bookmarks_obj, base_url_map=None):
+        if base_url_map is None:
+            base_url_map = cls.build_base_url_map(
+                bookmarks_obj.bookmarks_list)
         bookmarks_urls = []
         latest_date_added = None
         latest = None
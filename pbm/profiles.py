@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+pbm/profiles.py -- process many profiles' Bookmarks files in parallel
+
+Each Bookmarks file (e.g. every file found by
+:func:`pbm.main.list_profile_bookmarks`) is parsed, transformed, and
+(optionally) organized in a :mod:`multiprocessing` worker process;
+results and errors are returned as one :class:`ProfileResult` per file.
+
+.. code:: python
+
+    paths = list(list_profile_bookmarks())
+    results = process_profiles(paths, processes=4)
+    for line in format_report(results):
+        print(line)
+
+"""
+
+import collections
+import logging
+import multiprocessing
+import time
+import traceback
+
+
+log = logging.getLogger(__name__)
+
+
+class ProfileResult(
+    collections.namedtuple('ProfileResult', (
+        'path',
+        'ok',
+        'error',
+        'elapsed',
+        'url_count',
+        'transformed_url_count',
+        'organized'))):
+
+    """
+    Attributes:
+        path (str): path to the Bookmarks file
+        ok (bool): False if processing the file raised an exception
+        error (str or None): the exception (``<type>: <message>``)
+        elapsed (float): seconds
+        url_count (int or None): urls read
+        transformed_url_count (int or None): urls after the transforms
+        organized (bool): True if the file was rewritten
+    """
+
+
+def process_profile(path, conf=None, organize=False, verify=False,
+                    keep_backups=None, max_backup_age=None,
+                    use_cache=True, cache_dir=None):
+    """
+    Parse and transform one Bookmarks file; and rewrite it, if
+    ``organize`` is True (without prompting)
+
+    Args:
+        path (str): path to a Chromium Bookmarks JSON file
+
+    Keyword Arguments:
+        conf (dict): plugin configuration
+        organize (bool): overwrite the file with the transformed bookmarks
+        verify (bool): see :meth:`ChromiumBookmarks.organize`
+        keep_backups (int): see :meth:`ChromiumBookmarks.organize`
+        max_backup_age (timedelta): see :meth:`ChromiumBookmarks.organize`
+        use_cache (bool): read unchanged files from the parse cache
+            (not when organizing)
+        cache_dir (str): see :func:`pbm.cache.get_cache_dir`
+
+    Returns:
+        ProfileResult: the result (exceptions are returned as errors)
+    """
+    start = time.time()
+    url_count = transformed_url_count = None
+    # pbm.main imports this module
+    import pbm.main
+    ChromiumBookmarks = pbm.main.ChromiumBookmarks
+    try:
+        cb = ChromiumBookmarks(path, conf=conf,
+                               use_cache=use_cache and not organize,
+                               cache_dir=cache_dir)
+        url_count = sum(1 for _ in cb)
+        bookmarks_dict = ChromiumBookmarks.transform_bookmarks_dict(
+            bookmarks_obj=cb, conf=conf)
+        transformed_url_count = sum(
+            1 for _ in ChromiumBookmarks.iter_bookmarks(
+                bookmarks_dict=bookmarks_dict))
+        if organize:
+            ChromiumBookmarks.organize_bookmarks_json(
+                bookmarks_dict,
+                path,
+                prompt=False,
+                verify=verify,
+                keep_backups=keep_backups,
+                max_backup_age=max_backup_age,
+                cache_dir=cache_dir,
+                state=cb.pending_state)
+    except Exception as e:
+        log.debug(('process_profile.error', path, traceback.format_exc()))
+        return ProfileResult(
+            path, False, "%s: %s" % (type(e).__name__, e),
+            time.time() - start, url_count, transformed_url_count, False)
+    return ProfileResult(path, True, None, time.time() - start,
+                         url_count, transformed_url_count, organize)
+
+
+def _process_profile_args(args):
+    path, kwargs = args
+    return process_profile(path, **kwargs)
+
+
+def process_profiles(paths, processes=None, **kwargs):
+    """
+    Process Bookmarks files in parallel (see :func:`process_profile`)
+
+    Args:
+        paths (iterable[str]): paths to Chromium Bookmarks JSON files
+
+    Keyword Arguments:
+        processes (int): number of worker processes
+            (default: the number of CPUs; 1 to process in this process)
+        kwargs (dict): passed through to :func:`process_profile`
+
+    Returns:
+        list[ProfileResult]: one result for each path (in order)
+    """
+    paths = list(paths)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(paths))
+    if processes <= 1:
+        return [process_profile(path, **kwargs) for path in paths]
+    log.debug(('process_profiles', len(paths), processes))
+    pool = multiprocessing.Pool(processes=processes)
+    try:
+        results = pool.map(_process_profile_args,
+                           [(path, kwargs) for path in paths],
+                           chunksize=1)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results
+
+
+def format_report(results):
+    """
+    Args:
+        results (iterable[ProfileResult]): see :func:`process_profiles`
+
+    Yields:
+        str: one line for each result, and a summary line
+    """
+    count = errors = 0
+    for result in results:
+        count += 1
+        if result.ok:
+            yield "ok\t%s\turls=%d\ttransformed=%d\torganized=%s\t%.3fs" % (
+                result.path, result.url_count,
+                result.transformed_url_count, result.organized,
+                result.elapsed)
+        else:
+            errors += 1
+            yield "error\t%s\t%s\t%.3fs" % (
+                result.path, result.error, result.elapsed)
+    yield "# %d profiles, %d errors" % (count, errors)
@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+pbm/search.py -- inverted full-text index over bookmark urls
+
+Bookmark names, URL hosts, URL path (and query) segments, and folder
+names are tokenized into an inverted index (term -> postings); queries
+match terms exactly or by prefix, and results are ranked by field
+weight and term rarity.
+
+The index is saved in the pbm cache dir (not in the browser's profile
+dir; see :func:`get_index_path`), keyed on the file's size, mtime, and
+inode (see :mod:`pbm.cache`).
+
+.. code:: python
+
+    index = get_index('./path/to/Bookmarks')  # build and save, or load
+    for result in index.search(u'pyth doc', limit=10):
+        print(result['score'], result['url'])
+
+"""
+
+import array
+import bisect
+import collections
+import logging
+import marshal
+import math
+import os
+import re
+
+try:
+    from urllib import unquote
+    from urlparse import urlsplit
+except ImportError:  # pragma: no cover
+    from urllib.parse import unquote, urlsplit
+
+import pbm.cache as cache
+import pbm.fileio as fileio
+import pbm.store as store
+
+log = logging.getLogger(__name__)
+
+
+INDEX_SUFFIX = '.pbmindex'
+# increment when the saved index layout changes
+INDEX_VERSION = 1
+
+SEARCH_ROOTS = ('bookmark_bar', 'other', 'synced')
+
+# per-field term weights
+FIELD_WEIGHTS = collections.OrderedDict((
+    ('name', 4),
+    ('host', 3),
+    ('folder', 2),
+    ('path', 1),
+))
+# score multiplier for a prefix (not exact) term match
+PREFIX_FACTOR = 0.5
+
+# pbmweb ``/bookmarks/search`` ``limit`` (see :mod:`pbm.app`)
+DEFAULT_RESULT_LIMIT = 50
+MAX_RESULT_LIMIT = 1000
+
+TOKEN_RGX = re.compile(r'\w+', re.UNICODE)
+
+# search result keys (as :attr:`pbm.main.URL.JSON_FIELDS`, with a score)
+RESULT_FIELDS = (
+    'type', 'id', 'name', 'url', 'path', 'date_added', 'date_modified',
+    'score')
+
+
+def tokenize(text):
+    """
+    Args:
+        text (str): text to tokenize
+
+    Returns:
+        list[str]: lowercased alphanumeric tokens
+    """
+    if not text:
+        return []
+    return TOKEN_RGX.findall(text.lower())
+
+
+def url_tokens(url):
+    """
+    Args:
+        url (str): URL
+
+    Returns:
+        tuple: (host tokens, path and query tokens)
+    """
+    if not url:
+        return [], []
+    try:
+        parts = urlsplit(url)
+        host = parts.hostname or u''
+    except ValueError:
+        return [], tokenize(url)
+    if not parts.netloc:  # e.g. data:, javascript:
+        return [], tokenize(unquote(parts.path))
+    return (tokenize(host),
+            tokenize(unquote(parts.path)) + tokenize(unquote(parts.query)))
+
+
+def get_index_path(bookmarks_path, cache_dir=None):
+    """
+    Args:
+        bookmarks_path (str): path to a Bookmarks JSON file
+
+    Keyword Arguments:
+        cache_dir (str): see :func:`pbm.cache.get_cache_dir`
+
+    Returns:
+        str: path to the index file for ``bookmarks_path``
+        (:func:`pbm.cache.get_cache_path`, with a ``.pbmindex`` suffix)
+    """
+    cache_path = cache.get_cache_path(bookmarks_path, cache_dir=cache_dir)
+    return os.path.splitext(cache_path)[0] + INDEX_SUFFIX
+
+
+def _array_tobytes(column):
+    tobytes = getattr(column, 'tobytes', None) or column.tostring
+    return tobytes()
+
+
+def _array_frombytes(data):
+    column = array.array('i')
+    frombytes = getattr(column, 'frombytes', None) or column.fromstring
+    frombytes(data)
+    return column
+
+
+class SearchIndex(object):
+
+    """
+    Inverted index over bookmark urls
+
+    Attributes:
+        docs (list[tuple]): (id, name, url, folder names,
+            date_added, date_modified) for each indexed url
+        postings (dict): term -> ``array('i')`` of
+            ``doc, weight`` pairs (in doc order; or the array's bytes,
+            until the term is first queried)
+        terms (list[str]): sorted terms (for prefix matching)
+        key (tuple): :func:`pbm.cache.get_file_key` of the indexed file
+    """
+
+    def __init__(self, docs=None, postings=None, key=None):
+        self.docs = docs if docs is not None else []
+        self.postings = postings if postings is not None else {}
+        self.terms = sorted(self.postings)
+        self.key = key
+
+    def __len__(self):
+        return len(self.docs)
+
+    @classmethod
+    def from_store(cls, bookmark_store, roots=SEARCH_ROOTS, key=None):
+        """
+        Args:
+            bookmark_store (pbm.store.BookmarkStore): bookmarks to index
+
+        Keyword Arguments:
+            roots (tuple[str]): ``roots`` keys to index
+            key (tuple): :func:`pbm.cache.get_file_key` of the indexed file
+
+        Returns:
+            SearchIndex: a new index
+        """
+        docs = []
+        weights = collections.defaultdict(dict)
+        for idx, path in bookmark_store.iter_nodes(roots=roots):
+            if bookmark_store.types[idx] != store.TYPE_URL:
+                continue
+            doc = len(docs)
+            name = bookmark_store.get_name(idx)
+            url = bookmark_store.get_url(idx)
+            folders = tuple(bookmark_store.get_name(x) or u'' for x in path)
+            node = bookmark_store.node(idx)
+            docs.append((node.get('id'), name, url, folders,
+                         node.get('date_added'), node.get('date_modified')))
+            host, url_path = url_tokens(url)
+            for field, tokens in (
+                    ('name', tokenize(name)),
+                    ('host', host),
+                    ('folder', [t for x in folders for t in tokenize(x)]),
+                    ('path', url_path)):
+                weight = FIELD_WEIGHTS[field]
+                for token in tokens:
+                    doc_weights = weights[token]
+                    if doc_weights.get(doc, 0) < weight:
+                        doc_weights[doc] = weight
+        postings = {}
+        for term, doc_weights in weights.items():
+            column = array.array('i')
+            for doc in sorted(doc_weights):
+                column.append(doc)
+                column.append(doc_weights[doc])
+            postings[term] = column
+        return cls(docs=docs, postings=postings, key=key)
+
+    def to_marshal_data(self):
+        """
+        Returns:
+            dict: builtin types only (for :mod:`marshal`)
+        """
+        return {
+            'version': INDEX_VERSION,
+            'key': self.key,
+            'docs': self.docs,
+            'postings': dict(
+                (term, (column if isinstance(column, bytes)
+                        else _array_tobytes(column)))
+                for (term, column) in self.postings.items()),
+        }
+
+    @classmethod
+    def from_marshal_data(cls, data):
+        """
+        Args:
+            data (dict): output of :meth:`to_marshal_data`
+
+        Raises:
+            ValueError: if ``data`` is from another index version
+
+        Returns:
+            SearchIndex: an index (postings are decoded when first queried)
+        """
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError("Unsupported index version: %r" % (
+                data.get('version')))
+        return cls(docs=[tuple(x) for x in data['docs']],
+                   postings=data['postings'],
+                   key=data['key'])
+
+    def get_postings(self, term):
+        """
+        Returns:
+            array: ``doc, weight`` pairs for ``term``
+        """
+        column = self.postings.get(term)
+        if column is None:
+            return array.array('i')
+        if isinstance(column, bytes):
+            column = self.postings[term] = _array_frombytes(column)
+        return column
+
+    def match_terms(self, token, prefix=True):
+        """
+        Args:
+            token (str): query token
+
+        Keyword Arguments:
+            prefix (bool): also match terms which start with ``token``
+
+        Yields:
+            tuple: (term, exact) for each matching term
+        """
+        if not prefix:
+            if token in self.postings:
+                yield token, True
+            return
+        terms = self.terms
+        for i in range(bisect.bisect_left(terms, token), len(terms)):
+            term = terms[i]
+            if not term.startswith(token):
+                break
+            yield term, term == token
+
+    def score(self, query, prefix=True):
+        """
+        Score the docs which match every query token
+
+        Each token adds the best field weight (times ``PREFIX_FACTOR``
+        for a prefix match) times the term's inverse document frequency.
+
+        Args:
+            query (str): search query
+
+        Keyword Arguments:
+            prefix (bool): match query tokens as term prefixes
+
+        Returns:
+            dict: doc -> score
+        """
+        scores = None
+        ndocs = len(self.docs)
+        for token in set(tokenize(query)):
+            token_scores = {}
+            for term, exact in self.match_terms(token, prefix=prefix):
+                postings = self.get_postings(term)
+                idf = math.log(1.0 + ndocs / (len(postings) / 2.0))
+                factor = idf * (1.0 if exact else PREFIX_FACTOR)
+                for i in range(0, len(postings), 2):
+                    doc = postings[i]
+                    if scores is not None and doc not in scores:
+                        continue
+                    score = postings[i + 1] * factor
+                    if score > token_scores.get(doc, 0):
+                        token_scores[doc] = score
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = dict((doc, score + token_scores[doc])
+                              for (doc, score) in scores.items()
+                              if doc in token_scores)
+            if not scores:
+                break
+        return scores or {}
+
+    def search(self, query, limit=None, prefix=True):
+        """
+        Args:
+            query (str): search query (all tokens must match)
+
+        Keyword Arguments:
+            limit (int): return at most this many results
+            prefix (bool): match query tokens as term prefixes
+
+        Returns:
+            list[OrderedDict]: URL dicts (see :data:`RESULT_FIELDS`;
+            ``path`` is the ``/``-joined folder names), best first
+        """
+        scores = self.score(query, prefix=prefix)
+        ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        results = []
+        for doc, score in ranked:
+            (id_, name, url, folders,
+             date_added, date_modified) = self.docs[doc]
+            results.append(collections.OrderedDict(zip(RESULT_FIELDS, (
+                'url', id_, name, url, u'/'.join(folders),
+                date_added, date_modified, round(score, 4)))))
+        return results
+
+
+def load_index(bookmarks_path, index_path=None, cache_dir=None):
+    """
+    Load the saved index for ``bookmarks_path``, if it is current
+
+    Args:
+        bookmarks_path (str): path to a Bookmarks JSON file
+
+    Keyword Arguments:
+        index_path (str): default: :func:`get_index_path`
+        cache_dir (str): see :func:`pbm.cache.get_cache_dir`
+
+    Returns:
+        SearchIndex or None: None if there is no current index
+    """
+    if index_path is None:
+        index_path = get_index_path(bookmarks_path, cache_dir=cache_dir)
+    try:
+        key = cache.get_file_key(bookmarks_path)
+        with open(index_path, 'rb') as f:
+            index = SearchIndex.from_marshal_data(marshal.load(f))
+    except (IOError, OSError) as e:
+        log.debug(('search.load_index.miss', index_path, e))
+        return None
+    except (EOFError, ValueError, TypeError, KeyError, AttributeError) as e:
+        log.info(('search.load_index.invalid', index_path, e))
+        return None
+    if index.key != key:
+        log.debug(('search.load_index.stale', index_path))
+        return None
+    return index
+
+
+def save_index(index, index_path):
+    """
+    Atomically write ``index`` to ``index_path``
+
+    Returns:
+        str or None: ``index_path`` (None if it could not be written)
+    """
+    data = marshal.dumps(index.to_marshal_data())
+    try:
+        dirname = os.path.dirname(index_path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fileio.atomic_write(index_path, lambda f: f.write(data),
+                            encoding=None, fsync=False)
+    except (IOError, OSError) as e:
+        log.info(('search.save_index.error', index_path, e))
+        return None
+    return index_path
+
+
+def get_index(bookmarks_path, index_path=None, bookmark_store=None,
+              use_cache=False, cache_dir=None):
+    """
+    Load the saved index for ``bookmarks_path``; or build and save it
+
+    Args:
+        bookmarks_path (str): path to a Bookmarks JSON file
+
+    Keyword Arguments:
+        index_path (str): default: :func:`get_index_path`
+        bookmark_store (pbm.store.BookmarkStore): the parsed
+            ``bookmarks_path`` (default: parse it)
+        use_cache (bool): parse ``bookmarks_path`` with the parse cache
+            (see :func:`pbm.cache.load_store`)
+        cache_dir (str): see :func:`pbm.cache.get_cache_dir`
+
+    Returns:
+        SearchIndex: a current index
+    """
+    if index_path is None:
+        index_path = get_index_path(bookmarks_path, cache_dir=cache_dir)
+    index = load_index(bookmarks_path, index_path=index_path)
+    if index is not None:
+        return index
+    key = cache.get_file_key(bookmarks_path)
+    if bookmark_store is None:
+        if use_cache:
+            bookmark_store = cache.load_store(bookmarks_path,
+                                              cache_dir=cache_dir)
+        else:
+            bookmark_store = store.BookmarkStore.from_path(bookmarks_path)
+    index = SearchIndex.from_store(bookmark_store, key=key)
+    if cache.get_file_key(bookmarks_path) == key:
+        save_index(index, index_path)
+    return index
@@ -0,0 +1,647 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+pbm/serialize.py -- Chromium Bookmarks JSON serialization
+
+Write a ``bookmarks_dict`` as indented (or compact) JSON in chunks,
+without a round-trip re-parse; optionally with an accelerated JSON
+backend (``orjson`` or ``ujson``, if installed), and with Chromium's
+``checksum`` (computed in the same pass) and each folder's subtree
+digest (see :mod:`pbm.merkle`; returned, not written).
+
+.. code:: python
+
+    output_json = dumps(bookmarks_dict)
+    with codecs.open(path, 'w', encoding='utf8') as f:
+        stats = dump(bookmarks_dict, f, verify=True)
+    verify_file(path, stats)
+
+"""
+
+import codecs
+import collections
+import hashlib
+import json
+import json.encoder
+import logging
+import re
+
+import pbm.merkle as merkle
+
+log = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+try:
+    string_types = (basestring,)
+    integer_types = (int, long)
+    text_type = unicode
+except NameError:  # pragma: no cover
+    string_types = (str,)
+    integer_types = (int,)
+    text_type = str
+
+
+DEFAULT_INDENT = 2
+DEFAULT_CHUNK_SIZE = 2**16
+
+BACKENDS = ('orjson', 'ujson', 'json')
+
+NODE_TYPE_RGX = re.compile(r'"type":\s*"(url|folder)"')
+
+INFINITY = float('inf')
+
+# roots which Chromium includes in the checksum, in checksum order
+CHECKSUM_ROOTS = ('bookmark_bar', 'other', 'synced')
+
+
+class SerializationError(ValueError):
+    pass
+
+
+class SerializeStats(
+        collections.namedtuple('SerializeStats', (
+            'urls',
+            'folders',
+            'nbytes',
+            'sha1',
+            'checksum',
+            'merkle'))):
+    """
+    What was serialized (for :func:`verify_json` and :func:`verify_file`)
+
+    Attributes:
+        urls (int): number of ``url`` nodes
+        folders (int): number of ``folder`` nodes
+        nbytes (int): length of the UTF-8 encoded output
+        sha1 (str): hex SHA-1 digest of the UTF-8 encoded output
+        checksum (str): Chromium ``checksum`` (see ``checksum``)
+        merkle (OrderedDict): folder id -> subtree hexdigest
+            (see ``merkle``)
+    """
+
+
+def _to_text(s):
+    if s is None:
+        return u''
+    if isinstance(s, text_type):
+        return s
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return text_type(s)
+
+
+class BookmarksChecksum(object):
+
+    """
+    Chromium's Bookmarks ``checksum``: an MD5 digest of each node's
+    id, title (UTF-16LE), type, and url; in pre-order over the
+    ``bookmark_bar``, ``other``, and ``synced`` roots
+    (see ``components/bookmarks/browser/bookmark_codec.cc``)
+
+    Roots which are serialized out of checksum order are buffered
+    until the preceding roots are done.
+    """
+
+    def __init__(self, roots=None):
+        """
+        Keyword Arguments:
+            roots (None, dict): ``roots`` dict (to skip missing roots)
+        """
+        self.md5 = hashlib.md5()
+        self._order = [key for key in CHECKSUM_ROOTS
+                       if roots is None or key in roots]
+        self._buffers = {}
+        self._done = set()
+        self._update = None
+
+    @staticmethod
+    def node_data(node):
+        """
+        Args:
+            node (dict): url or folder node
+
+        Returns:
+            bytes: checksum input for ``node``
+        """
+        _type = node.get('type')
+        data = (_to_text(node.get('id')).encode('utf-8') +
+                _to_text(node.get('name')).encode('utf-16-le'))
+        if _type == 'url':
+            return data + b'url' + _to_text(node.get('url')).encode('utf-8')
+        return data + b'folder'
+
+    def start_root(self, key):
+        if key not in self._order:
+            self._update = None
+        elif key == self._order[0]:
+            self._update = self.md5.update
+        else:
+            self._update = self._buffers.setdefault(key, []).append
+
+    def update_node(self, node):
+        if self._update is not None:
+            self._update(self.node_data(node))
+
+    def end_root(self, key):
+        self._update = None
+        if key not in self._order:
+            return
+        self._done.add(key)
+        while self._order and self._order[0] in self._done:
+            for data in self._buffers.pop(self._order.pop(0), ()):
+                self.md5.update(data)
+
+    def hexdigest(self):
+        for key in self._order:
+            for data in self._buffers.pop(key, ()):
+                self.md5.update(data)
+        del self._order[:]
+        return self.md5.hexdigest()
+
+
+def compute_checksum(bookmarks_dict):
+    """
+    Args:
+        bookmarks_dict (dict): Chromium Bookmarks JSON dict
+
+    Returns:
+        str: Chromium's ``checksum`` for ``bookmarks_dict``
+        (see :class:`BookmarksChecksum`)
+    """
+    roots = bookmarks_dict.get('roots') or {}
+    checksum = BookmarksChecksum(roots=roots)
+    for key in CHECKSUM_ROOTS:
+        if key not in roots:
+            continue
+        checksum.start_root(key)
+        stack = [roots[key]]
+        while stack:
+            node = stack.pop()
+            if not hasattr(node, 'get'):
+                continue
+            if node.get('type') in ('url', 'folder'):
+                checksum.update_node(node)
+            stack.extend(reversed(node.get('children') or []))
+        checksum.end_root(key)
+    return checksum.hexdigest()
+
+
+def with_checksum(bookmarks_dict, checksum):
+    """
+    Returns:
+        OrderedDict: a shallow copy of ``bookmarks_dict`` with
+        ``checksum`` as the last key
+    """
+    output = collections.OrderedDict(
+        (key, value) for (key, value) in bookmarks_dict.items()
+        if key != 'checksum')
+    output['checksum'] = checksum
+    return output
+
+
+def get_backend(backend=None, indent=DEFAULT_INDENT):
+    """
+    Args:
+        backend (None, str): ``orjson``, ``ujson``, or ``json``
+            (default: the first of :data:`BACKENDS` which is installed
+            and supports ``indent``)
+
+    Keyword Arguments:
+        indent (None, int): indent (None for compact output)
+
+    Returns:
+        str: backend name
+    """
+    if backend is not None:
+        if backend not in BACKENDS:
+            raise ValueError("Unknown backend: %r (choose from: %s)" % (
+                backend, ', '.join(BACKENDS)))
+        return backend
+    if orjson is not None and indent in (None, 2):
+        return 'orjson'
+    if ujson is not None:
+        return 'ujson'
+    return 'json'
+
+
+def count_nodes(bookmarks_dict):
+    """
+    Args:
+        bookmarks_dict (dict): Chromium Bookmarks JSON dict
+
+    Returns:
+        Counter: ``url`` and ``folder`` node counts
+    """
+    counts = collections.Counter()
+    stack = [bookmarks_dict]
+    while stack:
+        o = stack.pop()
+        if hasattr(o, 'items'):
+            _type = o.get('type')
+            if _type in ('url', 'folder'):
+                counts[_type] += 1
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+    return counts
+
+
+class BookmarksSerializer(object):
+
+    """
+    Serialize Chromium Bookmarks JSON in chunks
+
+    The ``json`` backend output is the same as
+    ``json.dumps(obj, indent=indent, default=default)``
+    (and ``separators=(',', ':')`` when ``indent`` is None).
+    """
+
+    def __init__(self,
+                 indent=DEFAULT_INDENT,
+                 default=None,
+                 backend=None,
+                 ensure_ascii=True,
+                 chunk_size=DEFAULT_CHUNK_SIZE,
+                 verify=False,
+                 checksum=False,
+                 merkle=False):
+        """
+        Keyword Arguments:
+            indent (None, int): indent (None for compact output)
+            default (callable): function which returns a serializable
+                version of an object (as ``json.dumps(default=...)``)
+            backend (None, str): see :func:`get_backend`
+            ensure_ascii (bool): escape non-ASCII characters
+            chunk_size (int): approximate size of each chunk (characters)
+            verify (bool): count nodes and compute a digest (see
+                :attr:`stats`)
+            checksum (bool): compute Chromium's ``checksum`` while
+                serializing and write it as the last top-level key
+                (replacing any ``checksum`` in ``obj``)
+            merkle (bool): compute each folder's subtree digest (see
+                :func:`pbm.merkle.folder_hexdigests`; ``obj`` is not
+                modified)
+        """
+        self.indent = indent
+        self.default = default
+        self.backend = get_backend(backend, indent=indent)
+        self.ensure_ascii = ensure_ascii
+        self.chunk_size = chunk_size
+        self.verify = verify
+        self.checksum = checksum
+        self.merkle = merkle
+        self.stats = None
+        if indent is None:
+            self.item_separator, self.key_separator = ',', ':'
+        else:
+            encoder = json.JSONEncoder(indent=indent)
+            self.item_separator = encoder.item_separator
+            self.key_separator = encoder.key_separator
+        if ensure_ascii:
+            self.encode_str = json.encoder.encode_basestring_ascii
+        else:
+            self.encode_str = json.encoder.encode_basestring
+
+    def encode_key(self, key):
+        if isinstance(key, string_types):
+            return self.encode_str(key)
+        # as json.dumps
+        if key is True:
+            key = 'true'
+        elif key is False:
+            key = 'false'
+        elif key is None:
+            key = 'null'
+        elif isinstance(key, float):
+            key = self.encode_float(key)
+        elif isinstance(key, integer_types):
+            key = str(key)
+        else:
+            raise TypeError("key %r is not a string" % (key,))
+        return self.encode_str(key)
+
+    @staticmethod
+    def encode_float(o):
+        if o != o:
+            return 'NaN'
+        elif o == INFINITY:
+            return 'Infinity'
+        elif o == -INFINITY:
+            return '-Infinity'
+        return repr(o)
+
+    def encode_scalar(self, o):
+        """
+        Returns:
+            str or None: JSON for a string, number, bool, or None
+            (None if ``o`` is not a scalar)
+        """
+        if isinstance(o, string_types):
+            return self.encode_str(o)
+        elif o is None:
+            return 'null'
+        elif o is True:
+            return 'true'
+        elif o is False:
+            return 'false'
+        elif isinstance(o, integer_types):
+            return str(o)
+        elif isinstance(o, float):
+            return self.encode_float(o)
+        return None
+
+    def _encode(self, o, level, parts, _depth=0):
+        """
+        Append the JSON for ``o`` to ``parts``
+
+        Args:
+            o (object): value to encode
+            level (int): current indentation level
+            parts (list[str]): output buffer (see :meth:`_flush`)
+        """
+        _s = self.encode_scalar(o)
+        if _s is not None:
+            parts.append(_s)
+            return
+        is_dict = hasattr(o, 'items')
+        if not (is_dict or isinstance(o, (list, tuple))):
+            if self.default is None or _depth:
+                raise TypeError("%r is not JSON serializable" % (o,))
+            self._encode(self.default(o), level, parts, _depth=_depth + 1)
+            return
+        if not o:
+            parts.append('{}' if is_dict else '[]')
+            return
+        if self.indent is None:
+            newline_indent = close_indent = ''
+        else:
+            newline_indent = '\n' + ' ' * (self.indent * (level + 1))
+            close_indent = '\n' + ' ' * (self.indent * level)
+        separator = self.item_separator + newline_indent
+        first = True
+        if is_dict:
+            _checksum = self._checksum
+            if self.verify or _checksum is not None:
+                _type = o.get('type')
+                if _type in ('url', 'folder'):
+                    if self.verify:
+                        self._counts[_type] += 1
+                    if _checksum is not None:
+                        _checksum.update_node(o)
+            is_top = o is self._top
+            is_roots = o is self._roots
+            key_separator = self.key_separator
+            parts.append('{' + newline_indent)
+            for key, value in o.items():
+                if is_top and key == 'checksum':
+                    continue
+                if first:
+                    first = False
+                else:
+                    parts.append(separator)
+                _s = self.encode_scalar(value)
+                if _s is not None:
+                    parts.append(self.encode_key(key) + key_separator + _s)
+                else:
+                    parts.append(self.encode_key(key) + key_separator)
+                    if is_roots:
+                        _checksum.start_root(key)
+                    self._encode(value, level + 1, parts)
+                    if is_roots:
+                        _checksum.end_root(key)
+            if is_top:
+                if not first:
+                    parts.append(separator)
+                parts.append(self.encode_key('checksum') + key_separator +
+                             self.encode_str(_checksum.hexdigest()))
+            parts.append(close_indent + '}')
+        else:
+            parts.append('[' + newline_indent)
+            for value in o:
+                if first:
+                    first = False
+                else:
+                    parts.append(separator)
+                self._encode(value, level + 1, parts)
+                if len(parts) >= self._flush_parts:
+                    self._flush(parts)
+            parts.append(close_indent + ']')
+
+    def _flush(self, parts):
+        chunk = ''.join(parts)
+        del parts[:]
+        if self._digest is not None:
+            data = chunk.encode('utf-8')
+            self._digest.update(data)
+            self._nbytes += len(data)
+        self._write(chunk)
+
+    def encode(self, obj, write):
+        """
+        Serialize ``obj`` with the tree-walking (``json``) encoder
+
+        Args:
+            obj (dict): Chromium Bookmarks JSON dict (or any JSON value)
+            write (callable): called with each chunk (of about
+                ``chunk_size`` characters)
+
+        Returns:
+            SerializeStats: stats (see ``verify``)
+        """
+        self._counts = collections.Counter()
+        self._digest = hashlib.sha1() if self.verify else None
+        self._nbytes = 0
+        self._write = write
+        # chunks are flushed between list items; assume ~32 chars per part
+        self._flush_parts = max(1, self.chunk_size // 32)
+        self._top = self._roots = self._checksum = None
+        merkle_hexdigests = self._folder_hexdigests(obj)
+        if self.checksum and hasattr(obj, 'items'):
+            self._top = obj
+            roots = obj.get('roots')
+            if hasattr(roots, 'items'):
+                self._roots = roots
+            self._checksum = BookmarksChecksum(roots=self._roots)
+        parts = []
+        self._encode(obj, 0, parts)
+        self._flush(parts)
+        self.stats = SerializeStats(
+            urls=self._counts['url'],
+            folders=self._counts['folder'],
+            nbytes=self._nbytes,
+            sha1=(self._digest.hexdigest()
+                  if self._digest is not None else None),
+            checksum=(self._checksum.hexdigest()
+                      if self._checksum is not None else None),
+            merkle=merkle_hexdigests)
+        return self.stats
+
+    def _folder_hexdigests(self, obj):
+        """
+        Returns:
+            OrderedDict or None: folder id -> subtree hexdigest
+            (None unless ``merkle``)
+        """
+        if self.merkle and hasattr(obj, 'items'):
+            return merkle.folder_hexdigests(obj)
+        return None
+
+    def _dumps_backend(self, obj):
+        """
+        Serialize ``obj`` with an accelerated backend
+
+        Returns:
+            str or None: JSON (None if the backend could not encode ``obj``)
+        """
+        checksum = None
+        merkle_hexdigests = self._folder_hexdigests(obj)
+        if self.checksum and hasattr(obj, 'items'):
+            checksum = compute_checksum(obj)
+            obj = with_checksum(obj, checksum)
+        try:
+            if self.backend == 'orjson':
+                option = 0
+                if self.indent is not None:
+                    option |= orjson.OPT_INDENT_2
+                output = orjson.dumps(obj, default=self.default,
+                                      option=option).decode('utf-8')
+            elif self.backend == 'ujson':
+                output = ujson.dumps(obj,
+                                     indent=self.indent or 0,
+                                     ensure_ascii=self.ensure_ascii)
+            else:
+                return None
+        except (TypeError, OverflowError, ValueError) as e:
+            log.debug(('serialize.backend', self.backend, e))
+            return None
+        if self.verify:
+            counts = count_nodes(obj)
+            data = output.encode('utf-8')
+            self.stats = SerializeStats(
+                urls=counts['url'],
+                folders=counts['folder'],
+                nbytes=len(data),
+                sha1=hashlib.sha1(data).hexdigest(),
+                checksum=checksum,
+                merkle=merkle_hexdigests)
+        elif checksum is not None or merkle_hexdigests is not None:
+            self.stats = SerializeStats(
+                urls=None, folders=None, nbytes=None, sha1=None,
+                checksum=checksum, merkle=merkle_hexdigests)
+        return output
+
+    def dumps(self, obj):
+        """
+        Args:
+            obj (dict): Chromium Bookmarks JSON dict
+
+        Returns:
+            str: JSON
+        """
+        if self.backend != 'json':
+            output = self._dumps_backend(obj)
+            if output is not None:
+                return output
+        chunks = []
+        self.encode(obj, chunks.append)
+        return ''.join(chunks)
+
+    def dump(self, obj, fileobj):
+        """
+        Write ``obj`` to ``fileobj`` in chunks
+
+        Args:
+            obj (dict): Chromium Bookmarks JSON dict
+            fileobj (file): a file-like object which accepts unicode text
+
+        Returns:
+            SerializeStats: stats (see ``verify``)
+        """
+        if self.backend != 'json':
+            output = self._dumps_backend(obj)
+            if output is not None:
+                fileobj.write(output)
+                return self.stats
+        return self.encode(obj, fileobj.write)
+
+
+def dumps(obj, **kwargs):
+    """
+    Keyword Arguments:
+        kwargs (dict): see :class:`BookmarksSerializer`
+
+    Returns:
+        str: JSON
+    """
+    return BookmarksSerializer(**kwargs).dumps(obj)
+
+
+def dump(obj, fileobj, **kwargs):
+    """
+    Keyword Arguments:
+        kwargs (dict): see :class:`BookmarksSerializer`
+
+    Returns:
+        SerializeStats: stats (see ``verify``)
+    """
+    return BookmarksSerializer(**kwargs).dump(obj, fileobj)
+
+
+def verify_json(output_json, stats):
+    """
+    Check serialized JSON against the stats from serializing it
+    (a node count and a digest, instead of a full re-parse)
+
+    Args:
+        output_json (str): serialized JSON
+        stats (SerializeStats): stats from :class:`BookmarksSerializer`
+            (with ``verify=True``)
+
+    Raises:
+        SerializationError: if the output does not match
+
+    Returns:
+        bool: True
+    """
+    counts = collections.Counter(NODE_TYPE_RGX.findall(output_json))
+    if (counts['url'], counts['folder']) != (stats.urls, stats.folders):
+        raise SerializationError(
+            "Expected %d urls and %d folders, found %d and %d" % (
+                stats.urls, stats.folders, counts['url'], counts['folder']))
+    if stats.sha1 is not None:
+        data = output_json.encode('utf-8')
+        sha1 = hashlib.sha1(data).hexdigest()
+        if (len(data), sha1) != (stats.nbytes, stats.sha1):
+            raise SerializationError(
+                "Expected %d bytes with sha1 %s, found %d bytes with "
+                "sha1 %s" % (stats.nbytes, stats.sha1, len(data), sha1))
+    return True
+
+
+def verify_file(path, stats):
+    """
+    Check a written Bookmarks JSON file against the stats from
+    serializing it (see :func:`verify_json`)
+
+    Args:
+        path (str): path to the written file
+        stats (SerializeStats): stats from :class:`BookmarksSerializer`
+
+    Raises:
+        SerializationError: if the file does not match
+
+    Returns:
+        bool: True
+    """
+    with codecs.open(path, encoding='utf-8') as f:
+        return verify_json(f.read(), stats)
@@ -0,0 +1,596 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+"""
+pbm/store.py -- compact, array-backed (columnar) bookmarks store
+
+Each node is a row index into parallel ``array.array`` columns
+(id, type, parent, date_added, date_modified, name, url, guid); names
+and urls are interned in string tables, guids (which are unique) are
+packed into 16 bytes each, and each folder's children are a
+``[child_start, child_end)`` range of the ``child_index`` column.
+Each node's key order is interned too, so nodes are exported with their
+keys in the order they were read.
+
+.. code:: python
+
+    store = BookmarkStore.from_path('./path/to/Bookmarks')  # streaming
+    store = BookmarkStore.from_bookmarks_dict(bookmarks_dict)
+    bookmarks_dict = store.to_bookmarks_dict()  # Chromium JSON layout
+
+"""
+
+import array
+import binascii
+import collections
+import logging
+import sys
+
+import pbm.jsonstream as jsonstream
+
+log = logging.getLogger(__name__)
+
+
+TYPE_URL = 0
+TYPE_FOLDER = 1
+NODE_TYPES = ('url', 'folder')
+
+MISSING = -1
+
+# bytes per node in the guids column (a UUID); all zeros for no guid
+GUID_SIZE = 16
+NO_GUID = b'\0' * GUID_SIZE
+
+# keys which are stored in columns; all other node keys are 'extras'
+COLUMN_KEYS = frozenset((
+    'type', 'id', 'name', 'url', 'guid',
+    'date_added', 'date_modified', 'children'))
+
+DEFAULT_ROOTS = ('bookmark_bar', 'other')
+
+# array (or list) attributes of a BookmarkStore
+COLUMNS = (
+    'ids', 'types', 'parents', 'date_added', 'date_modified',
+    'names', 'urls', 'guids', 'child_start', 'child_end', 'child_index',
+    'key_orders')
+
+
+def get_int64_typecode():
+    """
+    Returns:
+        str or None: an ``array.array`` typecode with at least 64 bits
+        (None if there is no such typecode on this platform)
+    """
+    for typecode in ('q', 'l'):
+        try:
+            if array.array(typecode).itemsize >= 8:
+                return typecode
+        except ValueError:
+            continue
+    return None
+
+
+INT64_TYPECODE = get_int64_typecode()
+
+
+def int64_column(values=()):
+    if INT64_TYPECODE is None:
+        return list(values)
+    return array.array(INT64_TYPECODE, values)
+
+
+def to_int(value, default=MISSING):
+    """
+    Coerce a Chromium id or longdate (str, int, float, or None) to an int
+
+    Returns:
+        int: ``int(value)`` or ``default``
+    """
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return default
+
+
+def _array_tobytes(column):
+    tobytes = getattr(column, 'tobytes', None) or column.tostring
+    return tobytes()
+
+
+def _array_frombytes(column, data):
+    frombytes = getattr(column, 'frombytes', None) or column.fromstring
+    frombytes(data)
+
+
+def pack_guid(guid):
+    """
+    Args:
+        guid (str): a node guid
+
+    Returns:
+        bytes or None: the 16 bytes of ``guid`` (None if ``guid`` is not
+        a lowercase, hyphenated, non-nil UUID; which would not round-trip)
+    """
+    try:
+        if len(guid) != 36:
+            return None
+        packed = binascii.unhexlify(guid.replace('-', ''))
+    except (TypeError, ValueError, AttributeError, binascii.Error):
+        return None
+    if (len(packed) != GUID_SIZE or packed == NO_GUID
+            or unpack_guid(packed) != guid):
+        return None
+    return packed
+
+
+def unpack_guid(packed):
+    """
+    Args:
+        packed (bytes): output of :func:`pack_guid`
+
+    Returns:
+        str: the hyphenated UUID
+    """
+    h = binascii.hexlify(packed).decode('ascii')
+    return u'%s-%s-%s-%s-%s' % (h[:8], h[8:12], h[12:16], h[16:20], h[20:])
+
+
+def pack(obj):
+    """
+    Convert JSON values to builtin types which :mod:`marshal` accepts
+    (which does not accept dict subclasses like OrderedDict);
+    dicts become tuples of ``(key, value)`` pairs, to keep their order
+
+    Returns:
+        object: see :func:`unpack`
+    """
+    if hasattr(obj, 'items'):
+        return tuple((key, pack(value)) for (key, value) in obj.items())
+    if isinstance(obj, list):
+        return [pack(value) for value in obj]
+    return obj
+
+
+def unpack(obj):
+    """
+    Inverse of :func:`pack`
+
+    Returns:
+        object: JSON values (with OrderedDicts)
+    """
+    if isinstance(obj, tuple):
+        return collections.OrderedDict(
+            (key, unpack(value)) for (key, value) in obj)
+    if isinstance(obj, list):
+        return [unpack(value) for value in obj]
+    return obj
+
+
+class StringTable(object):
+
+    """
+    An append-only table of interned strings (or other hashable values;
+    e.g. tuples of keys)
+    """
+
+    def __init__(self, strings=None):
+        self.strings = []
+        self.index = {}
+        for s in strings or []:
+            self.add(s)
+
+    def add(self, s):
+        """
+        Args:
+            s (str): string to intern
+
+        Returns:
+            int: index of ``s`` in the table
+        """
+        idx = self.index.get(s)
+        if idx is None:
+            idx = self.index[s] = len(self.strings)
+            self.strings.append(s)
+        return idx
+
+    def __getitem__(self, idx):
+        return self.strings[idx]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class BookmarkStore(object):
+
+    """
+    Columnar bookmarks store
+
+    Attributes:
+        ids, date_added, date_modified (array): int64 columns
+            (``MISSING`` where the node has no such key)
+        types (array): ``TYPE_URL`` or ``TYPE_FOLDER``
+        parents (array): parent node index (``MISSING`` for root folders)
+        names, urls (array): indexes into ``name_table`` /
+            ``url_table``
+        guids (array): ``GUID_SIZE`` bytes per node (see
+            :func:`pack_guid`; ``NO_GUID`` if the node has no guid, or
+            if it is in ``extras``)
+        child_start, child_end (array): range of ``child_index``
+        child_index (array): node indexes, grouped by parent folder
+        key_orders (array): indexes into ``key_order_table`` (tuples of
+            each node's keys, in the order they were read)
+        extras (dict): node index -> OrderedDict of other node keys
+            (e.g. ``meta_info``; and ids and longdates which are not
+            integer strings)
+        roots (OrderedDict): ``roots`` key -> root folder node index
+        roots_extra (OrderedDict): ``roots`` keys which are not folders
+        header (OrderedDict): top-level keys other than ``roots``
+            and ``checksum``
+        checksum (str or None): the ``checksum`` which was read
+    """
+
+    def __init__(self):
+        self.ids = int64_column()
+        self.types = array.array('b')
+        self.parents = array.array('i')
+        self.date_added = int64_column()
+        self.date_modified = int64_column()
+        self.names = array.array('i')
+        self.urls = array.array('i')
+        self.guids = array.array('B')
+        self.child_start = array.array('i')
+        self.child_end = array.array('i')
+        self.child_index = array.array('i')
+        self.name_table = StringTable()
+        self.url_table = StringTable()
+        self.key_orders = array.array('i')
+        self.key_order_table = StringTable()
+        self.extras = {}
+        self.roots = collections.OrderedDict()
+        self.roots_extra = collections.OrderedDict()
+        self.header = collections.OrderedDict()
+        self.checksum = None
+
+    def __len__(self):
+        return len(self.types)
+
+    def _append(self, node, type_):
+        idx = len(self.types)
+        self.types.append(type_)
+        self.parents.append(MISSING)
+        self.ids.append(to_int(node.get('id')))
+        self.date_added.append(to_int(node.get('date_added')))
+        self.date_modified.append(to_int(node.get('date_modified')))
+        name = node.get('name')
+        self.names.append(
+            MISSING if name is None else self.name_table.add(name))
+        url = node.get('url')
+        self.urls.append(
+            MISSING if url is None else self.url_table.add(url))
+        guid = node.get('guid')
+        packed_guid = None if guid is None else pack_guid(guid)
+        _array_frombytes(self.guids, packed_guid or NO_GUID)
+        self.child_start.append(0)
+        self.child_end.append(0)
+        self.key_orders.append(self.key_order_table.add(tuple(node.keys())))
+        extras = None
+        for key, value in node.items():
+            if key not in COLUMN_KEYS:
+                if extras is None:
+                    extras = collections.OrderedDict()
+                extras[key] = value
+        for key, column in (('id', self.ids),
+                            ('date_added', self.date_added),
+                            ('date_modified', self.date_modified)):
+            value = node.get(key)
+            if value is not None and (column[idx] == MISSING
+                                      or value != str(column[idx])):
+                # keep values which are not integer strings as-is
+                if extras is None:
+                    extras = collections.OrderedDict()
+                extras[key] = value
+        if guid is not None and packed_guid is None:
+            # keep guids which are not UUIDs as-is
+            if extras is None:
+                extras = collections.OrderedDict()
+            extras['guid'] = guid
+        if extras is not None:
+            self.extras[idx] = extras
+        return idx
+
+    def add_events(self, events):
+        """
+        Append nodes from :class:`pbm.jsonstream.StreamEvent` events
+        (post-order: each folder after all of its children)
+
+        Args:
+            events (iterable[StreamEvent]): url and folder events
+
+        Returns:
+            BookmarkStore: self
+        """
+        pending = [[]]  # child node indexes, by depth
+        for event in events:
+            depth = len(event.path)
+            while len(pending) <= depth + 1:
+                pending.append([])
+            if event.type == 'url':
+                pending[depth].append(self._append(event.node, TYPE_URL))
+                continue
+            idx = self._append(event.node, TYPE_FOLDER)
+            children = pending[depth + 1]
+            pending[depth + 1] = []
+            for child in children:
+                self.parents[child] = idx
+            self.child_start[idx] = len(self.child_index)
+            self.child_index.extend(children)
+            self.child_end[idx] = len(self.child_index)
+            if depth:
+                pending[depth].append(idx)
+            else:
+                self.roots[event.root] = idx
+        return self
+
+    @classmethod
+    def from_bookmarks_dict(cls, bookmarks_dict):
+        """
+        Args:
+            bookmarks_dict (dict): Chromium Bookmarks JSON dict
+
+        Returns:
+            BookmarkStore: a new store
+        """
+        store = cls()
+        for key, value in bookmarks_dict.items():
+            if key not in ('roots', 'checksum'):
+                store.header[key] = value
+        store.checksum = bookmarks_dict.get('checksum')
+        for key, node in bookmarks_dict.get('roots', {}).items():
+            if hasattr(node, 'get'):
+                store.add_events(jsonstream.iter_node_events(node, key, []))
+            else:
+                store.roots_extra[key] = node
+        return store
+
+    @classmethod
+    def from_path(cls, bookmarks_path, chunk_size=None):
+        """
+        Incrementally parse a Chromium Bookmarks JSON file into a store
+        (without building a ``bookmarks_dict``)
+
+        Args:
+            bookmarks_path (str): path to a Chromium Bookmarks JSON file
+
+        Keyword Arguments:
+            chunk_size (int): number of characters to read at a time
+
+        Returns:
+            BookmarkStore: a new store
+        """
+        import codecs
+        store = cls()
+        with codecs.open(bookmarks_path, encoding='utf-8') as f:
+            parser = jsonstream.BookmarksStreamParser(
+                f, chunk_size=chunk_size)
+            store.add_events(parser)
+        for key, value in parser.header.items():
+            if key != 'checksum':
+                store.header[key] = value
+        store.checksum = parser.header.get('checksum')
+        store.roots_extra.update(parser.roots_extra)
+        return store
+
+    def to_marshal_data(self):
+        """
+        Returns:
+            dict: builtin types only (for :mod:`marshal`); columns as bytes
+            (see :meth:`from_marshal_data`)
+        """
+        columns = {}
+        for key in COLUMNS:
+            column = getattr(self, key)
+            if isinstance(column, array.array):
+                columns[key] = (column.typecode, _array_tobytes(column))
+            else:
+                columns[key] = (None, list(column))
+        return {
+            'columns': columns,
+            'name_table': list(self.name_table.strings),
+            'url_table': list(self.url_table.strings),
+            'key_order_table': list(self.key_order_table.strings),
+            'extras': [(idx, pack(extras))
+                       for (idx, extras) in self.extras.items()],
+            'roots': list(self.roots.items()),
+            'roots_extra': pack(self.roots_extra),
+            'header': pack(self.header),
+            'checksum': self.checksum,
+        }
+
+    @classmethod
+    def from_marshal_data(cls, data):
+        """
+        Args:
+            data (dict): output of :meth:`to_marshal_data`
+
+        Returns:
+            BookmarkStore: a new store
+        """
+        store = cls()
+        for key, (typecode, values) in data['columns'].items():
+            if typecode is None:
+                column = list(values)
+            else:
+                column = array.array(typecode)
+                _array_frombytes(column, values)
+            setattr(store, key, column)
+        for key in ('name_table', 'url_table', 'key_order_table'):
+            table = getattr(store, key)
+            table.strings = list(data[key])
+            table.index = dict(
+                (s, idx) for (idx, s) in enumerate(table.strings))
+        store.extras = dict(
+            (idx, unpack(extras)) for (idx, extras) in data['extras'])
+        store.roots = collections.OrderedDict(data['roots'])
+        store.roots_extra = unpack(data['roots_extra'])
+        store.header = unpack(data['header'])
+        store.checksum = data['checksum']
+        return store
+
+    def children(self, idx):
+        """
+        Returns:
+            array: child node indexes of folder ``idx``
+        """
+        return self.child_index[self.child_start[idx]:self.child_end[idx]]
+
+    def get_name(self, idx):
+        name_idx = self.names[idx]
+        return None if name_idx == MISSING else self.name_table[name_idx]
+
+    def get_url(self, idx):
+        url_idx = self.urls[idx]
+        return None if url_idx == MISSING else self.url_table[url_idx]
+
+    def get_guid(self, idx):
+        packed = _array_tobytes(
+            self.guids[idx * GUID_SIZE:(idx + 1) * GUID_SIZE])
+        return None if packed == NO_GUID else unpack_guid(packed)
+
+    def node(self, idx, children=False):
+        """
+        Export one node in the Chromium JSON layout (keys, ids, and
+        longdates as they were read)
+
+        Args:
+            idx (int): node index
+
+        Keyword Arguments:
+            children (bool): if True, recursively export children
+                (otherwise folders have ``children: []``)
+
+        Returns:
+            OrderedDict: node dict
+        """
+        node = {}
+        type_ = self.types[idx]
+        node['type'] = NODE_TYPES[type_]
+        for key, column in (('id', self.ids),
+                            ('date_added', self.date_added),
+                            ('date_modified', self.date_modified)):
+            value = column[idx]
+            if value != MISSING:
+                node[key] = str(value)
+        name = self.get_name(idx)
+        if name is not None:
+            node['name'] = name
+        guid = self.get_guid(idx)
+        if guid is not None:
+            node['guid'] = guid
+        if type_ == TYPE_URL:
+            url = self.get_url(idx)
+            if url is not None:
+                node['url'] = url
+        else:
+            node['children'] = (
+                [self.node(x, children=True) for x in self.children(idx)]
+                if children else [])
+        node.update(self.extras.get(idx, {}))
+        key_order = self.key_order_table[self.key_orders[idx]]
+        ordered = collections.OrderedDict(
+            (key, node.pop(key)) for key in key_order if key in node)
+        ordered.update(sorted(node.items()))
+        return ordered
+
+    def to_bookmarks_dict(self):
+        """
+        Export the store in the Chromium Bookmarks JSON layout
+
+        Returns:
+            OrderedDict: Chromium Bookmarks JSON dict (without ``checksum``)
+        """
+        roots = collections.OrderedDict(
+            (key, self.node(idx, children=True))
+            for (key, idx) in self.roots.items())
+        roots.update(self.roots_extra)
+        bookmarks_dict = collections.OrderedDict()
+        bookmarks_dict['roots'] = roots
+        bookmarks_dict.update(self.header)
+        return bookmarks_dict
+
+    def iter_nodes(self, roots=DEFAULT_ROOTS):
+        """
+        DFS (pre-order) walk of the given roots
+
+        Keyword Arguments:
+            roots (tuple[str]): ``roots`` keys to walk
+
+        Yields:
+            tuple: (node index, path) where path is a tuple of
+            ancestor folder node indexes (root folder first)
+        """
+        for key in roots:
+            idx = self.roots.get(key)
+            if idx is None:
+                continue
+            stack = [(idx, ())]
+            while stack:
+                idx, path = stack.pop()
+                yield idx, path
+                if self.types[idx] == TYPE_FOLDER:
+                    _path = path + (idx,)
+                    stack.extend(
+                        (x, _path) for x in reversed(self.children(idx)))
+
+    def iter_urls(self, roots=DEFAULT_ROOTS):
+        """
+        Keyword Arguments:
+            roots (tuple[str]): ``roots`` keys to walk
+
+        Yields:
+            OrderedDict: URL dicts (with the same keys as
+            :meth:`pbm.main.URL.to_json`)
+        """
+        for idx, path in self.iter_nodes(roots=roots):
+            if self.types[idx] != TYPE_URL:
+                continue
+            bookmark = collections.OrderedDict()
+            bookmark['type'] = 'url'
+            id_ = self.ids[idx]
+            bookmark['id'] = self.extras.get(idx, {}).get(
+                'id', None if id_ == MISSING else str(id_))
+            bookmark['name'] = self.get_name(idx)
+            bookmark['url'] = self.get_url(idx)
+            bookmark['path'] = None
+            extras = self.extras.get(idx, {})
+            for key, column in (('date_added', self.date_added),
+                                ('date_modified', self.date_modified)):
+                value = column[idx]
+                bookmark[key] = extras.get(
+                    key, None if value == MISSING else str(value))
+            yield bookmark
+
+    def max_id(self):
+        """
+        Returns:
+            int: the largest integer node id (``MISSING`` if empty)
+        """
+        return max(self.ids) if len(self.ids) else MISSING
+
+    def nbytes(self):
+        """
+        Returns:
+            int: approximate size of the columns and string tables in bytes
+        """
+        columns = [getattr(self, key) for key in COLUMNS]
+        size = sum(sys.getsizeof(c) for c in columns)
+        for table in (self.name_table, self.url_table,
+                      self.key_order_table):
+            size += sys.getsizeof(table.strings)
+            size += sys.getsizeof(table.index)
+            size += sum(sys.getsizeof(s) for s in table.strings)
+        return size
@@ -1,13 +1,26 @@
 # utility functions (seeAlso: six, nine):
 
+import collections
 import datetime
+import functools
 import os.path
 
 import jinja2
 
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
 
 DATETIME_CONST = 2**8 * 3**3 * 5**2 * 79 * 853
 
+# microseconds from 1601-01-01 (the Chromium epoch) to 1970-01-01
+LONGDATE_EPOCH_OFFSET = DATETIME_CONST * 1000000
+US_PER_DAY = 86400 * 1000000
+UNIX_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+NAT_INT64 = -2**63  # numpy.datetime64('NaT').view('int64')
+
 
 def longdate_to_datetime(t_long):
     if t_long is None:
@@ -32,6 +45,243 @@ def get_datetime_now_longdate(dt=None):
     return datetime_to_longdate(dt)
 
 
+def parse_longdate(t_long):
+    """
+    Args:
+        t_long (None, str, int, float): Chromium longdate
+            (microseconds since 1601-01-01)
+
+    Returns:
+        int or None: longdate as an int (None if missing)
+    """
+    if t_long is None or t_long == '':
+        return None
+    try:
+        return int(t_long)
+    except (TypeError, ValueError):
+        return int(float(t_long))
+
+
+def longdates_to_datetime64(longdates, use_numpy=None):
+    """
+    Convert a column of Chromium longdates to microseconds since the
+    Unix epoch, with integer arithmetic
+
+    Args:
+        longdates (iterable): Chromium longdates (str, int, float, or None)
+
+    Keyword Arguments:
+        use_numpy (None, bool): default: True if numpy is installed
+
+    Returns:
+        numpy.ndarray or list: ``datetime64[us]`` array (``NaT`` if missing);
+        or, without numpy, a list of ints (None if missing)
+    """
+    values = [parse_longdate(x) for x in longdates]
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if use_numpy:
+        arr = numpy.array(
+            [NAT_INT64 if x is None else x for x in values],
+            dtype=numpy.int64)
+        missing = arr == NAT_INT64
+        arr -= LONGDATE_EPOCH_OFFSET
+        arr[missing] = NAT_INT64
+        return arr.view('datetime64[us]')
+    return [None if x is None else x - LONGDATE_EPOCH_OFFSET
+            for x in values]
+
+
+def datetime64_to_longdates(values):
+    """
+    Convert a column of timestamps back to Chromium longdates
+    (the inverse of :func:`longdates_to_datetime64`)
+
+    Args:
+        values (iterable): a ``datetime64`` array, or ints (microseconds
+            since the Unix epoch), ``datetime.datetime`` objects, or None
+
+    Returns:
+        list: int longdates (None if missing)
+    """
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        us = values.astype('datetime64[us]').view(numpy.int64)
+        return [None if x == NAT_INT64 else x + LONGDATE_EPOCH_OFFSET
+                for x in us.tolist()]
+    epoch = datetime.datetime.utcfromtimestamp(0)
+    longdates = []
+    for x in values:
+        if x is None:
+            longdates.append(None)
+            continue
+        if isinstance(x, datetime.datetime):
+            delta = x - epoch
+            x = (delta.days * US_PER_DAY +
+                 delta.seconds * 1000000 +
+                 delta.microseconds)
+        longdates.append(x + LONGDATE_EPOCH_OFFSET)
+    return longdates
+
+
+def longdates_to_ymd(longdates, use_numpy=None):
+    """
+    Convert a column of Chromium longdates to (UTC) calendar dates,
+    without creating a ``datetime`` for each value
+
+    Args:
+        longdates (iterable): Chromium longdates (str, int, float, or None)
+
+    Keyword Arguments:
+        use_numpy (None, bool): default: True if numpy is installed
+
+    Returns:
+        list[tuple]: ``(year, month, day)`` int tuples (None if missing)
+    """
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    values = longdates_to_datetime64(longdates, use_numpy=use_numpy)
+    if use_numpy:
+        missing = (values.view(numpy.int64) == NAT_INT64).tolist()
+        months_ = values.astype('datetime64[M]')
+        years = (values.astype('datetime64[Y]').view(numpy.int64)
+                 + 1970).tolist()
+        months = (months_.view(numpy.int64) % 12 + 1).tolist()
+        days = ((values.astype('datetime64[D]').view(numpy.int64) -
+                 months_.astype('datetime64[D]').view(numpy.int64))
+                + 1).tolist()
+        return [None if m else (y, mo, d)
+                for (m, y, mo, d) in zip(missing, years, months, days)]
+    ymd_by_day = {}
+    ymds = []
+    for us in values:
+        if us is None:
+            ymds.append(None)
+            continue
+        day = us // US_PER_DAY
+        ymd = ymd_by_day.get(day)
+        if ymd is None:
+            date = datetime.date.fromordinal(UNIX_EPOCH_ORDINAL + day)
+            ymd = ymd_by_day[day] = (date.year, date.month, date.day)
+        ymds.append(ymd)
+    return ymds
+
+
+def longdates_to_isoformat(longdates):
+    """
+    Format a column of Chromium longdates as ISO 8601 UTC datetime strings
+    (as ``longdate_to_datetime(x).isoformat() + 'Z'``, but with integer
+    arithmetic, so without float rounding)
+
+    Args:
+        longdates (iterable): Chromium longdates (str, int, float, or None)
+
+    Returns:
+        list: ISO strings (e.g. ``2014-07-29T00:12:01.447463Z``);
+        empty values (None, ``''``) are returned as is
+    """
+    date_by_day = {}
+    isoformats = []
+    for longdate in longdates:
+        if not longdate:
+            isoformats.append(longdate)
+            continue
+        us = parse_longdate(longdate) - LONGDATE_EPOCH_OFFSET
+        day, us = divmod(us, US_PER_DAY)
+        date = date_by_day.get(day)
+        if date is None:
+            date = date_by_day[day] = datetime.date.fromordinal(
+                UNIX_EPOCH_ORDINAL + day).isoformat()
+        seconds, us = divmod(us, 1000000)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        if us:
+            isoformats.append('%sT%02d:%02d:%02d.%06dZ' % (
+                date, hours, minutes, seconds, us))
+        else:
+            isoformats.append('%sT%02d:%02d:%02dZ' % (
+                date, hours, minutes, seconds))
+    return isoformats
+
+
+def argsort_longdates(longdates, reverse=False, use_numpy=None):
+    """
+    Stable argsort of a column of Chromium longdates (missing sorts first)
+
+    Args:
+        longdates (iterable): Chromium longdates (str, int, float, or None)
+
+    Keyword Arguments:
+        reverse (bool): sort descending (equal values keep their order,
+            as with ``sorted(..., reverse=True)``)
+        use_numpy (None, bool): default: True if numpy is installed
+
+    Returns:
+        list[int]: indexes of ``longdates``, in sorted order
+    """
+    values = [parse_longdate(x) or 0 for x in longdates]
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if use_numpy:
+        arr = numpy.array(values, dtype=numpy.int64)
+        if reverse:
+            arr = -arr
+        return numpy.argsort(arr, kind='mergesort').tolist()
+    return sorted(range(len(values)),
+                  key=values.__getitem__,
+                  reverse=reverse)
+
+
+
+CacheInfo = collections.namedtuple(
+    'CacheInfo', ('hits', 'misses', 'maxsize', 'currsize'))
+
+
+def _lru_cache(maxsize=128):
+    """
+    A bounded least-recently-used cache decorator for one-argument
+    functions (:func:`functools.lru_cache`, on python 2)
+
+    Keyword Arguments:
+        maxsize (int): maximum number of cached results
+
+    Returns:
+        callable: decorator (the wrapped function has ``cache_info()``
+        and ``cache_clear()``)
+    """
+    def decorator(func):
+        cache = collections.OrderedDict()
+        stats = collections.Counter()
+
+        @functools.wraps(func)
+        def wrapper(arg):
+            try:
+                result = cache.pop(arg)
+            except KeyError:
+                stats['misses'] += 1
+                result = func(arg)
+                if len(cache) >= maxsize:
+                    cache.popitem(last=False)
+            else:
+                stats['hits'] += 1
+            cache[arg] = result
+            return result
+
+        def cache_info():
+            return CacheInfo(stats['hits'], stats['misses'], maxsize,
+                             len(cache))
+
+        def cache_clear():
+            cache.clear()
+            stats.clear()
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
+
+
+lru_cache = getattr(functools, 'lru_cache', _lru_cache)
+
 
 if hasattr(dict, 'iteritems'):
     def itervalues(x):
@@ -62,12 +312,144 @@ def json_default(o):
         return o
 
 
+TEMPLATES_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+_environment = None
+
+
+def get_bytecode_cache(cache_dir=None):
+    """
+    Keyword Arguments:
+        cache_dir (str): default: ``$XDG_CACHE_HOME/pbm/jinja2``
+            (see :func:`pbm.cache.get_cache_dir`)
+
+    Returns:
+        jinja2.FileSystemBytecodeCache or None: None if ``cache_dir``
+        cannot be created
+    """
+    if cache_dir is None:
+        import pbm.cache
+        cache_dir = os.path.join(pbm.cache.get_cache_dir(), 'jinja2')
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+    except OSError:
+        return None
+    return jinja2.FileSystemBytecodeCache(cache_dir)
+
+
+def make_environment(auto_reload=False, bytecode_cache=None):
+    """
+    Keyword Arguments:
+        auto_reload (bool): recompile templates when their files change
+        bytecode_cache (jinja2.BytecodeCache): compiled template cache
+            (shared between processes)
+
+    Returns:
+        jinja2.Environment: for the templates in :data:`TEMPLATES_PATH`
+    """
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(TEMPLATES_PATH),
+        autoescape=True,
+        auto_reload=auto_reload,
+        cache_size=-1,  # never evict compiled templates
+        bytecode_cache=bytecode_cache)
+
+
+def get_environment(auto_reload=None):
+    """
+    Get the process-wide template environment (for the CLI and pbmweb),
+    with a bytecode cache (see :func:`get_bytecode_cache`)
+
+    Keyword Arguments:
+        auto_reload (bool): if not None, set ``auto_reload``
+
+    Returns:
+        jinja2.Environment: the shared environment
+    """
+    global _environment
+    if _environment is None:
+        _environment = make_environment(
+            bytecode_cache=get_bytecode_cache())
+    if auto_reload is not None:
+        _environment.auto_reload = auto_reload
+    return _environment
+
+
+def precompile_templates(environment=None):
+    """
+    Compile (and cache) all of the templates; e.g. at startup
+
+    Keyword Arguments:
+        environment (jinja2.Environment): default: :func:`get_environment`
+
+    Returns:
+        list[str]: template names
+    """
+    if environment is None:
+        environment = get_environment()
+    names = environment.list_templates(extensions=['jinja'])
+    for name in names:
+        environment.get_template(name)
+    return names
+
+
 def get_template(template):
-    env = jinja2.Environment(autoescape=True)
-    loader = jinja2.FileSystemLoader(
-        os.path.join(
-            os.path.dirname(
-                os.path.abspath(__file__)),
-            'templates'))
-    tmpl = loader.load(env, template)
-    return tmpl
+    """
+    Args:
+        template (str): template name (in :data:`TEMPLATES_PATH`)
+
+    Returns:
+        jinja2.Template: the compiled template (from
+        :func:`get_environment`, which caches compiled templates)
+    """
+    return get_environment().get_template(template)
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024  # characters
+
+
+def iter_chunks(fragments, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Join small string fragments (e.g. from ``jinja2.Template.generate``)
+    into chunks of at least ``chunk_size`` characters
+
+    Args:
+        fragments (iterable[str]): strings to join
+
+    Keyword Arguments:
+        chunk_size (int): minimum chunk length (except for the last chunk)
+
+    Yields:
+        str: chunks, in order
+    """
+    buf = []
+    size = 0
+    for fragment in fragments:
+        buf.append(fragment)
+        size += len(fragment)
+        if size >= chunk_size:
+            yield u''.join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield u''.join(buf)
+
+
+def generate_template(template, context=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Render a template incrementally (without building the whole document)
+
+    Args:
+        template (str): template name (in :data:`TEMPLATES_PATH`)
+
+    Keyword Arguments:
+        context (dict): template context
+        chunk_size (int): see :func:`iter_chunks`
+
+    Returns:
+        iterator[str]: rendered chunks
+    """
+    t = get_template(template)
+    return iter_chunks(t.generate(context or {}), chunk_size=chunk_size)
@@ -40,6 +40,9 @@ setup(
                  'pbm'},
     include_package_data=True,
     install_requires=requirements,
+    extras_require={
+        'numpy': ['numpy'],
+    },
     license="BSD",
     zip_safe=False,
     keywords='pbm bookmarks chrome chromium',
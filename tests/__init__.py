@@ -1 +1,17 @@
 # -*- coding: utf-8 -*-
+"""
+The tests write the parse cache, the pbm state, and the Jinja bytecode
+cache (see :func:`pbm.cache.get_cache_dir`) under a temporary
+``$XDG_CACHE_HOME``; not under the developer's ``~/.cache/pbm``.
+(This is set once, before pbm is imported: the template environment
+and its bytecode cache are shared by every test in the process.)
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+
+XDG_CACHE_HOME = tempfile.mkdtemp(prefix='pbm-tests-')
+os.environ['XDG_CACHE_HOME'] = XDG_CACHE_HOME
+atexit.register(shutil.rmtree, XDG_CACHE_HOME, True)
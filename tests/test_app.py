@@ -7,6 +7,8 @@ test_app.py -- test pbm.app tornado application
 
 from contextlib import contextmanager
 
+import os
+
 import tornado.testing
 from urlobject import URLObject
 
@@ -45,6 +47,20 @@ class Test_app(tornado.testing.AsyncHTTPTestCase):
             self.assertEqual(resp.code, 200)
             self.assertEqual(URLObject(resp.effective_url).path, '/login')
 
+    def test_jinja_environment(self):
+        import pbm.utils
+        environment = self._app.settings['jinja_environment']
+        self.assertIs(environment, pbm.utils.get_environment())
+        self.assertIs(self._app.jinja_environment, environment)
+        self.assertFalse(environment.auto_reload)
+        self.assertEqual(len(environment.cache),
+                         len(pbm.utils.precompile_templates()))
+        try:
+            make_app({'debug': True})
+            self.assertTrue(environment.auto_reload)
+        finally:
+            environment.auto_reload = False
+
     def test_login(self):
         resp = self.fetch('/login')
         self.assertEqual(resp.code, 200)
@@ -90,12 +106,288 @@ class Test_app(tornado.testing.AsyncHTTPTestCase):
             self.assertTrue(data)
             self.assertTrue(isinstance(data, list))
 
+    def test_bookmarks_pagination(self):
+        import json
+        with nop_auth():
+            resp = self.fetch('/bookmarks/chrome/links.json')
+            urls = json.loads(resp.body)
+            self.assertNotIn('Link', resp.headers)
+
+            url = '/bookmarks/chrome/links.json?limit=5'
+            pages = []
+            while url:
+                resp = self.fetch(url)
+                self.assertEqual(resp.code, 200)
+                pages.append(json.loads(resp.body))
+                link = resp.headers.get('Link')
+                url = None
+                if link:
+                    self.assertTrue(link.endswith('>; rel="next"'))
+                    url = link[1:link.index('>')]
+                    self.assertIn('limit=5', url)
+            self.assertEqual(sum(pages, []), urls)
+            self.assertEqual(len(pages[0]), 5)
+
+            resp = self.fetch(
+                '/bookmarks/chrome/links.json?since=2000-01-01&limit=3')
+            self.assertEqual(resp.code, 200)
+            self.assertEqual(len(json.loads(resp.body)), 3)
+            self.assertIn('since=2000-01-01', resp.headers['Link'])
+
+            resp = self.fetch('/bookmarks/chrome/list?limit=2')
+            self.assertEqual(resp.code, 200)
+            self.assertEqual(resp.body.count('<li '), 2)
+            self.assertIn('rel="next"', resp.body)
+            self.assertIn('Link', resp.headers)
+
+            for query in ('limit=0', 'limit=x', 'after=x', 'since=x',
+                          'order=x', 'order=tree&since=2000-01-01'):
+                resp = self.fetch('/bookmarks/chrome/links.json?' + query)
+                self.assertEqual(resp.code, 400, query)
+
+    def test_bookmarks_search(self):
+        with nop_auth():
+            resp = self.fetch('/bookmarks/search?q=wrd+docs')
+            self.assertEqual(resp.code, 200)
+            import json
+            data = json.loads(resp.body)
+            self.assertEqual(data['query'], 'wrd docs')
+            self.assertTrue(data['results'])
+            self.assertEqual(data['results'][0]['url'],
+                             'http://wrdrd.github.io/docs/')
+
+            for limit in ('x', '0', '1001'):
+                resp = self.fetch('/bookmarks/search?q=wrd&limit=' + limit)
+                self.assertEqual(resp.code, 400, limit)
+            resp = self.fetch('/bookmarks/search?q=wrd&limit=1')
+            self.assertEqual(len(json.loads(resp.body)['results']), 1)
+
+            # built from the snapshot; not saved next to the file
+            import pbm.search
+            self.assertFalse(os.path.exists(
+                pbm.search.get_index_path(self._app.settings['cb']
+                                          .bookmarks_path)))
+
+    def test_response_cache(self):
+        with nop_auth():
+            resp = self.fetch('/bookmarks/chrome/links.json')
+            self.assertEqual(resp.code, 200)
+            # (uncompressed until the cached body is compressed)
+            identity_etag = resp.headers['Etag']
+            response_cache = self._app.settings['response_cache']
+            self.io_loop.run_sync(response_cache.join)
+            resp = self.fetch('/bookmarks/chrome/links.json')
+            etag = resp.headers['Etag']
+            last_modified = resp.headers['Last-Modified']
+            self.assertTrue(etag.startswith('"'))
+            self.assertTrue(last_modified)
+
+            stats = dict(response_cache.stats)
+            resp2 = self.fetch('/bookmarks/chrome/links.json')
+            self.assertEqual(resp2.body, resp.body)
+            self.assertEqual(resp2.headers['Etag'], etag)
+            self.assertEqual(response_cache.stats['hit'],
+                             stats.get('hit', 0) + 1)
+
+            resp = self.fetch('/bookmarks/chrome/links.json',
+                              headers={'If-None-Match': etag})
+            self.assertEqual(resp.code, 304)
+            self.assertEqual(resp.body, b'')
+            resp = self.fetch('/bookmarks/chrome/links.json',
+                              headers={'If-None-Match': '"x"'})
+            self.assertEqual(resp.code, 200)
+            resp = self.fetch('/bookmarks/chrome/links.json',
+                              headers={'If-Modified-Since': last_modified})
+            self.assertEqual(resp.code, 304)
+
+            # query args are part of the key
+            resp = self.fetch('/bookmarks/chrome/json?indent=2')
+            self.assertEqual(resp.code, 200)
+            resp4 = self.fetch('/bookmarks/chrome/json?indent=4')
+            self.assertNotEqual(resp4.headers['Etag'], resp.headers['Etag'])
+
+            # a new data version is a miss
+            self._app.settings['cb'].invalidate()
+            stats = dict(response_cache.stats)
+            resp = self.fetch('/bookmarks/chrome/links.json')
+            self.assertEqual(resp.headers['Etag'], identity_etag)
+            self.assertEqual(response_cache.stats['miss'],
+                             stats.get('miss', 0) + 1)
+
+    def test_response_cache_evict(self):
+        from pbm.app import ResponseCache
+        response_cache = ResponseCache(max_bytes=10)
+        response_cache.set('a', b'1234')
+        response_cache.set('b', b'1234')
+        self.assertIsNotNone(response_cache.get('a'))
+        response_cache.set('c', b'1234')
+        self.assertEqual(list(response_cache.entries), ['a', 'c'])
+        self.assertEqual(response_cache.nbytes, 8)
+        self.assertEqual(response_cache.stats['evict'], 1)
+        entry = response_cache.set('d', b'12345678901')
+        self.assertTrue(entry.etag)
+        self.assertIsNone(response_cache.get('d'))
+        self.assertEqual(len(response_cache), 2)
+        response_cache = ResponseCache(max_bytes=10, max_entry_bytes=4)
+        response_cache.set('a', b'12345')
+        self.assertEqual(len(response_cache), 0)
+        self.assertEqual(ResponseCache(max_bytes=10).max_entry_bytes, 10)
+
+    def test_response_cache_compress_later(self):
+        import gzip
+        import io
+        from pbm.app import ResponseCache
+        response_cache = ResponseCache(encodings=('gzip',),
+                                       compress_min_size=4)
+        body = b'1234' * 100
+        entry = response_cache.set('a', body)
+        # served uncompressed until the executor is done
+        self.assertEqual(dict(entry.encodings), {})
+        self.assertIn('a', response_cache.pending)
+        self.assertEqual(response_cache.nbytes, len(body))
+        self.io_loop.run_sync(response_cache.join)
+        self.assertEqual(response_cache.pending, {})
+        self.assertEqual(list(entry.encodings), ['gzip'])
+        with gzip.GzipFile(
+                fileobj=io.BytesIO(entry.encodings['gzip'])) as f:
+            self.assertEqual(f.read(), body)
+        self.assertEqual(response_cache.nbytes, entry.size)
+        self.assertEqual(response_cache.stats['compress'], 1)
+
+        # an entry which was replaced meanwhile is not updated
+        entry = response_cache.set('b', body)
+        response_cache.set('b', body + b'5')
+        self.io_loop.run_sync(response_cache.join)
+        self.assertEqual(dict(entry.encodings), {})
+        self.assertEqual(list(response_cache.get('b').encodings), ['gzip'])
+        self.assertEqual(response_cache.nbytes, sum(
+            x.size for x in response_cache.entries.values()))
+
+        # compressed copies which would not fit are not kept
+        response_cache = ResponseCache(max_bytes=len(body) + 1,
+                                       encodings=('gzip',),
+                                       compress_min_size=4)
+        entry = response_cache.set('a', body)
+        self.io_loop.run_sync(response_cache.join)
+        self.assertEqual(dict(entry.encodings), {})
+        self.assertIs(response_cache.get('a'), entry)
+
+    def test_response_cache_encodings(self):
+        import gzip
+        import io
+        with nop_auth():
+            resp = self.fetch('/bookmarks/chrome/json',
+                              decompress_response=False)
+            self.assertEqual(resp.code, 200)
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+            body = resp.body
+            etag = resp.headers['Etag']
+            response_cache = self._app.settings['response_cache']
+            self.io_loop.run_sync(response_cache.join)
+
+            headers = {'Accept-Encoding': 'deflate, gzip;q=0.5'}
+            resp = self.fetch('/bookmarks/chrome/json', headers=headers,
+                              decompress_response=False)
+            self.assertEqual(resp.code, 200)
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertLess(len(resp.body), len(body))
+            with gzip.GzipFile(fileobj=io.BytesIO(resp.body)) as f:
+                self.assertEqual(f.read(), body)
+            gzip_etag = resp.headers['Etag']
+            self.assertNotEqual(gzip_etag, etag)
+
+            resp = self.fetch('/bookmarks/chrome/json',
+                              headers=dict(headers,
+                                           **{'If-None-Match': gzip_etag}),
+                              decompress_response=False)
+            self.assertEqual(resp.code, 304)
+            resp = self.fetch('/bookmarks/chrome/json',
+                              headers={'Accept-Encoding': 'gzip;q=0'},
+                              decompress_response=False)
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertEqual(resp.body, body)
+
+            # streamed responses are compressed once they are cached
+            resp = self.fetch('/bookmarks/chrome/tree')
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.io_loop.run_sync(response_cache.join)
+            resp2 = self.fetch('/bookmarks/chrome/tree', headers=headers,
+                               decompress_response=False)
+            self.assertEqual(resp2.headers['Content-Encoding'], 'gzip')
+            with gzip.GzipFile(fileobj=io.BytesIO(resp2.body)) as f:
+                self.assertEqual(f.read(), resp.body)
+
+    def test_parse_accept_encoding(self):
+        from pbm.app import parse_accept_encoding
+        self.assertEqual(parse_accept_encoding('gzip, br;q=0.5, *;q=0'),
+                         {'gzip': 1.0, 'br': 0.5, '*': 0.0})
+        self.assertEqual(parse_accept_encoding(None), {})
+        self.assertEqual(parse_accept_encoding('gzip;q=x'), {'gzip': 0.0})
+
+    def test_rdf_uri_escape(self):
+        from pbm.app import rdf_uri_escape, _rdf_uri_escape
+        from pbm.plugins.bookmarkletsfolder import BookmarkletsFolderPlugin
+        import urllib
+
+        def reference(url):
+            return u''.join(
+                urllib.quote(c) if (c < u'\x20' or c in u' <>"{}|^`\\')
+                else c for c in url)
+
+        urls = [x['url'] for x in BookmarkletsFolderPlugin.default_bookmarklets]
+        urls += [u'https://example.org/a?b=c#d', u'',
+                 u'http://example.org/\x00\x1f\u2603 \\']
+        _rdf_uri_escape.cache_clear()
+        for url in urls:
+            self.assertEqual(rdf_uri_escape(url), reference(url))
+        self.assertEqual(rdf_uri_escape(u'a b\n'), u'a%20b%0A')
+        url = urls[0]
+        self.assertEqual(rdf_uri_escape(url), reference(url))
+        self.assertGreaterEqual(_rdf_uri_escape.cache_info().hits, 1)
+
     def test_bookmarks_tree(self):
         with nop_auth():
             resp = self.fetch('/bookmarks/chrome/tree')
             self.assertEqual(resp.code, 200)
             self.assertIn('''typeof="pb:BookmarksTree"''', resp.body)
 
+    def test_bookmarks_tree_streamed(self):
+        self._app.settings['stream_chunk_size'] = 1024
+        with nop_auth():
+            resp = self.fetch('/bookmarks/chrome/tree')
+            self.assertEqual(resp.code, 200)
+            self.assertEqual(resp.headers.get('Transfer-Encoding'),
+                             'chunked')
+            etag = resp.headers['Etag']
+            self.assertTrue(etag.startswith('W/"'))
+
+            response_cache = self._app.settings['response_cache']
+            stats = dict(response_cache.stats)
+            resp2 = self.fetch('/bookmarks/chrome/tree',
+                               decompress_response=False)
+            self.assertEqual(resp2.body, resp.body)
+            self.assertEqual(resp2.headers['Etag'], etag)
+            self.assertEqual(response_cache.stats['hit'],
+                             stats.get('hit', 0) + 1)
+
+            # a response larger than max_entry_bytes is streamed; but
+            # not buffered (or cached)
+            response_cache.clear()
+            response_cache.max_entry_bytes = len(resp.body) - 1
+            resp = self.fetch('/bookmarks/chrome/tree')
+            self.assertEqual(resp2.body, resp.body)
+            self.assertEqual(len(response_cache), 0)
+
+            self._app.settings['response_cache'] = None
+            resp = self.fetch('/bookmarks/chrome/tree',
+                              headers={'If-None-Match': etag})
+            self.assertEqual(resp.code, 304)
+            resp = self.fetch('/bookmarks/chrome/list')
+            self.assertEqual(resp.code, 200)
+            self.assertEqual(resp.headers.get('Transfer-Encoding'),
+                             'chunked')
+
     def test_bookmarks_tree_rdfa(self):
         with nop_auth():
             resp = self.fetch('/bookmarks/chrome/tree')
@@ -123,3 +415,102 @@ class Test_app(tornado.testing.AsyncHTTPTestCase):
                 pass
                 # TODO: skipif
 
+
+
+class Test_datasource(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+        super(Test_datasource, self).setUp()
+        import shutil
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'Bookmarks')
+        shutil.copy(os.path.join('tests', 'data', 'Bookmarks'), self.path)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+        super(Test_datasource, self).tearDown()
+
+    def rename_other(self, name):
+        import json
+        import pbm.fileio
+        with open(self.path) as f:
+            bookmarks_dict = json.load(f)
+        bookmarks_dict['roots']['other']['name'] = name
+        pbm.fileio.atomic_write(
+            self.path, lambda f: f.write(json.dumps(bookmarks_dict)))
+        st = os.stat(self.path)
+        os.utime(self.path, (st.st_atime, st.st_mtime + 10))
+
+    def test_reload(self):
+        from pbm.datasource import BookmarksDataSource
+        datasource = BookmarksDataSource(self.path, poll_interval=0.01,
+                                         debounce=0.01)
+        cb = datasource.cb
+        self.assertFalse(datasource.is_stale())
+        datasource.add_callback(lambda cb: self.stop(cb))
+        self.assertEqual(datasource.start(io_loop=self.io_loop), 'poll')
+        try:
+            self.rename_other(u'renamed')
+            self.assertTrue(datasource.is_stale())
+            new_cb = self.wait(timeout=5)
+        finally:
+            datasource.stop()
+        self.assertIsNot(new_cb, cb)
+        self.assertIs(datasource.cb, new_cb)
+        self.assertEqual(datasource.generation, 1)
+        self.assertEqual(
+            new_cb.bookmarks_dict['roots']['other']['name'], u'renamed')
+        self.assertFalse(datasource.is_stale())
+
+    def test_reload_search_index(self):
+        from pbm.app import get_datasource, get_search_index
+        settings = {}
+        datasource = get_datasource(settings, self.path, start=False)
+        search_indexes = settings['search_indexes']
+        key = os.path.abspath(self.path)
+        # not built until it is first requested
+        self.assertIsNone(
+            get_search_index(search_indexes, datasource.cb, refresh=True))
+        future = get_search_index(search_indexes, datasource.cb)
+        self.assertIs(get_search_index(search_indexes, datasource.cb),
+                      future)
+        self.io_loop.add_future(future, lambda f: self.stop(f.result()))
+        index = self.wait(timeout=5)
+        self.assertFalse(index.search(u'renamed'))
+
+        # (urls in 'other' are indexed with its name)
+        import json
+        with open(self.path) as f:
+            bookmarks_dict = json.load(f)
+        bookmarks_dict['roots']['other']['children'].append(
+            {'type': 'url', 'id': '1000', 'name': u'x',
+             'url': u'http://example.org/'})
+        with open(self.path, 'w') as f:
+            json.dump(bookmarks_dict, f)
+        self.rename_other(u'renamed')
+        future = datasource.reload()
+        self.io_loop.add_future(
+            future, lambda f: self.io_loop.add_callback(self.stop))
+        self.wait(timeout=5)
+        cb, version, future = search_indexes[key]
+        self.assertIs(cb, datasource.cb)
+        self.io_loop.add_future(future, lambda f: self.stop(f.result()))
+        index = self.wait(timeout=5)
+        self.assertTrue(index.search(u'renamed'))
+        self.assertEqual(index.key, datasource.cb.source_key)
+
+    def test_reload_error(self):
+        from pbm.datasource import BookmarksDataSource
+        datasource = BookmarksDataSource(self.path)
+        cb = datasource.cb
+        with open(self.path, 'w') as f:
+            f.write('{"roots": ')
+        future = datasource.reload()
+        self.io_loop.add_future(
+            future, lambda f: self.io_loop.add_callback(self.stop))
+        self.wait(timeout=5)
+        self.assertIs(datasource.cb, cb)
+        self.assertEqual(datasource.stats['error'], 1)
+        self.assertFalse(datasource.is_stale())
@@ -12,11 +12,15 @@ import unittest
 
 import pbm
 import pbm.main as pb
+import pbm.utils
 
+import codecs
 import collections
+import datetime
 import itertools
 import json
 import logging
+import os
 
 log = logging.getLogger(__name__)
 
@@ -25,13 +29,20 @@ pbm
 class TestPromiumbookmarks(unittest.TestCase):
 
     def setUp(self):
+        import tempfile
         self.bookmarks_path = './tests/data/Bookmarks'
+        # files written by the tests (not into ./tests/data)
+        self.tmpdir = tempfile.mkdtemp()
 
     def log(self, *args):
         print(args)
 
     def tearDown(self):
-        pass
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def get_tmp_path(self, name):
+        return os.path.join(self.tmpdir, 'Bookmarks.%s' % name)
 
     def test_00_imports(self):
         import pbm.main as pb
@@ -41,6 +52,15 @@ class TestPromiumbookmarks(unittest.TestCase):
         import pbm.plugins.datefolders as dbf
         self.assertTrue(dbf)
 
+    def test_00_imports_standalone(self):
+        import subprocess
+        import sys
+        # modules which pbm.main imports (and which use pbm.main)
+        for name in ('pbm.merge', 'pbm.diff', 'pbm.profiles'):
+            self.assertEqual(
+                subprocess.call([sys.executable, '-c', 'import %s' % name]),
+                0, name)
+
     def test_01_list_bookmarks(self):
         from pbm.main import list_profile_bookmarks
         output = list_profile_bookmarks()
@@ -93,6 +113,386 @@ class TestPromiumbookmarks(unittest.TestCase):
         bookmarks = list(ChromiumBookmarks.iter_bookmarks(self.bookmarks_path))
         self.assertTrue(bookmarks)
 
+    def test_32_generate_template(self):
+        import pbm.app
+        import pbm.utils as utils
+        from pbm.main import ChromiumBookmarks
+        self.assertEqual(list(utils.iter_chunks(['ab', 'c', 'de', 'f'], 3)),
+                         ['abc', 'def'])
+        self.assertEqual(list(utils.iter_chunks(['abcd', 'e'], 3)),
+                         ['abcd', 'e'])
+        self.assertEqual(list(utils.iter_chunks([], 3)), [])
+        cb = ChromiumBookmarks(self.bookmarks_path)
+        context = {
+            'bookmarks': cb,
+            'longdate_isoformats': cb.get_longdate_isoformats(),
+            'rdf_uri_escape': pbm.app.rdf_uri_escape}
+        template_name = 'bookmarks_tree_partial.jinja'
+        htmlstr = utils.get_template(template_name).render(context)
+        chunks = list(utils.generate_template(template_name, context,
+                                              chunk_size=1024))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(u''.join(chunks), htmlstr)
+
+        from pbm.main import main
+        import StringIO
+        stdout = StringIO.StringIO()
+        self.assertEqual(
+            main(['--print-html', '--no-cache', self.bookmarks_path],
+                 stdout=stdout), 0)
+        self.assertEqual(stdout.getvalue(), htmlstr + u'\n')
+
+    def test_32_get_template(self):
+        import pbm.utils as utils
+        environment = utils.get_environment()
+        self.assertIs(utils.get_environment(), environment)
+        template = utils.get_template('bookmarks_tree_partial.jinja')
+        self.assertIs(utils.get_template('bookmarks_tree_partial.jinja'),
+                      template)
+        names = utils.precompile_templates()
+        self.assertIn('bookmarks_tree_partial.jinja', names)
+        self.assertEqual(len(environment.cache), len(names))
+
+    def test_34_stream_bookmarks(self):
+        from pbm.main import ChromiumBookmarks
+        bookmarks = list(ChromiumBookmarks.iter_bookmarks(self.bookmarks_path))
+        for chunk_size in (None, 7, 64):
+            streamed = list(ChromiumBookmarks.stream_bookmarks(
+                self.bookmarks_path, chunk_size=chunk_size))
+            self.assertEqual(streamed, bookmarks)
+        streamed = list(ChromiumBookmarks.iter_bookmarks(
+            self.bookmarks_path, stream=True))
+        self.assertEqual(streamed, bookmarks)
+
+    def test_34_stream_bookmarks_filterfunc(self):
+        import os
+        import shutil
+        import tempfile
+        from pbm.main import ChromiumBookmarks
+
+        def folder(id_, name, children):
+            return {'children': children, 'id': id_, 'name': name,
+                    'type': 'folder'}
+
+        def url(id_, url_):
+            return {'id': id_, 'name': url_, 'type': 'url', 'url': url_}
+
+        bookmarks_dict = {
+            'roots': {
+                'bookmark_bar': folder('1', 'Bookmarks bar', [
+                    url('2', 'http://a/'),
+                    folder('3', 'chrome', [
+                        url('4', 'http://skipped/'),
+                        folder('5', 'nested', [url('6', 'http://b/')])]),
+                    folder('7', 'fldr', [
+                        url('8', 'javascript:void(0)'),
+                        folder('9', 'nested', [url('10', 'http://c/')]),
+                        url('11', 'http://d/')]),
+                    url('12', 'http://e/')]),
+                'other': folder('13', 'Other bookmarks', [
+                    url('14', 'http://f/')]),
+                'synced': folder('15', 'Mobile bookmarks', [])},
+            'version': 1}
+        tmpdir = tempfile.mkdtemp()
+        try:
+            bookmarks_path = os.path.join(tmpdir, 'Bookmarks')
+            with codecs.open(bookmarks_path, 'w', encoding='utf-8') as f:
+                # Chromium key order: 'children' before 'name' and 'type'
+                json.dump(bookmarks_dict, f, indent=3, sort_keys=True)
+            filterfunc = ChromiumBookmarks.chrome_filterfunc
+            bookmarks = list(ChromiumBookmarks.iter_bookmarks(
+                bookmarks_path, filterfunc=filterfunc))
+            self.assertEqual([b['id'] for b in bookmarks],
+                             ['2', '10', '11', '12', '14'])
+            for chunk_size in (None, 7):
+                streamed = list(ChromiumBookmarks.stream_bookmarks(
+                    bookmarks_path, filterfunc=filterfunc,
+                    chunk_size=chunk_size))
+                self.assertEqual(streamed, bookmarks)
+            streamed = list(ChromiumBookmarks.iter_bookmarks(
+                bookmarks_path, filterfunc=filterfunc, stream=True))
+            self.assertEqual(streamed, bookmarks)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_35_stream_events(self):
+        import io
+        from pbm.jsonstream import BookmarksStreamParser
+        # Chromium writes 'children' before the other folder keys
+        data = json.dumps(collections.OrderedDict((
+            ('checksum', 'abc'),
+            ('roots', collections.OrderedDict((
+                ('bookmark_bar', collections.OrderedDict((
+                    ('children', [
+                        {'type': 'url', 'id': '2', 'name': u'a{',
+                         'url': 'http://a/'},
+                        collections.OrderedDict((
+                            ('children', [
+                                {'type': 'url', 'id': '4', 'name': 'b',
+                                 'url': 'http://b/}',
+                                 'meta_info': {'k': 'v'}}]),
+                            ('id', '3'),
+                            ('name', 'fldr'),
+                            ('type', 'folder')))]),
+                    ('id', '1'),
+                    ('name', 'Bookmarks bar'),
+                    ('type', 'folder')))),
+                ('sync_transaction_version', '1')))),
+            ('version', 1))))
+        parser = BookmarksStreamParser(io.StringIO(data.decode('utf-8')),
+                                       chunk_size=5)
+        # ancestor fields which follow 'children' are filled in later
+        events = [(e.type, e.root, e.node.get('id'),
+                   [x.get('name') for x in e.path])
+                  for e in list(parser)]
+        self.assertEqual(events, [
+            ('url', 'bookmark_bar', '2', ['Bookmarks bar']),
+            ('url', 'bookmark_bar', '4', ['Bookmarks bar', 'fldr']),
+            ('folder', 'bookmark_bar', '3', ['Bookmarks bar']),
+            ('folder', 'bookmark_bar', '1', [])])
+        self.assertEqual(parser.header, {'checksum': 'abc', 'version': 1})
+        self.assertEqual(parser.roots_extra,
+                         {'sync_transaction_version': '1'})
+
+    def test_36_bookmark_store(self):
+        from pbm.main import ChromiumBookmarks
+        cb = ChromiumBookmarks(self.bookmarks_path)
+        store = cb.to_bookmark_store()
+        self.assertTrue(len(store))
+        from pbm.jsonstream import iter_bookmark_events
+        self.assertEqual(store.max_id(),
+                         max(int(e.node['id']) for e in
+                             iter_bookmark_events(self.bookmarks_path)))
+
+        def normalize(bookmark):
+            return dict(
+                (k, v if v is None or k not in ('id', 'date_added',
+                                                'date_modified')
+                 else str(v))
+                for (k, v) in bookmark.items())
+        self.assertEqual(
+            [normalize(b) for b in store.iter_urls()],
+            [normalize(b) for b in cb])
+
+        # streaming load == dict load
+        store2 = ChromiumBookmarks.read_bookmark_store(self.bookmarks_path)
+        bookmarks_dict = store.to_bookmarks_dict()
+        self.assertEqual(store2.to_bookmarks_dict(), bookmarks_dict)
+        self.assertEqual(
+            list(store2.roots),
+            [k for (k, v) in cb.bookmarks_dict['roots'].items()
+             if hasattr(v, 'get')])
+        self.assertIn('sync_transaction_version',
+                      bookmarks_dict['roots'])
+        self.assertEqual(bookmarks_dict['version'], 1)
+
+        # export -> load -> export is stable
+        cb2 = ChromiumBookmarks.from_bookmark_store(store)
+        self.assertEqual(cb2.to_bookmark_store().to_bookmarks_dict(),
+                         bookmarks_dict)
+        self.assertEqual(len(list(cb2)), len(list(cb)))
+
+    def test_36_bookmark_store_key_order(self):
+        import pbm.store
+        url = collections.OrderedDict((
+            ('url', 'http://a/'), ('type', 'url'), ('name', 'a'),
+            ('id', '2'), ('guid', 'g2')))
+        folder = collections.OrderedDict((
+            ('children', [url]), ('id', '1'), ('name', 'Bookmarks bar'),
+            ('type', 'folder')))
+        store = pbm.store.BookmarkStore.from_bookmarks_dict(
+            {'roots': {'bookmark_bar': folder}})
+        for store in (store, pbm.store.BookmarkStore.from_marshal_data(
+                store.to_marshal_data())):
+            node = store.to_bookmarks_dict()['roots']['bookmark_bar']
+            self.assertEqual(list(node), list(folder))
+            self.assertEqual(list(node['children'][0]), list(url))
+            self.assertEqual(len(store.key_order_table), 2)
+
+    def test_36_bookmark_store_guids(self):
+        import sys
+        import uuid
+        import pbm.store
+        guids = [str(uuid.UUID(int=i * 0xabcdef, version=4))
+                 for i in range(1, 1001)]
+        bookmarks_dict = {'roots': {'bookmark_bar': {
+            'type': 'folder', 'id': '1', 'name': 'Bookmarks bar',
+            'guid': guids[0],
+            'children': [
+                {'type': 'url', 'id': str(i + 1), 'name': 'a',
+                 'url': 'http://a/%d' % i,
+                 'guid': guid}
+                for i, guid in enumerate(guids[1:], 1)]}}}
+        store = pbm.store.BookmarkStore.from_bookmarks_dict(bookmarks_dict)
+        # Chromium writes a (unique) guid on every node: not per-node
+        # extras, nor an interned string table; 16 bytes per node
+        self.assertEqual(store.extras, {})
+        self.assertEqual(len(store.guids),
+                         pbm.store.GUID_SIZE * len(store))
+        self.assertLess(sys.getsizeof(store.guids),
+                        sum(sys.getsizeof(x) for x in guids) // 3)
+        for store in (store, pbm.store.BookmarkStore.from_marshal_data(
+                store.to_marshal_data())):
+            self.assertEqual(
+                json.loads(json.dumps(store.to_bookmarks_dict())),
+                bookmarks_dict)
+
+        # guids which would not round-trip are kept as-is
+        children = bookmarks_dict['roots']['bookmark_bar']['children']
+        for node, guid in zip(children, [
+                'g2', guids[2].upper(), '0' * 32,
+                '00000000-0000-0000-0000-000000000000',
+                u'\xe9' * 36]):
+            node['guid'] = guid
+        del children[5]['guid']
+        store = pbm.store.BookmarkStore.from_bookmarks_dict(bookmarks_dict)
+        idxs = dict((id_, idx) for (idx, id_) in enumerate(store.ids))
+        self.assertEqual(sorted(store.ids[x] for x in store.extras),
+                         [2, 3, 4, 5, 6])
+        self.assertIsNone(store.get_guid(idxs[7]))
+        self.assertEqual(store.get_guid(idxs[8]), guids[7])
+        for store in (store, pbm.store.BookmarkStore.from_marshal_data(
+                store.to_marshal_data())):
+            self.assertEqual(
+                json.loads(json.dumps(store.to_bookmarks_dict())),
+                bookmarks_dict)
+
+    def test_37_bookmarks_list_cache(self):
+        from pbm.main import ChromiumBookmarks
+        cb = ChromiumBookmarks(self.bookmarks_path)
+        bookmarks_list = cb.bookmarks_list
+        self.assertIs(cb.bookmarks_list, bookmarks_list)
+
+        version = cb.version
+        cb.add_bookmark_bar_folder(
+            folder_name='test37',
+            folder_nodes=[{'type': 'url', 'id': cb.ids.next(),
+                           'name': 'test37', 'url': 'http://example.org/'}])
+        self.assertGreater(cb.version, version)
+        self.assertEqual(len(cb.bookmarks_list), len(bookmarks_list) + 1)
+
+        bookmarks_list = cb.bookmarks_list
+        cb.remove_bookmark_bar_folders('test37')
+        self.assertEqual(len(cb.bookmarks_list), len(bookmarks_list) - 1)
+
+        # in-place mutation + invalidate()
+        bookmarks_list = cb.bookmarks_list
+        cb.bookmark_bar[0]['children'] = []
+        self.assertIs(cb.bookmarks_list, bookmarks_list)
+        cb.invalidate()
+        self.assertEqual(
+            cb.bookmarks_list,
+            list(cb.iter_bookmarks(bookmarks_dict=cb.bookmarks_dict,
+                                   filterfunc=cb.chrome_filterfunc)))
+
+    def test_38_batch_longdates(self):
+        import pbm.utils as utils
+        longdates = [b.get('date_added') for b in
+                     pb.ChromiumBookmarks(self.bookmarks_path).bookmarks_list]
+        longdates.extend([None, '', 1.3e16])
+        use_numpy_values = [False]
+        if utils.numpy is not None:
+            use_numpy_values.append(True)
+        for use_numpy in use_numpy_values:
+            self.assertEqual(
+                utils.longdates_to_ymd(longdates, use_numpy=use_numpy),
+                [None if x in (None, '') else
+                 utils.longdate_to_datetime(x).timetuple()[:3]
+                 for x in longdates])
+            values = utils.longdates_to_datetime64(longdates,
+                                                   use_numpy=use_numpy)
+            self.assertEqual(utils.datetime64_to_longdates(values),
+                             [utils.parse_longdate(x) for x in longdates])
+            for reverse in (False, True):
+                order = utils.argsort_longdates(
+                    longdates, reverse=reverse, use_numpy=use_numpy)
+                self.assertEqual(
+                    order,
+                    sorted(range(len(longdates)),
+                           key=lambda i: utils.parse_longdate(
+                               longdates[i]) or 0,
+                           reverse=reverse))
+
+    def test_39_serialize(self):
+        import pbm.serialize as serialize
+        from pbm.main import ChromiumBookmarks
+        bookmarks_dict = ChromiumBookmarks.read_bookmarks(self.bookmarks_path)
+        for indent, kwargs in ((2, {'indent': 2}),
+                               (None, {'separators': (',', ':')})):
+            self.assertEqual(
+                serialize.dumps(bookmarks_dict, indent=indent,
+                                backend='json'),
+                json.dumps(bookmarks_dict, **kwargs))
+
+        serializer = serialize.BookmarksSerializer(
+            backend='json', chunk_size=64, verify=True)
+        chunks = []
+        stats = serializer.encode(bookmarks_dict, chunks.append)
+        self.assertGreater(len(chunks), 1)
+        output_json = ''.join(chunks)
+        self.assertEqual(json.loads(output_json), bookmarks_dict)
+        counts = serialize.count_nodes(bookmarks_dict)
+        self.assertEqual((stats.urls, stats.folders),
+                         (counts['url'], counts['folder']))
+        self.assertTrue(serialize.verify_json(output_json, stats))
+        self.assertRaises(serialize.SerializationError,
+                          serialize.verify_json,
+                          output_json.replace('"type": "url"',
+                                              '"type": "URL"', 1),
+                          stats)
+        self.assertRaises(serialize.SerializationError,
+                          serialize.verify_json,
+                          output_json.replace('http', 'HTTP', 1),
+                          stats)
+
+    def test_40_checksum(self):
+        import hashlib
+        import pbm.serialize as serialize
+        from pbm.main import ChromiumBookmarks
+        bookmarks_dict = collections.OrderedDict((
+            ('checksum', 'x'),
+            ('roots', collections.OrderedDict((
+                ('other', {'type': 'folder', 'id': '2', 'name': u'O',
+                           'children': []}),
+                ('bookmark_bar', {
+                    'type': 'folder', 'id': '1', 'name': u'B',
+                    'children': [{'type': 'url', 'id': '3', 'name': u'\xe9',
+                                  'url': 'http://e.com/'}]}),
+            ))),
+            ('version', 1),
+        ))
+        md5 = hashlib.md5()
+        for data in (b'1', u'B'.encode('utf-16-le'), b'folder',
+                     b'3', u'\xe9'.encode('utf-16-le'), b'url',
+                     b'http://e.com/',
+                     b'2', u'O'.encode('utf-16-le'), b'folder'):
+            md5.update(data)
+        checksum = md5.hexdigest()
+        self.assertEqual(serialize.compute_checksum(bookmarks_dict), checksum)
+
+        # roots are serialized out of checksum order
+        serializer = serialize.BookmarksSerializer(checksum=True)
+        output_json = serializer.dumps(bookmarks_dict)
+        self.assertEqual(serializer.stats.checksum, checksum)
+        output = json.loads(output_json,
+                            object_pairs_hook=collections.OrderedDict)
+        self.assertEqual(list(output), ['roots', 'version', 'checksum'])
+        self.assertEqual(output['checksum'], checksum)
+
+        bookmarks_dict = ChromiumBookmarks.read_bookmarks(self.bookmarks_path)
+        output_json = ChromiumBookmarks._to_json(bookmarks_dict)
+        path = self.get_tmp_path('test40.bak')
+        with codecs.open(path, 'w', encoding='utf8') as f:
+            f.write(output_json)
+        bookmarks_obj = ChromiumBookmarks(bookmarks_path=path)
+        self.assertEqual(bookmarks_obj.checksum,
+                         serialize.compute_checksum(bookmarks_dict))
+        self.assertTrue(bookmarks_obj.verify_checksum())
+        bookmarks_obj.bookmarks_dict['roots']['other']['name'] += u'!'
+        self.assertFalse(bookmarks_obj.verify_checksum())
+        bookmarks_obj.checksum = None
+        self.assertIsNone(bookmarks_obj.verify_checksum())
+
     def test_41_reorganize_by_date(self):
         from pbm.main import ChromiumBookmarks
         bookmarks_obj = ChromiumBookmarks(bookmarks_path=self.bookmarks_path)
@@ -110,6 +510,155 @@ class TestPromiumbookmarks(unittest.TestCase):
         json_output = json.dumps(bookmarks_obj.bookmarks_dict, indent=2)
         self.assertTrue(json_output)
 
+    def test_42_page_index(self):
+        from pbm.main import ChromiumBookmarks
+        import pbm.pagination as pagination
+        import pbm.utils as utils
+        cb = ChromiumBookmarks(bookmarks_path=self.bookmarks_path)
+        index = cb.get_page_index()
+        self.assertIs(cb.get_page_index(), index)
+        urls = list(cb)
+        self.assertEqual(len(index), len(urls))
+        by_date = [urls[i] for i in utils.argsort_longdates(
+            x.get('date_added') for x in urls)]
+
+        for order, expected in (('tree', urls),
+                                ('date', by_date),
+                                ('-date', by_date[::-1])):
+            pages = []
+            page = index.page(limit=5, order=order)
+            pages.append(page.urls)
+            while page.next_after is not None:
+                page = index.page(limit=5, order=order,
+                                  after=page.next_after)
+                pages.append(page.urls)
+            self.assertEqual(sum(pages, []), expected)
+            self.assertTrue(all(len(x) == 5 for x in pages[:-1]))
+
+        # (the fixture has duplicate ids: e.g. 5123123, as str and int)
+        ids = collections.Counter(str(x.get('id')) for x in urls)
+        self.assertGreater(ids.most_common(1)[0][1], 1)
+        for order, expected in (('tree', urls),
+                                ('date', by_date),
+                                ('-date', by_date[::-1])):
+            for limit in range(1, len(urls) + 1):
+                pages = [index.page(limit=limit, order=order)]
+                while pages[-1].next_after is not None:
+                    self.assertLessEqual(len(pages), len(urls))
+                    pages.append(index.page(
+                        limit=limit, order=order,
+                        after=pages[-1].next_after))
+                self.assertEqual(sum((x.urls for x in pages), []),
+                                 expected, (order, limit))
+        page = index.page(limit=1, order='tree')
+        self.assertEqual(page.next_after, u'%s:0' % urls[0]['id'])
+        for after in ('x:0', '%s:%d' % (urls[0]['id'], len(urls)),
+                      '%s:-1' % urls[0]['id'], '0'):
+            self.assertRaises(KeyError, index.page, after=after)
+        for after in ('x:1:0', '1:x', '1:2:-1'):
+            self.assertRaises(KeyError, index.page, after=after,
+                              order='date')
+
+        # cursors continue across inserts (e.g. a reload)
+        new_url = dict(by_date[-1], id='new',
+                       date_added=str(utils.parse_longdate(
+                           by_date[-1].get('date_added')) + 1))
+        for order, inserted, expected in (
+                ('tree', [new_url] + urls, urls),
+                ('-date', urls + [new_url], by_date[::-1]),
+                ('date', urls + [new_url], by_date + [new_url])):
+            page = index.page(limit=5, order=order)
+            index2 = pagination.PageIndex(inserted)
+            page2 = index2.page(limit=len(urls), order=order,
+                                after=page.next_after)
+            self.assertEqual(page.urls + page2.urls, expected, order)
+        # a date cursor for a removed url restarts at its date
+        page = index.page(limit=5, order='-date')
+        index2 = pagination.PageIndex(
+            [x for x in urls if x is not page.urls[-1]])
+        page2 = index2.page(limit=len(urls), order='-date',
+                            after=page.next_after)
+        self.assertEqual(page.urls[:-1] + page2.urls,
+                         by_date[::-1][:4] + by_date[::-1][5:])
+
+        since = utils.parse_longdate(by_date[-3].get('date_added'))
+        page = index.page(limit=2, order='-date', since=since)
+        self.assertEqual(page.urls, by_date[:-3:-1])
+        page = index.page(limit=2, order='-date', since=since,
+                          after=page.next_after)
+        self.assertTrue(all(
+            utils.parse_longdate(x.get('date_added')) >= since
+            for x in page.urls))
+        page = index.page(limit=10, order='date', since=since)
+        self.assertEqual(page.urls[-1], by_date[-1])
+        self.assertIsNone(page.next_after)
+
+        self.assertRaises(KeyError, index.page, after='x')
+        self.assertRaises(ValueError, index.page, order='x')
+        self.assertRaises(ValueError, index.page, since=since)
+
+        self.assertEqual(pagination.parse_since('13051051921447463'),
+                         13051051921447463)
+        self.assertEqual(pagination.parse_since('1601-01-01'), 0)
+        self.assertEqual(
+            pagination.parse_since('1970-01-01T00:00:00.000001Z'),
+            utils.DATETIME_CONST * 1000000 + 1)
+        self.assertEqual(pagination.parse_since('2014-07-29'),
+                         pagination.parse_since('2014-07-29T00:00:00'))
+        self.assertRaises(ValueError, pagination.parse_since, '07/29/2014')
+
+        cb.invalidate()
+        self.assertIsNot(cb.get_page_index(), index)
+
+    def test_43_lru_cache(self):
+        import pbm.utils as utils
+        calls = []
+
+        def double(x):
+            calls.append(x)
+            return x * 2
+        for lru_cache in set((utils.lru_cache, utils._lru_cache)):
+            cached = lru_cache(maxsize=2)(double)
+            del calls[:]
+            self.assertEqual([cached(x) for x in (1, 2, 1, 3, 2, 1)],
+                             [2, 4, 2, 6, 4, 2])
+            self.assertEqual(calls, [1, 2, 3, 2, 1])
+            info = cached.cache_info()
+            self.assertEqual((info.hits, info.misses, info.currsize),
+                             (1, 5, 2))
+            cached.cache_clear()
+            self.assertEqual(cached.cache_info().currsize, 0)
+
+    def test_44_longdate_isoformats(self):
+        from pbm.main import ChromiumBookmarks
+        import pbm.app
+        import pbm.utils as utils
+        longdates = ['13051051921447463', 13053368494000000, '0', '',
+                     None, 11644473600000001]
+        self.assertEqual(utils.longdates_to_isoformat(longdates), [
+            '2014-07-28T20:12:01.447463Z',
+            '2014-08-24T15:41:34Z',
+            '1601-01-01T00:00:00Z',
+            '',
+            None,
+            '1970-01-01T00:00:00.000001Z'])
+        self.assertEqual(pbm.app.format_longdate('13051051921447463'),
+                         '2014-07-28T20:12:01.447463Z')
+        # (longdate_to_datetime rounds through a float)
+        self.assertEqual(
+            utils.longdates_to_isoformat(['13053368494256041'])[0][:19],
+            utils.longdate_to_datetime(
+                '13053368494256041').isoformat()[:19])
+
+        cb = ChromiumBookmarks(self.bookmarks_path)
+        isoformats = cb.get_longdate_isoformats()
+        self.assertIs(cb.get_longdate_isoformats(), isoformats)
+        for url in cb:
+            self.assertEqual(isoformats[url['date_added']],
+                             pbm.app.format_longdate(url['date_added']))
+        cb.invalidate()
+        self.assertIsNot(cb.get_longdate_isoformats(), isoformats)
+
     def test_51_rewrite_bookmarks(self):
         from pbm.main import ChromiumBookmarks
         bookmarks_dict = ChromiumBookmarks.transform_bookmarks_dict(
@@ -117,10 +666,38 @@ class TestPromiumbookmarks(unittest.TestCase):
         bookmarks_json = ChromiumBookmarks._to_json(bookmarks_dict)
         ChromiumBookmarks.organize_bookmarks_json(
             bookmarks_json,
-            self.bookmarks_path + '.test51.bak',
+            self.get_tmp_path('test51.bak'),
             prompt=False)
-        output_json = json.dumps(bookmarks_dict, indent=2)
+        import pbm.serialize as serialize
+        output_json = json.dumps(
+            serialize.with_checksum(
+                bookmarks_dict, serialize.compute_checksum(bookmarks_dict)),
+            indent=2)
         self.assertTrue(json.loads(output_json), bookmarks_dict)
+        self.assertEqual(bookmarks_json, output_json)
+
+        # stream a dict straight to the file
+        ChromiumBookmarks.organize_bookmarks_json(
+            bookmarks_dict,
+            self.get_tmp_path('test51.bak'),
+            prompt=False,
+            verify=True)
+        # (each folder's subtree digest is saved in the pbm state;
+        # not in its meta_info, which Chromium syncs)
+        import pbm.merkle as merkle
+        bookmark_bar = bookmarks_dict['roots']['bookmark_bar']
+        self.assertNotIn('meta_info', bookmark_bar)
+        self.assertEqual(
+            merkle.load_hexdigests(self.get_tmp_path('test51.bak'))[
+                u'%s' % bookmark_bar['id']],
+            merkle.SubtreeHashes().hexdigest(bookmark_bar))
+        output_json = json.dumps(
+            serialize.with_checksum(
+                bookmarks_dict, serialize.compute_checksum(bookmarks_dict)),
+            indent=2)
+        with codecs.open(self.get_tmp_path('test51.bak'),
+                         encoding='utf8') as f:
+            self.assertEqual(f.read(), output_json)
 
     def test_60_get_option_parser(self):
         from pbm.main import get_option_parser
@@ -197,7 +774,7 @@ class TestPromiumbookmarks(unittest.TestCase):
         output = list(cb)
         self.assertTrue(output)
 
-        output = cb.organize(dest=self.bookmarks_path + '.test97.bak',
+        output = cb.organize(dest=self.get_tmp_path('test97.bak'),
                              prompt=False)
         self.assertTrue(output)
 
@@ -207,11 +784,11 @@ class TestPromiumbookmarks(unittest.TestCase):
         output = list(cb)
         self.assertTrue(output)
 
-        output = cb.organize(dest=self.bookmarks_path + '.test99.bak',
+        output = cb.organize(dest=self.get_tmp_path('test99.bak'),
                              prompt=False)
         self.assertTrue(output)
 
-        cb2 = ChromiumBookmarks(self.bookmarks_path + '.test99.bak')
+        cb2 = ChromiumBookmarks(self.get_tmp_path('test99.bak'))
         cbdict = cb2.bookmarks_dict
         queue_folders = [x for x in cbdict['roots']['bookmark_bar']['children']
                          if x.get('name') == 'queue']
@@ -230,6 +807,273 @@ class TestPromiumbookmarks(unittest.TestCase):
 
         self.assertGreaterEqual(queue['id'], max_id) # , max_node)
 
+class TestFileIO(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'Bookmarks')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, path):
+        with codecs.open(path, encoding='utf8') as f:
+            return f.read()
+
+    def test_10_atomic_write(self):
+        import pbm.fileio as fileio
+        fileio.atomic_write(self.path, lambda f: f.write(u'one \u2603'))
+        self.assertEqual(self.read(self.path), u'one \u2603')
+        inode = os.stat(self.path).st_ino
+
+        backup_path = fileio.get_backup_path(self.path)
+        fileio.atomic_write(self.path, lambda f: f.write(u'two'),
+                            backup_path=backup_path)
+        self.assertEqual(self.read(self.path), u'two')
+        self.assertEqual(self.read(backup_path), u'one \u2603')
+        self.assertEqual(os.stat(backup_path).st_ino, inode)
+        self.assertNotEqual(fileio.get_backup_path(self.path), backup_path)
+
+        def fail(*args):
+            raise ValueError()
+        self.assertRaises(ValueError, fileio.atomic_write,
+                          self.path, fail)
+        self.assertRaises(ValueError, fileio.atomic_write,
+                          self.path, lambda f: f.write(u'three'),
+                          check=fail)
+        self.assertEqual(self.read(self.path), u'two')
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         sorted(['Bookmarks',
+                                 os.path.basename(backup_path)]))
+
+    def test_20_prune_backups(self):
+        import pbm.fileio as fileio
+        now = datetime.datetime(2014, 7, 28, 12, 0, 0)
+        paths = []
+        for n in range(4):
+            path = fileio.get_backup_path(
+                self.path, dt=now - datetime.timedelta(days=n))
+            paths.append(path)
+            open(path, 'w').close()
+        paths.append(fileio.get_backup_path(self.path, dt=now))
+        open(paths[-1], 'w').close()
+        other = fileio.get_backup_path(self.path + '.test', dt=now)
+        open(other, 'w').close()
+
+        self.assertEqual([p for (dt, p) in fileio.list_backups(self.path)],
+                         [paths[4]] + paths[:4])
+        self.assertEqual(fileio.prune_backups(self.path), [])
+        self.assertEqual(
+            fileio.prune_backups(self.path, max_age=datetime.timedelta(
+                days=2, hours=1), now=now),
+            [paths[3]])
+        self.assertEqual(fileio.prune_backups(self.path, keep=2),
+                         paths[1:3])
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         sorted(os.path.basename(p)
+                                for p in (paths[0], paths[4], other)))
+
+
+
+class TempBookmarksTestCase(unittest.TestCase):
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.path = os.path.join(self.tmpdir, 'Bookmarks')
+        shutil.copy('./tests/data/Bookmarks', self.path)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+
+class TestCache(TempBookmarksTestCase):
+
+    def test_00_get_cache_dir(self):
+        import pbm.cache as cache
+        # (see tests/__init__.py)
+        self.assertNotEqual(
+            os.path.dirname(cache.get_cache_dir()),
+            os.path.join(os.path.expanduser('~'), '.cache'))
+        self.assertEqual(
+            cache.get_cache_dir(environ={'XDG_CACHE_HOME': '/x'}),
+            os.path.join('/x', 'pbm'))
+
+    def test_10_load_store(self):
+        import pbm.cache as cache
+        import pbm.store as store
+        self.assertEqual(cache.get_cache_dir({'XDG_CACHE_HOME': '/x'}),
+                         os.path.join('/x', 'pbm'))
+        cache_path = cache.get_cache_path(self.path, cache_dir=self.cache_dir)
+        self.assertIsNone(cache.load(self.path, cache_dir=self.cache_dir))
+
+        expected = store.BookmarkStore.from_path(self.path)
+        bookmark_store = cache.load_store(self.path, cache_dir=self.cache_dir)
+        self.assertTrue(os.path.exists(cache_path))
+        bookmark_store = cache.load(self.path, cache_dir=self.cache_dir)
+        self.assertIsNotNone(bookmark_store)
+        self.assertEqual(bookmark_store.to_bookmarks_dict(),
+                         expected.to_bookmarks_dict())
+        self.assertEqual(list(bookmark_store.iter_urls()),
+                         list(expected.iter_urls()))
+
+        # a changed file is a miss
+        with codecs.open(self.path, 'a', encoding='utf8') as f:
+            f.write(u'\n')
+        self.assertIsNone(cache.load(self.path, cache_dir=self.cache_dir))
+        self.assertTrue(cache.load_store(self.path, cache_dir=self.cache_dir))
+        self.assertIsNotNone(cache.load(self.path, cache_dir=self.cache_dir))
+
+        # an invalid cache file is a miss
+        with open(cache_path, 'wb') as f:
+            f.write(b'\x00')
+        self.assertIsNone(cache.load(self.path, cache_dir=self.cache_dir))
+
+    def test_20_chromiumbookmarks(self):
+        from pbm.main import ChromiumBookmarks
+        expected = ChromiumBookmarks(self.path)
+        for n in range(2):  # miss, hit
+            bookmarks_obj = ChromiumBookmarks(self.path, use_cache=True,
+                                              cache_dir=self.cache_dir)
+            self.assertIsNone(bookmarks_obj._bookmarks_dict)
+            self.assertEqual(list(bookmarks_obj), list(expected))
+            self.assertIsNone(bookmarks_obj._bookmarks_dict)
+            self.assertEqual(bookmarks_obj.bookmarks_list,
+                             expected.bookmarks_list)
+            self.assertEqual(
+                json.loads(json.dumps(bookmarks_obj.bookmarks_dict)),
+                json.loads(json.dumps(
+                    expected.to_bookmark_store().to_bookmarks_dict())))
+            self.assertEqual(bookmarks_obj.checksum, expected.checksum)
+
+    def test_30_main_stream(self):
+        import StringIO
+        import pbm.cache as cache
+        from pbm.main import ChromiumBookmarks, main
+
+        def run(*args):
+            stdout = StringIO.StringIO()
+            self.assertEqual(main(list(args) + [self.path], stdout=stdout),
+                             0)
+            return stdout.getvalue()
+
+        __init__ = ChromiumBookmarks.__init__
+        try:
+            expected = run('--print-all', '--no-cache')
+            # the HTML templates need a ChromiumBookmarks (not a stream)
+            output = run('--print-all', '--print-html-link-list',
+                         '--no-cache')
+            self.assertTrue(output.startswith(expected))
+            self.assertIn('<li ', output)
+
+            def fail(*args, **kwargs):
+                raise AssertionError("ChromiumBookmarks was built")
+            ChromiumBookmarks.__init__ = fail
+            # streamed by default (a cache miss is not written) ...
+            self.assertEqual(run('--print-all'), expected)
+            self.assertIsNone(cache.load(self.path))
+            # ... or read from a current cache
+            cache.load_store(self.path)
+            self.assertIsNotNone(cache.load(self.path))
+            self.assertEqual(run('--print-all'), expected)
+        finally:
+            ChromiumBookmarks.__init__ = __init__
+
+class TestSearch(TempBookmarksTestCase):
+
+    def test_10_tokenize(self):
+        import pbm.search as search
+        self.assertEqual(search.tokenize(u'WRD R&D Documentation'),
+                         [u'wrd', u'r', u'd', u'documentation'])
+        self.assertEqual(
+            search.url_tokens(u'https://www.Example.com/a-b/c?q=x%20y#f'),
+            ([u'www', u'example', u'com'], [u'a', u'b', u'c', u'q', u'x', u'y']))
+        self.assertEqual(search.url_tokens(u'data:text/html,x'),
+                         ([], [u'text', u'html', u'x']))
+
+    def test_20_search(self):
+        import pbm.search as search
+        import pbm.store as store
+        bookmarks_dict = {'roots': {
+            'bookmark_bar': {
+                'type': 'folder', 'id': '1', 'name': u'Bookmarks bar',
+                'children': [
+                    {'type': 'url', 'id': '3', 'name': u'Python docs',
+                     'url': u'https://docs.python.org/2/'},
+                    {'type': 'folder', 'id': '4', 'name': u'python',
+                     'children': [
+                         {'type': 'url', 'id': '5', 'name': u'PyPI',
+                          'url': u'https://pypi.org/project/pbm/'},
+                     ]},
+                ]},
+            'other': {'type': 'folder', 'id': '2', 'name': u'Other',
+                      'children': [
+                          {'type': 'url', 'id': '6', 'name': u'Tornado',
+                           'url': u'http://www.tornadoweb.org/'}]},
+        }}
+        index = search.SearchIndex.from_store(
+            store.BookmarkStore.from_bookmarks_dict(bookmarks_dict))
+        self.assertEqual(len(index), 3)
+
+        results = index.search(u'python')
+        self.assertEqual([x['id'] for x in results], ['3', '5'])
+        self.assertEqual(results[1]['path'], u'Bookmarks bar/python')
+        self.assertGreater(results[0]['score'], results[1]['score'])
+        self.assertEqual(tuple(results[0]), search.RESULT_FIELDS)
+
+        self.assertEqual([x['id'] for x in index.search(u'pyth')],
+                         ['3', '5'])
+        self.assertEqual(index.search(u'pyth', prefix=False), [])
+        self.assertEqual([x['id'] for x in index.search(u'tornado www')],
+                         ['6'])
+        self.assertEqual(index.search(u'python tornado'), [])
+        self.assertEqual(len(index.search(u'py')), 2)
+        self.assertEqual(len(index.search(u'py', limit=1)), 1)
+        self.assertEqual(index.search(u''), [])
+
+    def test_30_get_index(self):
+        import pbm.search as search
+        index_path = search.get_index_path(self.path,
+                                           cache_dir=self.cache_dir)
+        # in the pbm cache dir; not next to the Bookmarks file
+        self.assertEqual(os.path.dirname(index_path), self.cache_dir)
+        self.assertFalse(os.path.exists(index_path))
+        index = search.get_index(self.path, cache_dir=self.cache_dir)
+        self.assertTrue(os.path.exists(index_path))
+        self.assertEqual(os.listdir(self.tmpdir), ['Bookmarks', 'cache'])
+        expected = index.search(u'wrd')
+        self.assertTrue(expected)
+
+        loaded = search.load_index(self.path, cache_dir=self.cache_dir)
+        self.assertIsNotNone(loaded)
+        self.assertEqual(loaded.search(u'wrd'), expected)
+
+        # a changed file is stale
+        with codecs.open(self.path, 'a', encoding='utf8') as f:
+            f.write(u'\n')
+        self.assertIsNone(search.load_index(self.path,
+                                            cache_dir=self.cache_dir))
+        index = search.get_index(self.path, use_cache=True,
+                                 cache_dir=self.cache_dir)
+        self.assertEqual(index.search(u'wrd'), expected)
+        self.assertIsNotNone(search.load_index(self.path,
+                                               cache_dir=self.cache_dir))
+
+    def test_40_main_search(self):
+        from pbm.main import main
+        import StringIO
+        stdout = StringIO.StringIO()
+        self.assertEqual(
+            main(['--search', 'wrd docs', '--no-cache', self.path],
+                 stdout=stdout), 0)
+        self.assertIn(u'http://wrdrd.github.io/docs/', stdout.getvalue())
+        self.assertEqual(os.listdir(self.tmpdir), ['Bookmarks'])
+
 #   class Test0PluginManager(unittest.TestCase):
 #       def test_00_get_plugins(self):
 #           from pbm.main import PluginManager
@@ -248,6 +1092,361 @@ class TestPromiumbookmarks(unittest.TestCase):
 import os
 import pbm.plugins as plugins
 
+class TestProfiles(TempBookmarksTestCase):
+
+    def setUp(self):
+        super(TestProfiles, self).setUp()
+        import shutil
+        self.paths = []
+        for name in ('Default', 'Profile 1'):
+            path = os.path.join(self.tmpdir, name, 'Bookmarks')
+            os.makedirs(os.path.dirname(path))
+            shutil.copy(self.path, path)
+            self.paths.append(path)
+        self.broken_path = os.path.join(self.tmpdir, 'Profile 2',
+                                        'Bookmarks')
+        os.makedirs(os.path.dirname(self.broken_path))
+        with open(self.broken_path, 'w') as f:
+            f.write('{"roots": ')
+
+    def test_10_process_profiles(self):
+        import pbm.profiles as profiles
+        from pbm.main import list_profile_bookmarks
+        paths = sorted(list_profile_bookmarks(self.tmpdir))
+        self.assertEqual(paths, self.paths + [self.broken_path])
+        for processes in (1, 2):
+            results = profiles.process_profiles(
+                paths, processes=processes, cache_dir=self.cache_dir)
+            self.assertEqual([x.path for x in results], paths)
+            self.assertEqual([x.ok for x in results], [True, True, False])
+            self.assertTrue(results[0].url_count)
+            self.assertEqual(results[0], results[1]._replace(
+                path=results[0].path, elapsed=results[0].elapsed))
+            self.assertFalse(results[0].organized)
+            self.assertTrue(results[2].error)
+        report = list(profiles.format_report(results))
+        self.assertEqual(len(report), 4)
+        self.assertEqual(report[-1], '# 3 profiles, 1 errors')
+
+        with open(self.paths[0]) as f:
+            before = f.read()
+        results = profiles.process_profiles(self.paths, processes=2,
+                                            organize=True)
+        self.assertTrue(all(x.ok and x.organized for x in results))
+        with open(self.paths[0]) as f:
+            self.assertNotEqual(f.read(), before)
+
+    def test_20_main_all_profiles(self):
+        from pbm.main import main
+        import StringIO
+        stdout = StringIO.StringIO()
+        self.assertEqual(
+            main(['--all-profiles', '-j', '2', '--no-cache'] + self.paths,
+                 stdout=stdout), 0)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('ok\t' + self.paths[0]))
+        stdout = StringIO.StringIO()
+        self.assertEqual(
+            main(['--all-profiles', '-j', '1', '--no-cache',
+                  self.broken_path], stdout=stdout), 1)
+        self.assertTrue(stdout.getvalue().startswith('error\t'))
+
+
+class TestMerge(TempBookmarksTestCase):
+
+    def setUp(self):
+        super(TestMerge, self).setUp()
+        with open(self.path) as f:
+            bookmarks_dict = json.load(
+                f, object_pairs_hook=collections.OrderedDict)
+        bookmarks_dict['roots']['other']['children'].append(
+            collections.OrderedDict((
+                ('date_added', '13000000000000000'),
+                ('id', '9999'),
+                ('name', 'new'),
+                ('type', 'url'),
+                ('url', 'https://example.org/new'))))
+        self.path2 = os.path.join(self.tmpdir, 'Bookmarks.2')
+        with open(self.path2, 'w') as f:
+            json.dump(bookmarks_dict, f, indent=2)
+        self.output_path = os.path.join(self.tmpdir, 'Merged')
+
+    def test_10_iter_sorted_urls(self):
+        import pbm.merge as merge
+        from pbm.main import ChromiumBookmarks
+        expected = list(ChromiumBookmarks.stream_bookmarks(
+            self.path, roots=merge.MERGE_ROOTS))
+        for run_size in (3, 1000):
+            stats = collections.Counter()
+            items = list(merge.iter_sorted_urls(
+                self.path, run_size=run_size, tmpdir=self.tmpdir,
+                stats=stats))
+            self.assertEqual(sorted(x[2]['id'] for x in items),
+                             sorted(x['id'] for x in expected))
+            self.assertEqual([x[:2] for x in items], sorted(
+                x[:2] for x in items))
+            self.assertEqual(stats['run'],
+                             1 if run_size > len(expected) else
+                             -(-len(expected) // run_size))
+
+    def test_20_merge_bookmarks(self):
+        import re
+        import pbm.merge as merge
+        from pbm.main import ChromiumBookmarks
+        from pbm.plugins.dedupe import get_dedupe_keyfunc
+        urls = list(ChromiumBookmarks.stream_bookmarks(
+            self.path, roots=merge.MERGE_ROOTS))
+        keyfunc = get_dedupe_keyfunc('url')
+        unique = len(set(keyfunc(x) for x in urls)) + 1
+
+        outputs = []
+        for run_size in (2, merge.DEFAULT_RUN_SIZE):
+            stats = merge.merge_bookmarks(
+                [self.path, self.path2], self.output_path, key='url',
+                run_size=run_size, tmpdir=self.tmpdir, backup=False)
+            self.assertEqual(stats.inputs, 2)
+            self.assertEqual(stats.urls, 2 * len(urls) + 1)
+            self.assertEqual(stats.written, unique)
+            self.assertEqual(stats.duplicates, stats.urls - unique)
+            with open(self.output_path) as f:
+                outputs.append(f.read())
+            cb = ChromiumBookmarks(self.output_path)
+            self.assertEqual(cb.checksum, stats.checksum)
+            self.assertTrue(cb.verify_checksum())
+            merged = list(cb)
+            self.assertEqual(len(merged), unique)
+            self.assertEqual(merged[0]['url'], 'https://example.org/new')
+            dates = [int(x['date_added']) for x in merged]
+            self.assertEqual(dates, sorted(dates))
+            self.assertEqual(len(set(x['id'] for x in merged)), unique)
+        self.assertEqual(len(set(
+            re.sub(r'"date_added": "\d+"', '', x) for x in outputs)), 1)
+
+    def test_30_main_merge(self):
+        from pbm.main import main
+        import StringIO
+        stdout = StringIO.StringIO()
+        self.assertEqual(
+            main(['--merge', self.output_path, '--dedupe-key', 'url',
+                  self.path, self.path2], stdout=stdout), 0)
+        self.assertIn('# merged', stdout.getvalue())
+        self.assertTrue(os.path.exists(self.output_path))
+
+
+class TestDiff(TempBookmarksTestCase):
+
+    def setUp(self):
+        super(TestDiff, self).setUp()
+        with open(self.path) as f:
+            self.old_dict = json.load(
+                f, object_pairs_hook=collections.OrderedDict)
+        with open(self.path) as f:
+            self.new_dict = json.load(
+                f, object_pairs_hook=collections.OrderedDict)
+        roots = self.new_dict['roots']
+        bookmark_bar = roots['bookmark_bar']['children']
+        folders = dict((x['name'], x) for x in bookmark_bar)
+        folders['bookmarklets']['children'][0]['name'] = 'notetab'
+        chrome = folders['chrome']['children']
+        folders['starred']['children'].append(chrome.pop(0))
+        chrome.pop()
+        roots['other']['children'].append(folders['2014']['children'].pop(1))
+        roots['other']['children'].append(collections.OrderedDict((
+            ('date_added', '13000000000000000'),
+            ('id', '9999'),
+            ('name', 'new'),
+            ('type', 'url'),
+            ('url', 'https://example.org/new'))))
+        self.path2 = os.path.join(self.tmpdir, 'Bookmarks.2')
+        with open(self.path2, 'w') as f:
+            json.dump(self.new_dict, f, indent=2)
+
+    def test_10_compute_hashes(self):
+        import pbm.merkle as merkle
+        root = self.old_dict['roots']['bookmark_bar']
+        hashes = merkle.compute_hashes(root)
+
+        def count(node):
+            return 1 + sum(count(x) for x in node.get('children', ()))
+        self.assertEqual(len(hashes), count(root))
+        queues = [x for x in root['children'] if x['name'] == 'queue']
+        self.assertEqual(hashes[id(queues[0])], hashes[id(queues[1])])
+        copy = json.loads(json.dumps(root))
+        copy['id'] = '0'
+        copy['children'][0]['date_modified'] = '1'
+        self.assertEqual(merkle.compute_hashes(copy)[id(copy)],
+                         hashes[id(root)])
+        copy['children'][0]['name'] = 'changed'
+        self.assertNotEqual(merkle.compute_hashes(copy)[id(copy)],
+                            hashes[id(root)])
+        self.assertEqual(len(merkle.hexdigest(hashes[id(root)])), 40)
+
+    def test_20_diff_bookmarks(self):
+        import pbm.diff as diff
+        self.assertEqual(diff.diff_bookmarks(self.old_dict, self.old_dict),
+                         [])
+        changes = diff.diff_bookmarks(self.old_dict, self.new_dict)
+        self.assertEqual(
+            sorted(collections.Counter(x.kind for x in changes).items()),
+            [('added', 1), ('moved', 2), ('removed', 1), ('renamed', 1)])
+        by_kind = dict(((x.kind, x.type), x) for x in changes)
+        folder = by_kind[('moved', 'folder')]
+        self.assertEqual(folder.name, '2014-9')
+        self.assertEqual(folder.old_path, ('bookmark_bar', '2014'))
+        self.assertEqual(folder.path, ('other',))
+        moved = by_kind[('moved', 'url')]
+        self.assertEqual(moved.url, 'chrome://bookmarks')
+        self.assertEqual(moved.old_path, ('bookmark_bar', 'chrome'))
+        self.assertEqual(moved.path, ('bookmark_bar', 'starred'))
+        renamed = by_kind[('renamed', 'url')]
+        self.assertEqual((renamed.old_name, renamed.name),
+                         ('notetab (400px)', 'notetab'))
+        self.assertEqual(by_kind[('removed', 'url')].url,
+                         'chrome://chrome-urls')
+        self.assertEqual(by_kind[('added', 'url')].path, ('other',))
+
+    def test_30_main_diff(self):
+        from pbm.main import main
+        import StringIO
+        stdout = StringIO.StringIO()
+        self.assertEqual(main(['--diff', self.path, self.path2],
+                              stdout=stdout), 0)
+        lines = stdout.getvalue().splitlines()
+        self.assertIn(u'+ https://example.org/new\tother\tu\'new\'', lines)
+        self.assertEqual(
+            lines[-1], '# 1 added, 1 removed, 2 moved, 1 renamed, 0 changed')
+        stdout = StringIO.StringIO()
+        self.assertEqual(main(['--diff-json', self.path, self.path2],
+                              stdout=stdout), 0)
+        output = json.loads(stdout.getvalue())
+        self.assertEqual(output['counts']['moved'], 2)
+        self.assertEqual(len(output['changes']), 5)
+
+
+class TestSubtreeHashes(TempBookmarksTestCase):
+
+    def test_10_save_hexdigests(self):
+        import pbm.cache as cache
+        import pbm.merkle as merkle
+        import pbm.serialize as serialize
+        cb = pb.ChromiumBookmarks(self.path, cache_dir=self.cache_dir)
+        bookmarks_dict = cb.bookmarks_dict
+        bookmark_bar = bookmarks_dict['roots']['bookmark_bar']
+        hashes = cb.get_subtree_hashes()
+        self.assertIs(cb.get_subtree_hashes(), hashes)
+        self.assertTrue(hashes.changed(bookmark_bar))
+        with open(os.devnull, 'w') as f:
+            stats = serialize.dump(bookmarks_dict, f,
+                                   checksum=True, merkle=True)
+        self.assertEqual(stats.merkle[u'%s' % bookmark_bar['id']],
+                         hashes.hexdigest(bookmark_bar))
+        self.assertNotIn('meta_info', bookmark_bar)
+        self.assertTrue(merkle.save_hexdigests(self.path, stats.merkle,
+                                               cache_dir=self.cache_dir))
+        self.assertEqual(
+            cache.load_state(self.path, cache_dir=self.cache_dir)['key'],
+            list(cache.get_file_key(self.path)))
+        cb.invalidate()
+        hashes = cb.get_subtree_hashes()
+        folders = [x for x in bookmark_bar['children']
+                   if x['type'] == 'folder']
+        self.assertFalse(hashes.changed(bookmark_bar))
+        self.assertFalse(any(hashes.changed(x) for x in folders))
+
+        chrome = [x for x in folders if x['name'] == 'chrome'][0]
+        chrome['children'][0]['name'] = 'renamed'
+        cb.invalidate()
+        hashes = cb.get_subtree_hashes()
+        self.assertTrue(hashes.changed(bookmark_bar))
+        self.assertEqual([x['name'] for x in folders if hashes.changed(x)],
+                         ['chrome'])
+
+    def test_20_datefolders_skip_unchanged(self):
+        import pbm.merkle as merkle
+        from pbm.plugins.datefolders import DateBasedFoldersPlugin
+        cb = pb.ChromiumBookmarks(self.path, cache_dir=self.cache_dir)
+        cb.organize(prompt=False)
+        cb = pb.ChromiumBookmarks(self.path, cache_dir=self.cache_dir)
+        bookmark_bar = cb.bookmarks_dict['roots']['bookmark_bar']
+        year_folder = [x for x in bookmark_bar['children']
+                       if x['name'] == '2014'][0]
+        self.assertNotIn('meta_info', year_folder)
+        self.assertTrue(merkle.load_hexdigests(
+            self.path, cache_dir=self.cache_dir)[u'%s' % year_folder['id']])
+        self.assertFalse(
+            DateBasedFoldersPlugin.subtree_changed(cb, year_folder))
+        urls = len(list(cb))
+        cb.bookmarks_dict['roots']['other']['children'].append(
+            collections.OrderedDict((
+                ('date_added', '13049999999000000'),
+                ('id', '9999'),
+                ('name', 'new'),
+                ('type', 'url'),
+                ('url', 'https://example.org/new'))))
+        cb.invalidate()
+
+        # skipping is opt-in (a plain rebuild does not skip)
+        plugin = DateBasedFoldersPlugin()
+        plugins.PluginSequence.visit(cb, [plugin])
+        self.assertEqual(plugin.unchanged, {})
+        plugin = DateBasedFoldersPlugin(
+            conf={'datefolders_skip_unchanged': True})
+        plugins.PluginSequence.visit(cb, [plugin])
+        self.assertEqual(list(plugin.unchanged), [(2014,)])
+        plugin.finish(cb)
+        self.assertEqual(plugin.stats['unchanged'], 1)
+        self.assertEqual(plugin.stats['filed'], 1)
+        year_folder = [x for x in bookmark_bar['children']
+                       if x['name'] == '2014'][0]
+        self.assertIn('https://example.org/new', [
+            x['url'] for x in pb.ChromiumBookmarks.walk_bookmarks(
+                year_folder)])
+        self.assertTrue(
+            DateBasedFoldersPlugin.subtree_changed(cb, year_folder))
+        self.assertEqual(len(list(cb)), urls + 2)
+
+        # the same folders as a full rebuild
+        def year_urls(bookmarks_obj):
+            bookmark_bar = bookmarks_obj.bookmarks_dict['roots'][
+                'bookmark_bar']
+            return sorted(
+                (x['name'], b['url'])
+                for x in bookmark_bar['children'] if x['name'] == '2014'
+                for b in pb.ChromiumBookmarks.walk_bookmarks(x))
+        cb2 = pb.ChromiumBookmarks(self.path)
+        cb2.bookmarks_dict['roots']['other']['children'].append(
+            dict(cb.bookmarks_dict['roots']['other']['children'][-1]))
+        cb2.invalidate()
+        plugin = DateBasedFoldersPlugin(
+            conf={'datefolders_skip_unchanged': False})
+        plugins.PluginSequence.visit(cb2, [plugin])
+        self.assertEqual(plugin.unchanged, {})
+        plugin.finish(cb2)
+        self.assertEqual(set(year_urls(cb)), set(year_urls(cb2)))
+
+    def test_30_organize_incremental_state(self):
+        from pbm.plugins.datefolders import (DateBasedFoldersPlugin,
+                                             WATERMARK_KEY)
+        conf = {'datefolders_incremental': True}
+        self.assertTrue(DateBasedFoldersPlugin(conf=conf).skip_unchanged)
+        self.assertFalse(DateBasedFoldersPlugin().skip_unchanged)
+        cb = pb.ChromiumBookmarks(self.path, conf=conf,
+                                  cache_dir=self.cache_dir)
+        self.assertIsNone(cb.get_state(WATERMARK_KEY))
+        cb.organize(prompt=False)
+        watermark = cb.get_state(WATERMARK_KEY)
+        self.assertTrue(watermark)
+
+        # the watermark is saved in the pbm state; not in the file
+        with open(self.path) as f:
+            self.assertNotIn('pbm_', f.read())
+        cb = pb.ChromiumBookmarks(self.path, conf=conf,
+                                  cache_dir=self.cache_dir)
+        self.assertEqual(cb.pending_state, {})
+        self.assertEqual(cb.get_state(WATERMARK_KEY), watermark)
+
+
 class PluginTestCase(unittest.TestCase):
 
     bookmarks_path = os.path.join('tests', 'data', 'Bookmarks')
@@ -330,6 +1529,106 @@ class TestDateBasedFoldersPlugin(PluginTestCase):
         self.bookmarks_obj = self.pluginseq.run(self.bookmarks_obj)
         self.assertIn('2014', self.get_bookmark_bar_foldernames())
 
+    def run_incremental(self, fused=True):
+        pluginseq = plugins.PluginSequence(
+            pluginstrs=self.pluginstrs,
+            conf={'datefolders_incremental': True},
+            fused=fused)
+        self.bookmarks_obj = pluginseq.run(
+            self.bookmarks_obj, pluginstrs=self.pluginstrs)
+        return pluginseq
+
+    def get_datefolder_urls(self):
+        from pbm.plugins.datefolders import datefolder_key
+        urls = []
+        for folder in self.get_bookmark_bar_nodes():
+            if datefolder_key(folder.get('name')):
+                urls.extend(
+                    (day.get('name'), x.get('url'), x.get('date_added'))
+                    for month in folder['children']
+                    for day in month['children']
+                    for x in day['children'])
+        return urls
+
+    @staticmethod
+    def get_ymd_name(longdate):
+        return '-'.join(
+            str(x) for x in pbm.utils.longdates_to_ymd([longdate])[0])
+
+    def test_30_incremental(self):
+        from pbm.plugins.datefolders import WATERMARK_KEY
+        # the first run is a full rebuild, which sets the watermark
+        # (in the pbm state; not in the synced meta_info)
+        self.run_incremental()
+        bookmark_bar = self.bookmarks_obj.bookmark_bar
+        self.assertIn('2014', self.get_bookmark_bar_foldernames())
+        self.assertNotIn('meta_info',
+                         self.bookmarks_obj.bookmarks_dict['roots']
+                         ['bookmark_bar'])
+        watermark = self.bookmarks_obj.get_state(WATERMARK_KEY)
+        filed = self.get_datefolder_urls()
+        self.assertEqual(
+            watermark,
+            max(int(x[2]) for x in filed))
+
+        year_2014 = [x for x in bookmark_bar if x.get('name') == '2014'][0]
+        year_2014_children = list(year_2014['children'])
+        new_date = str(watermark + 10**6)
+        old_date = str(int(pbm.utils.datetime_to_longdate(
+            datetime.datetime(2014, 7, 28, 12))))
+        bookmark_bar.append({
+            'type': 'folder', 'name': 'new', 'id': self.bookmarks_obj.ids.next(),
+            'children': [
+                {'type': 'url', 'name': 'new', 'url': 'http://example.org/new',
+                 'id': self.bookmarks_obj.ids.next(),
+                 'date_added': new_date},
+                {'type': 'url', 'name': 'old', 'url': 'http://example.org/old',
+                 'id': self.bookmarks_obj.ids.next(),
+                 'date_added': old_date}]})
+        self.bookmarks_obj.invalidate()
+
+        for fused in (True, False):
+            self.run_incremental(fused=fused)
+            filed_2 = self.get_datefolder_urls()
+            self.assertEqual(
+                collections.Counter(filed_2) - collections.Counter(filed),
+                collections.Counter([
+                    ('2014-7-28', 'http://example.org/old', old_date),
+                    (self.get_ymd_name(new_date),
+                     'http://example.org/new', new_date)]))
+            # existing folders are not rebuilt
+            self.assertIs(
+                [x for x in self.bookmarks_obj.bookmark_bar
+                 if x.get('name') == '2014'][0],
+                year_2014)
+            self.assertEqual(year_2014['children'][:len(year_2014_children)],
+                             year_2014_children)
+            self.assertEqual(
+                self.bookmarks_obj.get_state(WATERMARK_KEY),
+                int(new_date))
+            # day folders stay sorted by date_added
+            days = collections.OrderedDict()
+            for day, url, date_added in filed_2:
+                days.setdefault(day, []).append(int(date_added))
+            for day, dates in days.items():
+                self.assertEqual(dates, sorted(dates), day)
+
+    def test_31_file_bookmarks(self):
+        from pbm.plugins.datefolders import DateBasedFoldersPlugin
+        self.run_incremental()
+        bookmarks_list = [
+            {'type': 'url', 'name': 'x', 'url': 'http://example.org/x',
+             'date_added': str(int(pbm.utils.datetime_to_longdate(
+                 datetime.datetime(2001, 2, 3))))}]
+        stats = DateBasedFoldersPlugin.file_bookmarks(
+            self.bookmarks_obj, bookmarks_list)
+        self.assertEqual(stats, collections.Counter(filed=1, folders=3))
+        names = self.get_bookmark_bar_foldernames()
+        self.assertLess(names.index('2001'), names.index('2014'))
+        stats = DateBasedFoldersPlugin.file_bookmarks(
+            self.bookmarks_obj, bookmarks_list)
+        self.assertEqual(stats, collections.Counter(existing=1))
+
 
 class TestBookmarkletsFolderPlugin(PluginTestCase):
     pluginstrs = ['bookmarkletsfolder']
@@ -367,6 +1666,76 @@ class TestStarredFolderPlugin(PluginTestCase):
         self.assertTrue(starred.get('children',[]))
 
 
+class TestDedupePlugin(PluginTestCase):
+    pluginstrs = ['dedupe']
+
+    @staticmethod
+    def url_node(url, name='x', date_added='1'):
+        return {'type': 'url', 'url': url, 'name': name,
+                'date_added': date_added}
+
+    def build_bookmarks_dict(self, children):
+        return {'roots': {
+            'bookmark_bar': {'type': 'folder', 'children': children},
+            'other': {'type': 'folder', 'children': []}}}
+
+    def test_20_adjacent_duplicates(self):
+        from pbm.plugins.dedupe import DedupePlugin
+        children = [self.url_node('http://a')] * 3 + [
+            self.url_node('http://b'),
+            {'type': 'folder', 'children': [self.url_node('http://b')]}]
+        bookmarks_dict = self.build_bookmarks_dict(children)
+        dedupe_obj = DedupePlugin.walk_and_dedupe_bookmarks(
+            bookmarks_dict['roots']['bookmark_bar'])
+        self.assertIs(bookmarks_dict['roots']['bookmark_bar']['children'],
+                      children)
+        self.assertEqual([x.get('url') for x in children],
+                         ['http://a', 'http://b', None])
+        self.assertEqual(children[-1]['children'], [])
+        self.assertEqual(dedupe_obj.stats,
+                         collections.Counter(url=5, duplicate=3))
+
+    def test_30_dedupe_keys(self):
+        from pbm.plugins.dedupe import DedupePlugin, DedupeObj
+        nodes = [
+            self.url_node('http://a', date_added='1'),
+            self.url_node('http://a', date_added='2'),
+            self.url_node('HTTP://A:80', name='y'),
+            self.url_node('http://a/', name='y'),
+        ]
+        expected = {
+            'url_date': 4,
+            'url': 3,
+            'normalized_url': 1,
+            'name_url': 3,
+        }
+        for key, count in expected.items():
+            children = list(nodes)
+            DedupePlugin.walk_and_dedupe_bookmarks(
+                self.build_bookmarks_dict(children)['roots']['bookmark_bar'],
+                dedupe_obj=DedupeObj(key=key))
+            self.assertEqual(len(children), count, key)
+        self.assertRaises(ValueError, DedupeObj, key='nope')
+
+    def test_31_normalize_url(self):
+        from pbm.plugins.dedupe import normalize_url
+        self.assertEqual(normalize_url('HTTPS://Example.COM:443'),
+                         'https://example.com/')
+        self.assertEqual(normalize_url('http://u@Example.com:8080/A?b#C'),
+                         'http://u@example.com:8080/A?b#C')
+        self.assertEqual(normalize_url('javascript:void(0)'),
+                         'javascript:void(0)')
+
+    def test_40_conf_dedupe_key(self):
+        self.pluginseq.conf['dedupe_key'] = 'url'
+        urls = [b['url'] for b in self.bookmarks_obj.bookmarks_list]
+        self.bookmarks_obj = self.pluginseq.run(
+            self.bookmarks_obj, pluginstrs=self.pluginstrs)
+        self.assertEqual(
+            sorted(b['url'] for b in self.bookmarks_obj.bookmarks_list),
+            sorted(set(urls)))
+
+
 class TestAll(PluginTestCase):
     pluginstrs = pb.plugins.PluginSequence.DEFAULT_PLUGINS
 
@@ -391,6 +1760,60 @@ class TestAll(PluginTestCase):
         for id_, nodes in by_id.items():
             self.assertEqual(len(nodes), 1, (len(nodes), nodes))
 
+    def test_30_bookmarks_list_after_run(self):
+        self.assertTrue(self.bookmarks_obj.bookmarks_list)
+        self.bookmarks_obj = self.pluginseq.run(self.bookmarks_obj)
+        self.assertEqual(
+            self.bookmarks_obj.bookmarks_list,
+            list(self.bookmarks_obj.iter_bookmarks(
+                bookmarks_dict=self.bookmarks_obj.bookmarks_dict,
+                filterfunc=self.bookmarks_obj.chrome_filterfunc)))
+
+    @staticmethod
+    def tree_shape(node):
+        if node.get('type') == 'folder':
+            return (node.get('name'),
+                    [TestAll.tree_shape(x) for x in node.get('children', [])])
+        return (node.get('name'), node.get('url'))
+
+    def test_40_fused_single_walk(self):
+        self.bookmarks_obj = self.pluginseq.run(self.bookmarks_obj)
+        self.assertEqual(
+            dict(self.pluginseq.walks),
+            {'process_bookmarks': 1, 'postprocess_bookmarks': 1})
+        self.assertEqual(list(self.pluginseq.timings),
+                         plugins.PluginSequence.PLUGIN_FUNCS)
+        self.assertTrue(all(x >= 0 for x in self.pluginseq.timings.values()))
+
+    def test_41_fused_equivalent(self):
+        bookmarks_obj_2 = pb.ChromiumBookmarks(
+            bookmarks_path=self.bookmarks_path)
+        unfused = plugins.PluginSequence(
+            pluginstrs=self.pluginstrs, fused=False)
+        bookmarks_obj_2 = unfused.run(bookmarks_obj_2)
+        self.assertFalse(unfused.walks)
+        self.bookmarks_obj = self.pluginseq.run(self.bookmarks_obj)
+        roots, roots_2 = (self.bookmarks_obj.bookmarks_dict['roots'],
+                          bookmarks_obj_2.bookmarks_dict['roots'])
+        for key in ('bookmark_bar', 'other'):
+            self.assertEqual(self.tree_shape(roots[key]),
+                             self.tree_shape(roots_2[key]))
+
+    def test_42_visit(self):
+        class CountingPlugin(plugins.PromiumPlugin):
+            def __init__(self, conf=None):
+                super(CountingPlugin, self).__init__(conf=conf)
+                self.urls = []
+
+            def visit_url(self, node, path):
+                self.urls.append(node.get('url'))
+
+        visitor = CountingPlugin()
+        plugins.PluginSequence.visit(self.bookmarks_obj, [visitor])
+        self.assertEqual(
+            visitor.urls,
+            [b['url'] for b in self.bookmarks_obj.bookmarks_list])
+
 
 if __name__ == '__main__':
     import sys